@@ -1,9 +1,18 @@
-import requests
-import json
-import subprocess
-import platform
-import re
+import logging
+import os
+import random
+import socket
+import struct
 import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import fcntl
+except ImportError:  # Windows - adres ustalany tylko na podstawie trasy do serwera
+    fcntl = None
 
 
 # --- Konfiguracja ---
@@ -11,160 +20,322 @@ import time
 API_BASE_URL = "http://192.168.0.107:5000/api/"
 
 # Częstotliwość raportowania adresu IP (w sekundach)
-REPORT_INTERVAL = 30  # Raportowanie co 30 sekund dla lepszej aktualizacji statusu
+REPORT_INTERVAL = 30  # Raportowanie co 30 sekund dla lepszej aktualizacji statusu (serwer może zalecić inny odstęp)
+REPORT_JITTER = 0.2  # losowe przesunięcie każdego odstępu (±20%), żeby kioski nie zgłaszały się równocześnie
+STARTUP_SPREAD = 15  # pierwszy raport po starcie w losowej chwili z tylu sekund (np. po zaniku zasilania całej sieci)
+IP_CHECK_INTERVAL = 10  # co ile sekund sprawdzać lokalnie zmianę adresu IP (bez ruchu sieciowego)
+RETRY_BASE_DELAY = 5  # opóźnienie ponowienia po błędzie, podwajane przy kolejnych błędach
+RETRY_MAX_DELAY = 300
+
+# Bufor próbek zbieranych, gdy serwer jest niedostępny (wysyłane zbiorczo po odzyskaniu połączenia)
+BUFFER_PATH = os.getenv("IPDOAPI_BUFFER_PATH", "/var/lib/ipdoapi/heartbeats.buf")
+BUFFER_CAPACITY = 2880  # liczba próbek (doba przy raportach co 30 s); najstarsze są nadpisywane
+
+# Poziom logowania (DEBUG pokazuje każdy raport; domyślnie tylko zmiany i błędy)
+LOG_LEVEL = os.getenv("IPDOAPI_LOG_LEVEL", "INFO").upper()
+
+# Limity czasu żądania: (nawiązanie połączenia, odpowiedź) w sekundach
+REQUEST_TIMEOUT = (5, 10)
+
+SIOCGIFADDR = 0x8915  # ioctl Linuksa: adres IPv4 interfejsu
+
+log = logging.getLogger("ipdoapi")
+
+_device_serial = None
+
 
 def get_device_serial():
     """
-    Pobiera numer seryjny urządzenia.
-    Specyficzne dla Raspberry Pi, dla innych systemów może zwrócić None.
-    """
-    system = platform.system().lower()
-    if system == "linux":
-        try:
-            # Próba odczytania numeru seryjnego z /proc/cpuinfo (typowe dla Raspberry Pi)
-            process = subprocess.Popen(
-                "cat /proc/cpuinfo | grep Serial | cut -d ' ' -f 2",
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            stdout, stderr = process.communicate(timeout=5)
-            if process.returncode == 0 and stdout.strip():
-                return stdout.strip()
-            else:
-                print(f"Nie udało się pobrać numeru seryjnego z /proc/cpuinfo. Błąd: {stderr.strip()}")
-        except subprocess.TimeoutExpired:
-            print("Timeout podczas próby pobrania numeru seryjnego.")
-        except Exception as e:
-            print(f"Wystąpił błąd podczas próby pobrania numeru seryjnego: {e}")
-    else:
-        print(f"Automatyczne pobieranie numeru seryjnego nie jest wspierane dla systemu: {system}")
+    Pobiera numer seryjny urządzenia (Raspberry Pi) bezpośrednio z /proc/cpuinfo,
+    a gdy go tam nie ma - z drzewa urządzeń. Wynik jest zapamiętywany na czas działania procesu.
+    """
+    global _device_serial
+    if _device_serial:
+        return _device_serial
+    try:
+        with open("/proc/cpuinfo", encoding="ascii", errors="replace") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key.strip() == "Serial" and value.strip():
+                    _device_serial = value.strip()
+                    return _device_serial
+    except OSError as e:
+        log.debug("Nie można odczytać /proc/cpuinfo: %s", e)
+    try:
+        with open("/sys/firmware/devicetree/base/serial-number", "rb") as f:
+            serial = f.read().rstrip(b"\x00\n").decode("ascii", errors="replace").strip()
+            if serial:
+                _device_serial = serial
+                return _device_serial
+    except OSError as e:
+        log.debug("Nie można odczytać numeru seryjnego z drzewa urządzeń: %s", e)
+    log.error("Nie udało się pobrać numeru seryjnego urządzenia")
     return None
 
-def get_ip_address():
+
+class SampleRing:
     """
-    Pobiera główny (pierwszy znaleziony) adres IP urządzenia.
+    Bufor pierścieniowy próbek heartbeatu w pliku o stałym rozmiarze: nagłówek (pozycja najstarszej
+    próbki, liczba próbek) i sloty po 4 bajty z czasem epoch. Każda próbka to zapis kilku bajtów w miejscu,
+    bez przepisywania pliku, więc przerwa w działaniu serwera nie zużywa karty SD.
     """
-    system = platform.system().lower()
-    ip_address = None
-    try:
-        if system == "linux":
-            # Użyj 'hostname -I' aby uzyskać listę adresów IP, weź pierwszy
-            process = subprocess.Popen(
-                "hostname -I",
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            stdout, stderr = process.communicate(timeout=5)
-            if process.returncode == 0 and stdout.strip():
-                ip_address = stdout.strip().split(' ')[0]
-            else:
-                print(f"Nie udało się pobrać adresu IP za pomocą 'hostname -I'. Błąd: {stderr.strip()}")
-
-        elif system == "windows":
-            # Użyj 'ipconfig' i sparsuj wynik
-            process = subprocess.Popen(
-                "ipconfig",
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW
-            )
-            stdout, stderr = process.communicate(timeout=10)
-            if process.returncode == 0:
-                # Szukaj linii z adresem IPv4
-                # To wyrażenie regularne może wymagać dostosowania w zależności od języka systemu Windows
-                match = re.search(r"IPv4 Address[.\s]*:\s*(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})", stdout, re.IGNORECASE)
-                if not match: # Spróbuj polskiej wersji
-                    match = re.search(r"Adres IPv4[.\s]*:\s*(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})", stdout, re.IGNORECASE)
-                
-                if match:
-                    ip_address = match.group(1)
-                else:
-                    print("Nie znaleziono adresu IPv4 w wyniku polecenia 'ipconfig'.")
-            else:
-                print(f"Nie udało się pobrać adresu IP za pomocą 'ipconfig'. Błąd: {stderr.strip()}")
+    HEADER = struct.Struct("<4sII")
+    RECORD = struct.Struct("<I")
+    MAGIC = b"HBR1"
+
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self._file = None
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        self._open()
+        return self._count
+
+    def _open(self):
+        if self._file is not None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        f = open(self.path, "r+b" if os.path.exists(self.path) else "w+b")
+        size = self.HEADER.size + self.capacity * self.RECORD.size
+        header = f.read(self.HEADER.size)
+        self._file = f
+        if len(header) == self.HEADER.size and os.fstat(f.fileno()).st_size == size:
+            magic, start, count = self.HEADER.unpack(header)
+            if magic == self.MAGIC and start < self.capacity and count <= self.capacity:
+                self._start, self._count = start, count
+                return
+        # Nowy lub niezgodny plik (np. inna pojemność) - zaczynamy od pustego bufora
+        f.truncate(size)
+        self._write_header()
+
+    def _write_header(self):
+        self._file.seek(0)
+        self._file.write(self.HEADER.pack(self.MAGIC, self._start, self._count))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, ts):
+        self._open()
+        slot = (self._start + self._count) % self.capacity
+        if self._count == self.capacity:
+            self._start = (self._start + 1) % self.capacity
         else:
-            print(f"Automatyczne pobieranie adresu IP nie jest wspierane dla systemu: {system}")
-        
-        return ip_address
-
-    except subprocess.TimeoutExpired:
-        print(f"Timeout podczas próby pobrania adresu IP dla systemu {system}.")
-    except Exception as e:
-        print(f"Wystąpił błąd podczas próby pobrania adresu IP dla systemu {system}: {e}")
-    return None
+            self._count += 1
+        self._file.seek(self.HEADER.size + slot * self.RECORD.size)
+        self._file.write(self.RECORD.pack(ts))
+        self._write_header()
+
+    def samples(self):
+        self._open()
+        self._file.seek(self.HEADER.size)
+        data = self._file.read(self.capacity * self.RECORD.size)
+        slots = [value for (value,) in self.RECORD.iter_unpack(data)]
+        return [slots[(self._start + i) % self.capacity] for i in range(self._count)]
 
+    def clear(self):
+        self._open()
+        self._start = self._count = 0
+        self._write_header()
 
-def report_device_ip(api_base_url, device_serial, ip_address):
+
+def get_route_address(host):
+    """
+    Adres lokalny, z którego system wysłałby pakiet do serwera API (connect() na gnieździe UDP
+    tylko wybiera trasę - nic nie jest wysyłane).
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect((host, 9))
+            address = s.getsockname()[0]
+            return address if address != "0.0.0.0" else None
+    except OSError:
+        return None
+
+
+def get_interface_addresses():
+    """
+    Adresy IPv4 interfejsów sieciowych (bez pętli zwrotnej), odczytane przez ioctl - bez uruchamiania procesów.
+    """
+    addresses = []
+    if fcntl is None:
+        return addresses
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for _, name in socket.if_nameindex():
+            if name == "lo":
+                continue
+            try:
+                packed = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack("256s", name[:15].encode()))
+            except OSError:
+                continue  # interfejs bez adresu IPv4
+            addresses.append(socket.inet_ntoa(packed[20:24]))
+    return addresses
+
+
+def get_ip_address(api_base_url=API_BASE_URL):
+    """
+    Pobiera główny adres IP urządzenia: adres interfejsu, przez który widoczny jest serwer API,
+    a gdy trasy brak - pierwszy adres IPv4 spośród interfejsów.
+    """
+    address = get_route_address(urlparse(api_base_url).hostname)
+    if address:
+        return address
+    try:
+        addresses = get_interface_addresses()
+    except OSError as e:
+        log.debug("Nie można odczytać adresów interfejsów: %s", e)
+        return None
+    return addresses[0] if addresses else None
+
+
+def create_session():
+    """
+    Sesja HTTP z utrzymywanym połączeniem (keep-alive) - kolejne raporty nie otwierają nowego połączenia TCP.
+    """
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+
+def report_device_ip(session, api_base_url, device_serial, ip_address, keepalive=False):
     """
     Wysyła adres IP urządzenia do serwera MediaHub API.
 
+    :param session: Sesja HTTP (create_session).
     :param api_base_url: Bazowy URL serwera API (np. http://localhost:5000/api)
     :param device_serial: Numer seryjny urządzenia.
     :param ip_address: Nowy adres IP urządzenia.
+    :param keepalive: Tylko potwierdzenie obecności - adres nie zmienił się od ostatniego raportu.
+    :return: (błąd, odstęp) - opis błędu lub None oraz odstęp do następnego raportu zalecany przez serwer.
     """
     endpoint_url = f"{api_base_url.rstrip('/')}/device/{device_serial}/ip"
-    payload = {"ip_address": ip_address}
-    headers = {"Content-Type": "application/json"}
-
-    print(f"Wysyłanie żądania PUT do: {endpoint_url}")
-    print(f"Dane: {json.dumps(payload)}")
+    payload = {"keepalive": True} if keepalive else {"ip_address": ip_address}
+    try:
+        response = session.put(endpoint_url, json=payload, timeout=REQUEST_TIMEOUT)
+    except requests.exceptions.Timeout:
+        return f"Żądanie do {endpoint_url} przekroczyło limit czasu", None
+    except requests.exceptions.RequestException as e:
+        return f"Nie można połączyć się z serwerem API {api_base_url}: {e}", None
 
+    if not response.ok:
+        return f"Serwer odrzucił raport ({response.status_code}): {response.text[:200]}", None
+    log.debug("%s przyjęty (%s)", "Keepalive" if keepalive else f"Raport IP {ip_address}", response.status_code)
     try:
-        response = requests.put(endpoint_url, json=payload, headers=headers, timeout=10)
-        
-        print(f"Status odpowiedzi: {response.status_code}")
-        try:
-            response_data = response.json()
-            print("Odpowiedź serwera:")
-            print(json.dumps(response_data, indent=2, ensure_ascii=False))
-        except json.JSONDecodeError:
-            print("Nie udało się zdekodować odpowiedzi JSON. Surowa odpowiedź:")
-            print(response.text)
-
-        if response.ok:
-            print("Adres IP został pomyślnie zaktualizowany.")
-            if response_data.get('status') == 'online':
-                print("Status urządzenia: ONLINE")
-        else:
-            print(f"Błąd podczas aktualizacji adresu IP. Serwer odpowiedział: {response.status_code}")
+        interval = int(response.json().get("interval"))
+    except (ValueError, TypeError, AttributeError):
+        return None, None  # starszy serwer bez zalecanego odstępu
+    return None, min(max(interval, 5), 3600)
 
-    except requests.exceptions.ConnectionError as e:
-        print(f"Błąd połączenia: Nie można połączyć się z serwerem API pod adresem {api_base_url}.")
-        print(f"Szczegóły: {e}")
-    except requests.exceptions.Timeout:
-        print("Błąd: Żądanie przekroczyło limit czasu.")
+
+def flush_samples(session, api_base_url, device_serial, ring):
+    """
+    Wysyła zbuforowane próbki jednym żądaniem POST i czyści bufor.
+
+    :return: Opis błędu lub None.
+    """
+    samples = ring.samples()
+    if not samples:
+        return None
+    endpoint_url = f"{api_base_url.rstrip('/')}/device/{device_serial}/heartbeats"
+    payload = {"sent_at": int(time.time()), "samples": [{"ts": ts} for ts in samples]}
+    try:
+        response = session.post(endpoint_url, json=payload, timeout=REQUEST_TIMEOUT)
     except requests.exceptions.RequestException as e:
-        print(f"Wystąpił błąd żądania: {e}")
+        return f"Nie udało się wysłać {len(samples)} zbuforowanych próbek: {e}"
+    if response.status_code >= 500:
+        return f"Serwer nie przyjął zbuforowanych próbek ({response.status_code})"
+    # Błąd 4xx (np. serwer bez endpointu zbiorczego) nie zniknie przy ponowieniu - próbki są porzucane
+    ring.clear()
+    if not response.ok:
+        return f"Serwer odrzucił zbuforowane próbki ({response.status_code}): {response.text[:200]}"
+    log.info("Wysłano %s próbek zebranych podczas braku połączenia", len(samples))
+    return None
+
+
+def jittered(interval):
+    return interval * random.uniform(1 - REPORT_JITTER, 1 + REPORT_JITTER)
+
+
+def retry_delay(failures):
+    """
+    Opóźnienie ponowienia po kolejnym nieudanym raporcie: wykładnicze, losowane z górnej połowy przedziału.
+    """
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (failures - 1))
+    return random.uniform(delay / 2, delay)
+
 
 if __name__ == "__main__":
-    print("Automatyczne pobieranie informacji o urządzeniu...")
-    
+    logging.basicConfig(level=LOG_LEVEL, format="%(levelname)s %(message)s")
+
     current_serial = get_device_serial()
     current_ip = get_ip_address()
 
     if not current_serial:
-        print("Nie udało się automatycznie pobrać numeru seryjnego urządzenia. Przerwanie działania.")
+        log.error("Nie udało się automatycznie pobrać numeru seryjnego urządzenia. Przerwanie działania.")
         exit(1)
-        
+
     if not current_ip:
-        print("Nie udało się automatycznie pobrać adresu IP urządzenia. Przerwanie działania.")
-        # Można by tu ewentualnie wysłać "DHCP" jako IP, jeśli to pożądane
-        # current_ip = "DHCP" 
+        log.error("Nie udało się automatycznie pobrać adresu IP urządzenia. Przerwanie działania.")
         exit(1)
 
-    print(f"Pobrany numer seryjny: {current_serial}")
-    print(f"Pobrany adres IP: {current_ip}")
-    
-    print(f"Rozpoczynam cykliczne raportowanie statusu co {REPORT_INTERVAL} sekund...")
-    
+    log.info("Numer seryjny: %s, adres IP: %s, raportowanie co %s s", current_serial, current_ip, REPORT_INTERVAL)
+
+    session = create_session()
+    ring = SampleRing(BUFFER_PATH, BUFFER_CAPACITY)
+    next_sample = 0
+    interval = REPORT_INTERVAL
+    reported_ip = None   # adres przyjęty przez serwer - dopóki się nie zmieni, wystarczy keepalive
+    attempted_ip = None  # adres z ostatniej próby - zmiana adresu wymusza raport także w trakcie ponawiania
+    failures = 0
+    last_error = None
+    next_report = time.monotonic() + random.uniform(0, STARTUP_SPREAD)
     while True:
-        # Pobierz aktualny adres IP przed każdym raportem
+        # Adres sprawdzany lokalnie co IP_CHECK_INTERVAL s, raport wysyłany od razu po jego zmianie
         updated_ip = get_ip_address() or current_ip
-        report_device_ip(API_BASE_URL, current_serial, updated_ip)
-        time.sleep(REPORT_INTERVAL)
+        if updated_ip != current_ip:
+            log.info("Zmiana adresu IP: %s -> %s", current_ip, updated_ip)
+            current_ip = updated_ip
+
+        now = time.monotonic()
+        if now >= next_report or (reported_ip is not None and current_ip != attempted_ip):
+            attempted_ip = current_ip
+            error, server_interval = report_device_ip(
+                session, API_BASE_URL, current_serial, current_ip, keepalive=current_ip == reported_ip
+            )
+            if error:
+                # Błąd logowany raz przy utracie połączenia, kolejne powtórzenia tylko na poziomie DEBUG
+                log.log(logging.DEBUG if last_error else logging.WARNING, error)
+                failures += 1
+                next_report = now + retry_delay(failures)
+            else:
+                if last_error:
+                    log.info("Połączenie z serwerem API przywrócone")
+                try:
+                    if len(ring):
+                        flush_error = flush_samples(session, API_BASE_URL, current_serial, ring)
+                        if flush_error:
+                            log.warning(flush_error)
+                except OSError as e:
+                    log.warning("Błąd bufora próbek %s: %s", BUFFER_PATH, e)
+                if server_interval and server_interval != interval:
+                    log.info("Serwer zalecił odstęp raportów %s s", server_interval)
+                    interval = server_interval
+                failures = 0
+                reported_ip = current_ip
+                next_report = now + jittered(interval)
+            last_error = error
+
+        # Bez połączenia próbki zapisywane są lokalnie w zwykłym odstępie raportów, niezależnie od ponowień
+        if last_error and now >= next_sample:
+            next_sample = now + interval
+            try:
+                ring.append(int(time.time()))
+            except OSError as e:
+                log.debug("Nie można zapisać próbki w %s: %s", BUFFER_PATH, e)
+
+        wake_at = min(next_report, now + IP_CHECK_INTERVAL, next_sample if last_error else next_report)
+        time.sleep(max(0, wake_at - time.monotonic()))
@@ -1,7 +1,28 @@
 import os
+import sys
+import json
+import hmac
 import sqlite3
 import datetime
-from flask import Flask, request, jsonify, send_file, after_this_request
+import threading
+import queue
+import time
+import atexit
+import uuid
+import hashlib
+import random
+import math
+import io
+import codecs
+import gzip
+import posixpath
+import bisect
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import mimetypes
+from urllib.parse import quote, unquote
+from flask import Flask, Response, request, jsonify, g, has_app_context
 from flask_cors import CORS
 import ftplib
 from dotenv import load_dotenv
@@ -15,7 +36,8 @@ from functools import wraps
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app)
+# Nagłówki odpowiedzi, które panel (inny origin) musi móc odczytać
+CORS(app, expose_headers=['ETag', 'X-No-Refresh', 'Content-Range'])
 
 # Klucz do szyfrowania/deszyfrowania (powinien być taki sam jak w pliku config.js)
 ENCRYPTION_KEY = 'kiosk-manager-secure-key-2025'
@@ -45,18 +67,99 @@ def decrypt_data(encrypted_text):
         return ''
 
 # Konfiguracja bazy danych
-DATABASE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'kiosks.db')
+# Ścieżkę można nadpisać zmienną DATABASE_PATH (względną wobec katalogu backend/, jak w .env)
+DATABASE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    os.getenv('DATABASE_PATH', os.path.join('..', 'database', 'kiosks.db'))
+)
 
+# Parametry połączeń SQLite
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '5'))      # sekundy oczekiwania na blokadę zapisu
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))              # maks. liczba bezczynnych połączeń w puli
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '8192'))   # cache stron na połączenie
+DB_STATEMENT_CACHE = 256                                       # skompilowane zapytania trzymane na połączenie
+
+# Połączenie z puli - close() wywoływane przez handlery nie zamyka go fizycznie,
+# tylko wycofuje niezatwierdzoną transakcję. Połączenie wraca do puli po zakończeniu żądania.
+class PooledConnection(sqlite3.Connection):
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def really_close(self):
+        super().close()
+
+class ConnectionPool:
+    def __init__(self, database_path, max_idle):
+        self.database_path = database_path
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+
+    def create(self):
+        conn = sqlite3.connect(
+            self.database_path,
+            timeout=DB_BUSY_TIMEOUT,
+            factory=PooledConnection,
+            cached_statements=DB_STATEMENT_CACHE,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)}')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.create()
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.really_close()
+            return
+        if self._idle.qsize() < self.max_idle:
+            self._idle.put(conn)
+        else:
+            conn.really_close()
+
+db_pool = ConnectionPool(DATABASE_PATH, DB_POOL_SIZE)
+
+# Połączenia dla kodu działającego poza żądaniem HTTP (inicjalizacja, wątki w tle)
+_db_thread_local = threading.local()
+
+# W obrębie jednego żądania wszystkie wywołania zwracają to samo połączenie z puli,
+# poza żądaniem - połączenie przypisane do bieżącego wątku
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None:
+            conn = g._db_conn = db_pool.acquire()
+        return conn
+
+    conn = getattr(_db_thread_local, 'conn', None)
+    if conn is None:
+        conn = _db_thread_local.conn = db_pool.create()
     return conn
 
+@app.teardown_appcontext
+def release_db_connection(exception):
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        db_pool.release(conn)
+
 def init_db():
     if not os.path.exists(os.path.dirname(DATABASE_PATH)):
         os.makedirs(os.path.dirname(DATABASE_PATH))
     
     conn = get_db_connection()
+    # WAL pozwala czytać równolegle z zapisem heartbeatów (ustawienie trwałe w pliku bazy)
+    conn.execute('PRAGMA journal_mode = WAL')
     with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'schema.sql'), 'r') as f:
         conn.executescript(f.read())
     conn.commit()
@@ -65,39 +168,215 @@ def init_db():
 # Inicjalizacja bazy danych przy starcie
 init_db()
 
-# Funkcja aktualizująca statusy kiosków na podstawie czasu ostatniego połączenia
+KIOSK_OFFLINE_AFTER = 60          # po ilu sekundach bez heartbeatu kiosk jest offline (przy wydłużonym odstępie heartbeatów - więcej)
+KIOSK_STATUS_SWEEP_INTERVAL = 15  # co ile sekund wątek w tle aktualizuje statusy
+
+# Funkcja aktualizująca statusy kiosków na podstawie czasu ostatniego połączenia - zwraca id kiosków oznaczonych jako offline
 def update_kiosk_statuses():
     conn = get_db_connection()
     # Pobierz czas 1 minuty temu
-    two_minutes_ago = (datetime.datetime.now() - datetime.timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M:%S')
+    two_minutes_ago = (datetime.datetime.now() - datetime.timedelta(seconds=heartbeat_pacing.offline_after())).strftime('%Y-%m-%d %H:%M:%S')
     
     # Zaktualizuj statusy kiosków, które nie połączyły się w ciągu ostatnich 1 minut
-    conn.execute(
-        'UPDATE kiosks SET status = "offline" WHERE last_connection < ? AND status != "offline"',
-        (two_minutes_ago,)
-    )
-    conn.commit()
+    # (last_connection w formacie 'YYYY-MM-DD HH:MM:SS' - porównanie tekstowe korzysta z indeksu).
+    # Blokada zapisu od początku transakcji - heartbeat nie zmieni statusu między odczytem a zapisem.
+    # Połączenie wątku w tle jest długowieczne - po błędzie transakcja musi zostać wycofana,
+    # inaczej blokada zapisu zostałaby na nim do końca działania serwera
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        kiosk_ids = [row[0] for row in conn.execute(
+            'SELECT id FROM kiosks WHERE last_connection < ? AND status != "offline"',
+            (two_minutes_ago,)
+        ).fetchall()]
+        if kiosk_ids:
+            conn.executemany('UPDATE kiosks SET status = "offline" WHERE id = ?', [(kiosk_id,) for kiosk_id in kiosk_ids])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     conn.close()
+    return kiosk_ids
 
-# Dekorator do weryfikacji tokenu JWT
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            try:
-                token = auth_header.split(" ")[1]
-            except IndexError:
-                return jsonify({'message': 'Token jest nieprawidłowy'}), 401
+# Migawka listy kiosków dla GET /api/kiosks - odczyt bez zapytań do bazy,
+# unieważniana przez heartbeaty, zmianę statusów i edycję kiosków
+class KioskSnapshot:
+    def __init__(self):
+        self._kiosks = None
+        self._version = 0
+        self._lock = threading.Lock()
 
-        if not token:
-            return jsonify({'message': 'Token jest wymagany'}), 401
+    def invalidate(self):
+        with self._lock:
+            self._kiosks = None
+            self._version += 1
 
+    def get(self):
+        with self._lock:
+            kiosks = self._kiosks
+            version = self._version
+        if kiosks is None:
+            conn = get_db_connection()
+            kiosks = [dict(kiosk) for kiosk in conn.execute('SELECT * FROM kiosks').fetchall()]
+            conn.close()
+            with self._lock:
+                # Nie zapisuj danych, które zdążyły się zdezaktualizować w trakcie odczytu
+                if self._version == version:
+                    self._kiosks = kiosks
+        return kiosks
+
+kiosk_snapshot = KioskSnapshot()
+
+# Zmiany stanu kiosków dla panelu (Server-Sent Events) - publikowane tylko przy faktycznej zmianie:
+# kiosk online/offline, nowy adres IP, dodanie, edycja i usunięcie kiosku
+KIOSK_EVENTS_HISTORY = 1000    # ile ostatnich zdarzeń trzymać do wznowienia po Last-Event-ID
+KIOSK_EVENTS_QUEUE_SIZE = 1000 # maks. liczba zdarzeń czekających na wolnego odbiorcę
+KIOSK_EVENTS_KEEPALIVE = 15    # co ile sekund wysyłać komentarz podtrzymujący połączenie
+KIOSK_EVENTS_RETRY_MS = 5000   # po ilu ms przeglądarka ponawia zerwane połączenie
+
+class KioskEventSubscriber:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=KIOSK_EVENTS_QUEUE_SIZE)
+        self.overflow = False
+
+class KioskEventBus:
+    def __init__(self, history):
+        self._seq = 0
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, events):
+        with self._lock:
+            for event in events:
+                self._seq += 1
+                item = (self._seq, event)
+                self._history.append(item)
+                for subscriber in list(self._subscribers):
+                    try:
+                        subscriber.queue.put_nowait(item)
+                    except queue.Full:
+                        # Odbiorca nie nadąża - zostanie odłączony i pobierze pełną listę od nowa
+                        subscriber.overflow = True
+                        self._subscribers.discard(subscriber)
+
+    # Zwraca (odbiorca, zdarzenia do odtworzenia lub None gdy potrzebna pełna lista, bieżący numer)
+    def subscribe(self, last_event_id=None):
+        subscriber = KioskEventSubscriber()
+        with self._lock:
+            self._subscribers.add(subscriber)
+            replay = None
+            if last_event_id is not None and last_event_id <= self._seq:
+                oldest = self._history[0][0] if self._history else self._seq + 1
+                # Wznowienie możliwe tylko, gdy żadne zdarzenie nie wypadło z historii
+                if last_event_id >= oldest - 1:
+                    replay = [item for item in self._history if item[0] > last_event_id]
+            return subscriber, replay, self._seq
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    # Numer ostatniego zdarzenia - rośnie przy każdej zmianie stanu floty
+    def last_id(self):
+        with self._lock:
+            return self._seq
+
+kiosk_events = KioskEventBus(KIOSK_EVENTS_HISTORY)
+
+def kiosk_event(event_type, kiosk_id, **fields):
+    return {"type": event_type, "id": kiosk_id, "fields": fields}
+
+# Wątek w tle oznaczający kioski bez heartbeatu jako offline
+def kiosk_status_sweeper():
+    while True:
+        time.sleep(KIOSK_STATUS_SWEEP_INTERVAL)
+        try:
+            kiosk_ids = update_kiosk_statuses()
+            if kiosk_ids:
+                kiosk_snapshot.invalidate()
+                kiosk_events.publish([kiosk_event('offline', kiosk_id, status='offline') for kiosk_id in kiosk_ids])
+        except Exception as e:
+            print(f"Błąd aktualizacji statusów kiosków: {e}")
+
+_background_started = False
+_background_lock = threading.Lock()
+
+# Uruchomienie zadań w tle przy pierwszym żądaniu (a nie przy imporcie modułu)
+@app.before_request
+def start_background_tasks():
+    global _background_started
+    if _background_started:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        threading.Thread(target=kiosk_status_sweeper, name='kiosk-status-sweeper', daemon=True).start()
+        threading.Thread(target=heartbeat_rollup_worker, name='heartbeat-rollup', daemon=True).start()
+        threading.Thread(target=ftp_pool_pruner, name='ftp-pool-pruner', daemon=True).start()
+        job_queue.start()
+        _background_started = True
+
+# Cache zweryfikowanych tokenów JWT - równoległe żądania panelu z tym samym tokenem
+# nie dekodują go ponownie i nie sprawdzają użytkownika w bazie
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '1024'))  # 0 wyłącza cache
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '60'))    # sekundy
+
+class TokenCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return claims
+
+    def put(self, token, claims):
+        if self.max_size <= 0:
+            return
+        # Wpis nie może żyć dłużej niż sam token
+        ttl = self.ttl
+        if 'exp' in claims:
+            ttl = min(ttl, claims['exp'] - time.time())
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (claims, time.monotonic() + ttl)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    # Do wywołania po usunięciu użytkownika lub zmianie jego hasła
+    def invalidate_user(self, username):
+        with self._lock:
+            for token in [t for t, (claims, _) in self._entries.items() if claims.get('username') == username]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+token_cache = TokenCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+# Weryfikacja tokenu JWT - zwraca odpowiedź z błędem lub None, jeśli token jest poprawny
+def verify_token(token):
+    if not token:
+        return jsonify({'message': 'Token jest wymagany'}), 401
+
+    if token_cache.get(token) is None:
         try:
             data = jwt.decode(token, JWT_SECRET_KEY, algorithms=["HS256"])
             conn = get_db_connection()
-            user = conn.execute('SELECT * FROM users WHERE username = ?', (data['username'],)).fetchone()
+            user = conn.execute('SELECT 1 FROM users WHERE username = ?', (data['username'],)).fetchone()
             conn.close()
             if not user:
                 return jsonify({'message': 'Użytkownik nie istnieje'}), 401
@@ -106,6 +385,25 @@ def token_required(f):
         except jwt.InvalidTokenError:
             return jsonify({'message': 'Token jest nieprawidłowy'}), 401
 
+        token_cache.put(token, data)
+    return None
+
+# Dekorator do weryfikacji tokenu JWT
+def token_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = None
+        if 'Authorization' in request.headers:
+            auth_header = request.headers['Authorization']
+            try:
+                token = auth_header.split(" ")[1]
+            except IndexError:
+                return jsonify({'message': 'Token jest nieprawidłowy'}), 401
+
+        error = verify_token(token)
+        if error:
+            return error
+
         return f(*args, **kwargs)
     return decorated
 
@@ -157,12 +455,205 @@ def init_default_user():
 init_default_user()
 
 # Obsługa FTP
+FTP_TIMEOUT = 30                                                        # timeout operacji na gnieździe FTP (s)
+FTP_POOL_MAX_PER_KIOSK = int(os.getenv('FTP_POOL_MAX_PER_KIOSK', '4'))  # maks. liczba sesji do jednego kiosku
+FTP_POOL_IDLE_TIMEOUT = float(os.getenv('FTP_POOL_IDLE_TIMEOUT', '60')) # po ilu sekundach bezczynności sesja jest zamykana
+FTP_POOL_WAIT_TIMEOUT = 30                                              # maks. czas oczekiwania na wolną sesję (s)
+FTP_STREAM_CHUNK_SIZE = 64 * 1024                                       # rozmiar porcji przy strumieniowaniu plików
+
+# Zalogowana sesja FTP należąca do puli
+class PooledFTP(ftplib.FTP):
+    pool = None
+    pool_key = None
+    pool_password = ''
+    home = None
+    cwd_changed = False
+    last_used = 0
+    checked_out = False
+    lease = 0                   # numer wydania z puli - odróżnia kolejnych użytkowników tej samej sesji
+
+    def cwd(self, dirname):
+        self.cwd_changed = True
+        return super().cwd(dirname)
+
+    # Handlery wywołują quit() po zakończeniu pracy - sesja wraca wtedy do puli.
+    # Wywołanie w trakcie obsługi wyjątku oznacza niepewny stan sesji, więc jest ona zamykana.
+    def quit(self):
+        self.pool.release(self, discard=sys.exc_info()[0] is not None)
+
+    # with ftp_connect(...) as ftp: - sesja wraca do puli (po wyjątku jest zamykana)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.release(self, discard=exc_type is not None)
+
+    def disconnect(self):
+        try:
+            super().quit()
+        except Exception:
+            self.close()
+
+# Pula sesji FTP kluczowana (host, port, użytkownik) - kolejne operacje na tym samym
+# kiosku nie płacą za połączenie TCP i logowanie USER/PASS
+class FtpPool:
+    def __init__(self, max_per_kiosk, idle_timeout):
+        self.max_per_kiosk = max_per_kiosk
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._in_use = {}
+        self._leases = itertools.count(1)
+        self._cond = threading.Condition()
+
+    def _count(self, key):
+        return self._in_use.get(key, 0) + len(self._idle.get(key, []))
+
+    def _prune_idle(self):
+        # Wywoływane z założoną blokadą - zwraca sesje do zamknięcia
+        expired = []
+        deadline = time.monotonic() - self.idle_timeout
+        for key in list(self._idle):
+            sessions = self._idle[key]
+            expired.extend(ftp for ftp in sessions if ftp.last_used < deadline)
+            sessions[:] = [ftp for ftp in sessions if ftp.last_used >= deadline]
+            if not sessions:
+                del self._idle[key]
+        return expired
+
+    # Wydanie sesji; w żądaniu HTTP sesja jest też zapamiętywana, żeby teardown mógł ją zwolnić,
+    # jeśli handler tego nie zrobił
+    def _hand_out(self, ftp):
+        with self._cond:
+            ftp.checked_out = True
+            ftp.lease = next(self._leases)
+        if has_app_context():
+            g.setdefault('_ftp_sessions', []).append((ftp, ftp.lease))
+        return ftp
+
+    # Sesja używana dłużej niż żądanie (strumieniowanie odpowiedzi) - zwalnia ją wywołujący
+    def detach(self, ftp):
+        if has_app_context():
+            sessions = g.get('_ftp_sessions') or []
+            g._ftp_sessions = [item for item in sessions if item[0] is not ftp]
+
+    def prune(self):
+        with self._cond:
+            expired = self._prune_idle()
+        for ftp in expired:
+            ftp.disconnect()
+
+    def _forget(self, key):
+        with self._cond:
+            self._in_use[key] -= 1
+            self._cond.notify_all()
+
+    def _create(self, key, hostname, username, password, port):
+        ftp = PooledFTP(timeout=FTP_TIMEOUT)
+        try:
+            ftp.connect(hostname, port)
+            ftp.login(username, password)
+            ftp.home = ftp.pwd()
+        except Exception:
+            ftp.close()
+            raise
+        ftp.pool = self
+        ftp.pool_key = key
+        ftp.pool_password = password
+        return ftp
+
+    def acquire(self, hostname, username, password, port=21, wait_timeout=FTP_POOL_WAIT_TIMEOUT):
+        key = (hostname, port, username)
+        deadline = time.monotonic() + wait_timeout
+        while True:
+            ftp = None
+            create = False
+            with self._cond:
+                to_close = self._prune_idle()
+                idle = self._idle.get(key, [])
+                for candidate in reversed(idle):
+                    if hmac.compare_digest(candidate.pool_password.encode('utf-8'), password.encode('utf-8')):
+                        idle.remove(candidate)
+                        ftp = candidate
+                        break
+                if ftp is None:
+                    # Sesja zalogowana innym hasłem zwalnia miejsce dla nowej
+                    if idle and self._count(key) >= self.max_per_kiosk:
+                        to_close.append(idle.pop(0))
+                    create = self._count(key) < self.max_per_kiosk
+                if ftp is not None or create:
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"Brak wolnej sesji FTP do {hostname}:{port}")
+                    self._cond.wait(remaining)
+
+            for stale in to_close:
+                stale.disconnect()
+
+            if ftp is not None:
+                try:
+                    ftp.voidcmd('NOOP')
+                    return self._hand_out(ftp)
+                except Exception:
+                    ftp.close()
+                    self._forget(key)
+                    continue
+
+            if create:
+                try:
+                    return self._hand_out(self._create(key, hostname, username, password, port))
+                except Exception:
+                    self._forget(key)
+                    raise
+
+    # Wielokrotne zwolnienie tej samej sesji jest ignorowane - licznik _in_use zmniejsza tylko pierwsze.
+    # Z podanym lease zwalniana jest tylko sesja z tego wydania (a nie pobrana ponownie przez innego użytkownika).
+    def release(self, ftp, discard=False, lease=None):
+        with self._cond:
+            if not ftp.checked_out or (lease is not None and ftp.lease != lease):
+                return
+            ftp.checked_out = False
+        if not discard and ftp.cwd_changed:
+            # Kolejny użytkownik sesji zaczyna w katalogu domowym, jak po zalogowaniu
+            try:
+                ftplib.FTP.cwd(ftp, ftp.home)
+                ftp.cwd_changed = False
+            except Exception:
+                discard = True
+        with self._cond:
+            self._in_use[ftp.pool_key] -= 1
+            if not discard:
+                ftp.last_used = time.monotonic()
+                self._idle.setdefault(ftp.pool_key, []).append(ftp)
+            expired = self._prune_idle()
+            self._cond.notify_all()
+        if discard:
+            ftp.disconnect()
+        for stale in expired:
+            stale.disconnect()
+
+ftp_pool = FtpPool(FTP_POOL_MAX_PER_KIOSK, FTP_POOL_IDLE_TIMEOUT)
+
+# Sesja, której handler nie oddał (return lub wyjątek bez quit()), jest zamykana po żądaniu -
+# inaczej blokowałaby miejsce w limicie FTP_POOL_MAX_PER_KIOSK na zawsze
+@app.teardown_appcontext
+def release_ftp_sessions(exception):
+    for ftp, lease in g.pop('_ftp_sessions', []):
+        ftp_pool.release(ftp, discard=True, lease=lease)
+
+# Bezczynne sesje zamykane także wtedy, gdy nikt nie pobiera nowych
+def ftp_pool_pruner():
+    while True:
+        time.sleep(FTP_POOL_IDLE_TIMEOUT)
+        try:
+            ftp_pool.prune()
+        except Exception as e:
+            print(f"Błąd zamykania bezczynnych sesji FTP: {e}")
+
 def ftp_connect(hostname, username, password, port=21):
     try:
-        ftp = ftplib.FTP()
-        ftp.connect(hostname, port)
-        ftp.login(username, password)
-        return ftp
+        return ftp_pool.acquire(hostname, username, password, port)
     except Exception as e:
         print(f"FTP connection error: {e}")
         return None
@@ -190,46 +681,40 @@ def ftp_delete_file(ftp, path, is_directory=False):
         print(f"FTP delete error: {e}")
         return False
 
-# Nowa funkcja do pobierania zawartości pliku
-def ftp_get_file_content(ftp, path):
-    try:
-        # Utwórz tymczasowy plik do pobrania zawartości
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            # Pobierz plik z FTP
-            ftp.retrbinary(f'RETR {path}', temp_file.write)
-            temp_file_path = temp_file.name
-        
-        # Odczytaj zawartość pobranego pliku
-        with open(temp_file_path, 'r') as file:
-            content = file.read()
-        
-        # Usuń tymczasowy plik
-        os.unlink(temp_file_path)
-        
-        return content
-    except Exception as e:
-        print(f"FTP get file content error: {e}")
-        return None
+# Edycja małych plików (harmonogramy, konfiguracja) - treść trzymana w pamięci, bez plików tymczasowych
+FTP_FILE_CONTENT_MAX_SIZE = int(os.getenv('FTP_FILE_CONTENT_MAX_SIZE', str(4 * 1024 * 1024)))  # maks. rozmiar pliku (B)
+FTP_FILE_CONTENT_ENCODING = 'utf-8'                                                          # kodowanie domyślne
+
+class FtpFileTooLarge(Exception):
+    pass
+
+# Wczytanie pliku z FTP do pamięci; przerwanie transferu po przekroczeniu limitu
+# (sesja jest wtedy w niepewnym stanie - wywołujący zamyka ją przez quit() w obsłudze wyjątku)
+def ftp_read_bytes(ftp, path, max_size=None):
+    buffer = io.BytesIO()
+    def write(block):
+        if max_size is not None and buffer.tell() + len(block) > max_size:
+            raise FtpFileTooLarge(f'Plik {path} przekracza limit {max_size} B')
+        buffer.write(block)
+    ftp.retrbinary(f'RETR {path}', write)
+    return buffer.getvalue()
+
+def ftp_get_file_content(ftp, path, max_size=FTP_FILE_CONTENT_MAX_SIZE):
+    return ftp_read_bytes(ftp, path, max_size)
 
-# Nowa funkcja do zapisu zawartości pliku
 def ftp_put_file_content(ftp, path, content):
-    try:
-        # Utwórz tymczasowy plik z zawartością
-        with tempfile.NamedTemporaryFile(delete=False, mode='w') as temp_file:
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-        
-        # Wyślij plik do FTP
-        with open(temp_file_path, 'rb') as file:
-            ftp.storbinary(f'STOR {path}', file)
-        
-        # Usuń tymczasowy plik
-        os.unlink(temp_file_path)
-        
-        return True
-    except Exception as e:
-        print(f"FTP put file content error: {e}")
-        return False
+    ftp.storbinary(f'STOR {path}', io.BytesIO(content))
+
+# Silny ETag treści - klient z aktualną kopią dostaje 304 zamiast pliku
+def content_etag(data):
+    return '"' + hashlib.sha1(data).hexdigest() + '"'
+
+# Tylko kodowania tekstowe - kodeki bytes-to-bytes i str-to-str (np. hex, rot13) są odrzucane jak nieznane
+def file_content_encoding(data):
+    encoding = data.get('encoding') or FTP_FILE_CONTENT_ENCODING
+    if not isinstance(encoding, str) or not getattr(codecs.lookup(encoding), '_is_text_encoding', True):
+        raise LookupError(encoding)
+    return encoding
 
 # Endpointy API
 
@@ -267,8 +752,8 @@ def update_settings():
 @app.route('/api/kiosks', methods=['GET'])
 @token_required
 def get_kiosks():
-    # Aktualizuj statusy kiosków przed zwróceniem wyników
-    update_kiosk_statuses()
+    # Statusy aktualizuje wątek w tle - tutaj tylko odczyt z migawki
+    kiosks = kiosk_snapshot.get()
     
     # Sprawdź, czy zapytanie pochodzi bezpośrednio po aktualizacji IP
     # Możemy to sprawdzić na podstawie nagłówka referer
@@ -279,24 +764,137 @@ def get_kiosks():
     # możemy to wykryć na podstawie nagłówków lub źródła żądania
     if 'Kiosk-Device' in user_agent or '/api/device/' in referer:
         # Zwróć minimalną odpowiedź (tylko podstawowe dane)
-    # ...istniejący kod logowania poprawiony wyżej...
-        kiosks = conn.execute('SELECT id, name, serial_number, ip_address, status FROM kiosks').fetchall()
-        conn.close()
+        minimal_fields = ('id', 'name', 'serial_number', 'ip_address', 'status')
         
         # Dodaj specjalny flag do odpowiedzi - frontend będzie wiedział, żeby nie odświeżać UI
         response = jsonify({
-            "kiosks": [dict(kiosk) for kiosk in kiosks],
+            "kiosks": [{field: kiosk[field] for field in minimal_fields} for kiosk in kiosks],
             "no_refresh": True
         })
         response.headers['X-No-Refresh'] = 'true'
         return response
     
     # Standardowa odpowiedź dla normalnych zapytań z frontendu
-    conn = get_db_connection()
-    kiosks = conn.execute('SELECT * FROM kiosks').fetchall()
-    conn.close()
+    return jsonify(kiosks)
+
+# Kompaktowa migawka floty dla odpytujących paneli: kolumny zamiast listy obiektów, tylko pola
+# używane przez panel (bez ftp_password). Wersja migawki to numer ostatniego zdarzenia kiosk_events,
+# więc zmienia się tylko przy zmianie stanu floty (dodanie, usunięcie, edycja, status, IP) - rutynowe
+# heartbeaty jej nie zmieniają. Dlatego last_connection jest podawane tylko dla kiosków offline
+# (stałe aż do powrotu online, który jest zdarzeniem); kiosk online ma null - łączy się na bieżąco.
+# Treść jest kodowana (i kompresowana) raz na wersję, dlatego ETag jest silny, a 304 nie wymaga
+# zapytania do bazy.
+KIOSK_SNAPSHOT_FIELDS = ('id', 'name', 'serial_number', 'mac_address', 'ip_address', 'status', 'last_connection', 'ftp_username')
+KIOSK_SNAPSHOT_GZIP_MIN_SIZE = 1024      # mniejsze odpowiedzi wysyłane bez kompresji (B)
+KIOSK_SNAPSHOT_BOOT_ID = uuid.uuid4().hex[:8]  # licznik zdarzeń zaczyna się od zera po restarcie serwera
+
+class CompactFleetSnapshot:
+    def __init__(self):
+        self._encoded = None                # (wersja, JSON, JSON gzip lub None)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(version, gzipped=False):
+        return f'"{KIOSK_SNAPSHOT_BOOT_ID}-{version}{"-gz" if gzipped else ""}"'
+
+    @staticmethod
+    def column(kiosk, field):
+        if field == 'last_connection' and kiosk['status'] == 'online':
+            return None
+        return kiosk[field]
+
+    def get(self):
+        version = kiosk_events.last_id()
+        # Budowanie pod blokadą - dla jednej wersji istnieje dokładnie jedna treść
+        with self._lock:
+            if self._encoded and self._encoded[0] == version:
+                return self._encoded
+            kiosks = kiosk_snapshot.get()
+            body = json.dumps({
+                "version": version,
+                "count": len(kiosks),
+                "fields": KIOSK_SNAPSHOT_FIELDS,
+                "columns": {field: [self.column(kiosk, field) for kiosk in kiosks] for field in KIOSK_SNAPSHOT_FIELDS}
+            }, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+            compressed = gzip.compress(body, compresslevel=6) if len(body) >= KIOSK_SNAPSHOT_GZIP_MIN_SIZE else None
+            self._encoded = (version, body, compressed)
+            return self._encoded
+
+fleet_snapshot = CompactFleetSnapshot()
+
+@app.route('/api/kiosks/snapshot', methods=['GET'])
+@token_required
+def get_fleet_snapshot():
+    # Bieżąca wersja z licznika w pamięci - niezmieniona migawka bez odczytu z bazy
+    version = kiosk_events.last_id()
+    if request.headers.get('If-None-Match') in (CompactFleetSnapshot.etag(version), CompactFleetSnapshot.etag(version, True)):
+        response = Response(status=304)
+        response.headers['ETag'] = request.headers['If-None-Match']
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+    
+    version, body, compressed = fleet_snapshot.get()
+    use_gzip = compressed is not None and 'gzip' in request.headers.get('Accept-Encoding', '')
+    response = Response(compressed if use_gzip else body, mimetype='application/json')
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['ETag'] = CompactFleetSnapshot.etag(version, use_gzip)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def sse_message(event, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return '\n'.join(lines) + '\n\n'
+
+# Strumień zmian stanu kiosków (Server-Sent Events). Na początek pełna lista (zdarzenie snapshot),
+# potem wyłącznie zmiany. Po zerwaniu połączenia przeglądarka wznawia od Last-Event-ID.
+# EventSource nie wysyła nagłówków, więc token przekazywany jest w parametrze zapytania.
+@app.route('/api/kiosks/events', methods=['GET'])
+def kiosk_events_stream():
+    token = request.args.get('token')
+    if not token and 'Authorization' in request.headers:
+        token = request.headers['Authorization'].split(' ')[-1]
+    error = verify_token(token)
+    if error:
+        return error
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
     
-    return jsonify([dict(kiosk) for kiosk in kiosks])
+    subscriber, replay, current_id = kiosk_events.subscribe(last_event_id)
+    kiosks = kiosk_snapshot.get() if replay is None else None
+    
+    def generate():
+        try:
+            yield f'retry: {KIOSK_EVENTS_RETRY_MS}\n\n'
+            if kiosks is not None:
+                yield sse_message('snapshot', kiosks, current_id)
+            for event_id, event in replay or []:
+                yield sse_message('kiosk', event, event_id)
+            while True:
+                try:
+                    event_id, event = subscriber.queue.get(timeout=KIOSK_EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    if subscriber.overflow:
+                        # Przeglądarka połączy się ponownie i dostanie pełną listę
+                        yield sse_message('reset', {})
+                        return
+                    yield ': keepalive\n\n'
+                    continue
+                yield sse_message('kiosk', event, event_id)
+        finally:
+            kiosk_events.unsubscribe(subscriber)
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/api/kiosks', methods=['POST'])
 @token_required
@@ -315,7 +913,11 @@ def add_kiosk():
         )
         conn.commit()
         kiosk_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        kiosk = dict(conn.execute('SELECT * FROM kiosks WHERE id = ?', (kiosk_id,)).fetchone())
         conn.close()
+        known_serials.invalidate()
+        kiosk_snapshot.invalidate()
+        kiosk_events.publish([kiosk_event('added', kiosk_id, **kiosk)])
         
         return jsonify({"id": kiosk_id, "message": "Kiosk dodany pomyślnie"}), 201
     except sqlite3.IntegrityError:
@@ -363,6 +965,9 @@ def update_kiosk(kiosk_id):
         conn.execute(query, list(update_fields.values()) + [kiosk_id])
         conn.commit()
         conn.close()
+        known_serials.invalidate()
+        kiosk_snapshot.invalidate()
+        kiosk_events.publish([kiosk_event('updated', kiosk_id, **update_fields)])
         
         return jsonify({"message": "Kiosk zaktualizowany pomyślnie"})
     except sqlite3.IntegrityError:
@@ -384,11 +989,389 @@ def delete_kiosk(kiosk_id):
         return jsonify({"error": "Kiosk nie znaleziony"}), 404
     
     conn.execute('DELETE FROM kiosks WHERE id = ?', (kiosk_id,))
+    conn.execute('DELETE FROM kiosk_media WHERE kiosk_id = ?', (kiosk_id,))
+    conn.execute('DELETE FROM heartbeats WHERE kiosk_id = ?', (kiosk_id,))
+    conn.execute('DELETE FROM heartbeat_rollups WHERE kiosk_id = ?', (kiosk_id,))
+    conn.execute('DELETE FROM kiosk_schedules WHERE kiosk_id = ?', (kiosk_id,))
+    conn.execute('DELETE FROM kiosk_group_members WHERE kiosk_id = ?', (kiosk_id,))
+    conn.execute('DELETE FROM kiosk_tags WHERE kiosk_id = ?', (kiosk_id,))
     conn.commit()
     conn.close()
+    known_serials.invalidate()
+    kiosk_snapshot.invalidate()
+    kiosk_events.publish([kiosk_event('removed', kiosk_id)])
     
     return '', 204
 
+# Wyszukiwanie kiosków po stronie serwera: filtry (status, grupa, tag, fragment nazwy/IP),
+# stronicowanie kursorem (keyset - kolejna strona to zakres indeksu, a nie OFFSET) i wybór pól
+KIOSK_QUERY_PAGE_DEFAULT = 100
+KIOSK_QUERY_PAGE_MAX = 1000
+KIOSK_QUERY_FIELDS = ('id', 'name', 'mac_address', 'serial_number', 'ip_address', 'last_connection',
+                      'status', 'ftp_username', 'created_at', 'updated_at')   # bez ftp_password
+KIOSK_QUERY_RELATIONS = ('groups', 'tags')
+# Wyrażenia sortowania - identyczne jak w indeksach idx_kiosks_name_sort / idx_kiosks_last_connection_sort
+KIOSK_QUERY_SORTS = {
+    'id': 'k.id',
+    'name': "IFNULL(k.name, '')",
+    'last_connection': "IFNULL(k.last_connection, '')"
+}
+KIOSK_TAG_MAX_LENGTH = 50
+
+def query_list(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+def normalize_tags(tags):
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise ValueError('Tagi muszą być listą napisów')
+    normalized = list(OrderedDict.fromkeys(tag.strip() for tag in tags if tag.strip()))
+    if any(len(tag) > KIOSK_TAG_MAX_LENGTH for tag in normalized):
+        raise ValueError(f'Tag może mieć maks. {KIOSK_TAG_MAX_LENGTH} znaków')
+    return normalized
+
+def encode_kiosk_cursor(sort, order, sort_key, kiosk_id):
+    return base64.urlsafe_b64encode(json.dumps({"s": sort, "o": order, "k": [sort_key, kiosk_id]}).encode('utf-8')).decode('ascii')
+
+def decode_kiosk_cursor(cursor, sort, order):
+    data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    if not isinstance(data, dict) or data.get('s') != sort or data.get('o') != order:
+        raise ValueError('Kursor nie pasuje do sortowania')
+    key = data.get('k')
+    if not isinstance(key, list) or len(key) != 2 or not isinstance(key[1], int) or isinstance(key[0], (list, dict)):
+        raise ValueError('Nieprawidłowy kursor')
+    return tuple(key)
+
+def like_pattern(text):
+    return '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+# Relacje (grupy, tagi) dociągane jednym zapytaniem dla całej strony
+def kiosk_relations(conn, kiosk_ids, relation):
+    result = {kiosk_id: [] for kiosk_id in kiosk_ids}
+    if not kiosk_ids:
+        return result
+    placeholders = ', '.join('?' for _ in kiosk_ids)
+    if relation == 'groups':
+        rows = conn.execute(
+            f'SELECT kiosk_id, group_id AS value FROM kiosk_group_members WHERE kiosk_id IN ({placeholders}) ORDER BY group_id',
+            kiosk_ids
+        )
+    else:
+        rows = conn.execute(
+            f'SELECT kiosk_id, tag AS value FROM kiosk_tags WHERE kiosk_id IN ({placeholders}) ORDER BY tag', kiosk_ids
+        )
+    for row in rows:
+        result[row['kiosk_id']].append(row['value'])
+    return result
+
+@app.route('/api/kiosks/query', methods=['GET'])
+@token_required
+def query_kiosks():
+    args = request.args
+    sort = args.get('sort', 'id')
+    order = args.get('order', 'asc')
+    if sort not in KIOSK_QUERY_SORTS or order not in ('asc', 'desc'):
+        return jsonify({"error": "Nieprawidłowe sortowanie"}), 400
+    
+    fields = query_list(args.get('fields')) or list(KIOSK_QUERY_FIELDS)
+    unknown = [field for field in fields if field not in KIOSK_QUERY_FIELDS and field not in KIOSK_QUERY_RELATIONS]
+    if unknown:
+        return jsonify({"error": f"Nieznane pola: {', '.join(unknown)}"}), 400
+    
+    try:
+        limit = min(max(int(args.get('limit', KIOSK_QUERY_PAGE_DEFAULT)), 1), KIOSK_QUERY_PAGE_MAX)
+        group_ids = [int(group_id) for group_id in query_list(args.get('group'))]
+        after = decode_kiosk_cursor(args['cursor'], sort, order) if args.get('cursor') else None
+    except (ValueError, TypeError):
+        return jsonify({"error": "Nieprawidłowy parametr limit, group lub cursor"}), 400
+    
+    sort_expr = KIOSK_QUERY_SORTS[sort]
+    conditions = []
+    params = []
+    statuses = query_list(args.get('status'))
+    if statuses:
+        conditions.append(f'k.status IN ({", ".join("?" for _ in statuses)})')
+        params += statuses
+    if group_ids:
+        conditions.append(
+            f'k.id IN (SELECT kiosk_id FROM kiosk_group_members WHERE group_id IN ({", ".join("?" for _ in group_ids)}))'
+        )
+        params += group_ids
+    # Kiosk musi mieć wszystkie podane tagi
+    tags = list(OrderedDict.fromkeys(query_list(args.get('tag'))))
+    if tags:
+        conditions.append(
+            f'k.id IN (SELECT kiosk_id FROM kiosk_tags WHERE tag IN ({", ".join("?" for _ in tags)}) '
+            f'GROUP BY kiosk_id HAVING COUNT(*) = ?)'
+        )
+        params += tags + [len(tags)]
+    if args.get('q'):
+        conditions.append("(k.name LIKE ? ESCAPE '\\' OR k.ip_address LIKE ? ESCAPE '\\')")
+        params += [like_pattern(args['q'])] * 2
+    
+    conn = get_db_connection()
+    total = None
+    if args.get('include_total') in ('1', 'true'):
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        total = conn.execute(f'SELECT COUNT(*) FROM kiosks k{where}', params).fetchone()[0]
+    
+    # Kursor: (wartość sortowania, id) ostatniego kiosku poprzedniej strony. Warunek rozpisany
+    # zamiast (a, b) > (?, ?) - tylko taką postać SQLite zamienia na wyszukiwanie w indeksie
+    if after is not None:
+        op = '>' if order == 'asc' else '<'
+        if sort == 'id':
+            conditions.append(f'k.id {op} ?')
+            params.append(after[1])
+        else:
+            conditions.append(f'({sort_expr} {op} ? OR ({sort_expr} = ? AND k.id {op} ?))')
+            params += [after[0], after[0], after[1]]
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    direction = 'ASC' if order == 'asc' else 'DESC'
+    columns = ', '.join(f'k.{field}' for field in fields if field in KIOSK_QUERY_FIELDS)
+    rows = conn.execute(
+        f'SELECT {sort_expr} AS sort_key, k.id AS kiosk_id{", " + columns if columns else ""} FROM kiosks k{where} '
+        f'ORDER BY {sort_expr} {direction}, k.id {direction} LIMIT ?',
+        params + [limit + 1]
+    ).fetchall()
+    
+    page = rows[:limit]
+    kiosk_ids = [row['kiosk_id'] for row in page]
+    relations = {relation: kiosk_relations(conn, kiosk_ids, relation) for relation in KIOSK_QUERY_RELATIONS if relation in fields}
+    conn.close()
+    
+    kiosks = []
+    for row in page:
+        kiosk = {field: row[field] for field in fields if field in KIOSK_QUERY_FIELDS}
+        for relation, values in relations.items():
+            kiosk[relation] = values[row['kiosk_id']]
+        kiosks.append(kiosk)
+    
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_kiosk_cursor(sort, order, page[-1]['sort_key'], page[-1]['kiosk_id'])
+    result = {"kiosks": kiosks, "next_cursor": next_cursor}
+    if total is not None:
+        result["total"] = total
+    return jsonify(result)
+
+@app.route('/api/kiosks/<int:kiosk_id>/tags', methods=['PUT'])
+@token_required
+def set_kiosk_tags(kiosk_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        tags = normalize_tags(data.get('tags'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    conn = get_db_connection()
+    if not conn.execute('SELECT 1 FROM kiosks WHERE id = ?', (kiosk_id,)).fetchone():
+        conn.close()
+        return jsonify({"error": "Kiosk nie znaleziony"}), 404
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute('DELETE FROM kiosk_tags WHERE kiosk_id = ?', (kiosk_id,))
+    conn.executemany('INSERT INTO kiosk_tags (kiosk_id, tag) VALUES (?, ?)', [(kiosk_id, tag) for tag in tags])
+    conn.commit()
+    conn.close()
+    return jsonify({"kiosk_id": kiosk_id, "tags": sorted(tags)})
+
+@app.route('/api/kiosk-tags', methods=['GET'])
+@token_required
+def list_kiosk_tags():
+    conn = get_db_connection()
+    tags = conn.execute('SELECT tag, COUNT(*) AS kiosks FROM kiosk_tags GROUP BY tag ORDER BY tag').fetchall()
+    conn.close()
+    return jsonify([dict(tag) for tag in tags])
+
+# Buforowanie heartbeatów kiosków (write-behind)
+HEARTBEAT_FLUSH_INTERVAL = float(os.getenv('HEARTBEAT_FLUSH_INTERVAL', '2'))  # sekundy między zapisami do bazy
+KNOWN_SERIALS_REFRESH = 300  # pełne przeładowanie listy numerów seryjnych co 5 minut
+
+# Odstęp heartbeatów zalecany kioskom w odpowiedzi (agent dodaje do niego losowe przesunięcie).
+# Maksimum trzyma odstęp poniżej 2 minut, bo tyle obejmuje minutowa historia dostępności.
+HEARTBEAT_INTERVAL = int(os.getenv('HEARTBEAT_INTERVAL', '30'))
+HEARTBEAT_MAX_INTERVAL = int(os.getenv('HEARTBEAT_MAX_INTERVAL', '90'))
+HEARTBEAT_TARGET_RATE = float(os.getenv('HEARTBEAT_TARGET_RATE', '50'))  # docelowa liczba heartbeatów/s z całej floty
+
+# Keepalive (bez ip_address) nie zmienia zapisanego adresu IP
+HEARTBEAT_UPDATE_SQL = (
+    'UPDATE kiosks SET ip_address = COALESCE(?, ip_address), last_connection = ?, status = "online", updated_at = ?, '
+    'mac_address = COALESCE(NULLIF(?, ""), mac_address) WHERE serial_number = ?'
+)
+
+# Zbiór numerów seryjnych zarejestrowanych kiosków - heartbeaty nie odpytują bazy
+class KnownSerials:
+    def __init__(self):
+        self._serials = None
+        self._loaded_at = 0
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def reload(self):
+        with self._lock:
+            version = self._version
+        conn = get_db_connection()
+        rows = conn.execute('SELECT serial_number FROM kiosks').fetchall()
+        conn.close()
+        serials = {row['serial_number'] for row in rows}
+        with self._lock:
+            # Nie zapisuj danych, które zdążyły się zdezaktualizować w trakcie odczytu
+            if self._version == version:
+                self._serials = serials
+                self._loaded_at = time.monotonic()
+        return serials
+
+    def invalidate(self):
+        with self._lock:
+            self._serials = None
+            self._version += 1
+
+    def _current(self):
+        with self._lock:
+            serials = self._serials
+            if serials is not None and time.monotonic() - self._loaded_at > KNOWN_SERIALS_REFRESH:
+                serials = None
+        if serials is None:
+            serials = self.reload()
+        return serials
+
+    def contains(self, serial_number):
+        return serial_number in self._current()
+
+    def count(self):
+        return len(self._current())
+
+# Bufor ostatnich heartbeatów - kolejne zgłoszenia tego samego kiosku nadpisują się w pamięci,
+# a wątek w tle zapisuje je do bazy jedną transakcją co HEARTBEAT_FLUSH_INTERVAL sekund
+class HeartbeatBuffer:
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, serial_number, ip_address, mac_address, timestamp):
+        with self._lock:
+            if ip_address is None and serial_number in self._pending:
+                # Keepalive nie może nadpisać adresu z pełnego raportu czekającego na zapis
+                ip_address = self._pending[serial_number][0]
+            self._pending[serial_number] = (ip_address, timestamp, timestamp, mac_address or '', serial_number)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='heartbeat-flush', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Błąd zapisu heartbeatów: {e}")
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        rows = list(batch.values())
+        started = time.monotonic()
+        conn = get_db_connection()
+        try:
+            # Stan sprzed zapisu - do wykrycia zmian statusu i adresu IP (jedno zapytanie na paczkę)
+            conn.execute('BEGIN IMMEDIATE')
+            previous = {}
+            serials = list(batch)
+            for start in range(0, len(serials), 500):
+                chunk = serials[start:start + 500]
+                placeholders = ', '.join('?' for _ in chunk)
+                for kiosk in conn.execute(
+                    f'SELECT id, serial_number, ip_address, status FROM kiosks WHERE serial_number IN ({placeholders})', chunk
+                ):
+                    previous[kiosk['serial_number']] = kiosk
+            try:
+                conn.executemany(HEARTBEAT_UPDATE_SQL, rows)
+            except sqlite3.IntegrityError:
+                # Konflikt MAC w jednym wierszu nie może blokować całej paczki
+                conn.rollback()
+                conn.execute('BEGIN IMMEDIATE')
+                for row in rows:
+                    try:
+                        conn.execute(HEARTBEAT_UPDATE_SQL, row)
+                    except sqlite3.IntegrityError as e:
+                        print(f"Pominięto heartbeat kiosku {row[-1]}: {e}")
+                        previous.pop(row[-1], None)
+            # Historia heartbeatów - dopisywana w tej samej transakcji
+            conn.executemany(
+                'INSERT OR IGNORE INTO heartbeats (ts, kiosk_id) VALUES (?, ?)',
+                [(heartbeat_epoch(batch[serial_number][1]), kiosk['id']) for serial_number, kiosk in previous.items()]
+            )
+            conn.commit()
+            elapsed = time.monotonic() - started
+        except Exception:
+            conn.rollback()
+            # Przywróć niezapisane heartbeaty (nowsze zgłoszenia mają pierwszeństwo)
+            with self._lock:
+                for serial_number, row in batch.items():
+                    self._pending.setdefault(serial_number, row)
+            raise
+        # Paczka jest już zapisana - błąd poniżej nie może spowodować jej ponownego zapisu
+        kiosk_snapshot.invalidate()
+        kiosk_events.publish(heartbeat_events(previous, batch))
+        heartbeat_pacing.record_flush(elapsed)
+        return len(rows)
+
+# Zdarzenia tylko dla kiosków, które wróciły online lub zmieniły adres IP
+def heartbeat_events(previous, batch):
+    events = []
+    for serial_number, kiosk in previous.items():
+        ip_address, timestamp = batch[serial_number][0], batch[serial_number][1]
+        if kiosk['status'] != 'online':
+            events.append(kiosk_event('online', kiosk['id'], status='online', ip_address=ip_address or kiosk['ip_address'], last_connection=timestamp))
+        elif ip_address is not None and kiosk['ip_address'] != ip_address:
+            events.append(kiosk_event('ip_changed', kiosk['id'], ip_address=ip_address, last_connection=timestamp))
+    return events
+
+# Zalecany odstęp heartbeatów: rośnie z liczbą kiosków (docelowo HEARTBEAT_TARGET_RATE zgłoszeń/s)
+# i podwaja się, gdy zapis paczek heartbeatów do bazy nie nadąża za HEARTBEAT_FLUSH_INTERVAL
+class HeartbeatPacing:
+    def __init__(self):
+        self._flush_duration = 0.0
+        self._interval = None
+        self._computed_at = 0
+        self._recommended = []  # (czas, odstęp) zaleceń z ostatnich minut
+        self._lock = threading.Lock()
+
+    def record_flush(self, duration):
+        with self._lock:
+            self._flush_duration = 0.8 * self._flush_duration + 0.2 * duration
+
+    def interval(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._interval is not None and now - self._computed_at < 5:
+                return self._interval
+            flush_duration = self._flush_duration
+        interval = max(HEARTBEAT_INTERVAL, math.ceil(known_serials.count() / HEARTBEAT_TARGET_RATE))
+        if flush_duration > HEARTBEAT_FLUSH_INTERVAL / 2:
+            interval *= 2
+        interval = min(interval, HEARTBEAT_MAX_INTERVAL)
+        with self._lock:
+            self._interval, self._computed_at = interval, now
+            self._recommended = [(t, i) for t, i in self._recommended if now - t < 2 * HEARTBEAT_MAX_INTERVAL]
+            if not self._recommended or self._recommended[-1][1] != interval:
+                self._recommended.append((now, interval))
+        return interval
+
+    # Próg offline: kiosk pracujący według najdłuższego niedawnego zalecenia nie może zostać oznaczony jako offline
+    def offline_after(self):
+        with self._lock:
+            longest = max((i for _, i in self._recommended), default=HEARTBEAT_INTERVAL)
+        return max(KIOSK_OFFLINE_AFTER, 2 * longest)
+
+known_serials = KnownSerials()
+heartbeat_buffer = HeartbeatBuffer(HEARTBEAT_FLUSH_INTERVAL)
+heartbeat_pacing = HeartbeatPacing()
+atexit.register(heartbeat_buffer.flush)
+
 @app.route('/api/device/<string:serial_number>/ip', methods=['POST', 'PUT'])
 def update_device_ip(serial_number):
     # Obsługa zarówno metody POST jak i PUT
@@ -404,59 +1387,390 @@ def update_device_ip(serial_number):
     else:
         data = request.json or {}
 
-    ip_address = data.get('ip_address') or request.remote_addr
+    # Keepalive agenta ({"keepalive": true}) potwierdza tylko obecność - adres IP zostaje bez zmian
+    if data.get('keepalive'):
+        ip_address = None
+    else:
+        ip_address = data.get('ip_address') or request.remote_addr
     mac_address = data.get('mac_address', '')
 
-    conn = get_db_connection()
-
-    kiosk = conn.execute(
-        'SELECT * FROM kiosks WHERE serial_number = ?', 
-        (serial_number,)
-    ).fetchone()
-
-    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    if not kiosk:
-        # Zamykamy połączenie z bazą danych
-        conn.close()
+    if not known_serials.contains(serial_number):
         # Odrzucamy aktualizację IP dla niezarejestrowanych urządzeń
         return jsonify({
             "status": "error", 
             "message": "Kiosk o podanym numerze seryjnym nie jest zarejestrowany w systemie"
         }), 404
 
-    update_query = 'UPDATE kiosks SET ip_address = ?, last_connection = ?, status = ?, updated_at = ?'
-    update_params = [ip_address, now, 'online', now]
+    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    # Zapis do bazy odbywa się zbiorczo w tle
+    heartbeat_buffer.add(serial_number, ip_address, mac_address, now)
+
+    # Zwróć prostą odpowiedź JSON bez żadnych nagłówków sterujących; interval - zalecany odstęp w sekundach
+    return jsonify({"status": "ok", "action": "updated", "interval": heartbeat_pacing.interval()})
+
+HEARTBEAT_BULK_MAX_SAMPLES = 5000  # maks. liczba próbek w jednym zgłoszeniu zbiorczym
+HEARTBEAT_CLOCK_TOLERANCE = 5      # rozbieżność zegara kiosku (s), powyżej której próbki są przesuwane
+
+# Próbki heartbeatu zebrane przez agenta, gdy serwer był niedostępny - trafiają do historii dostępności
+# w jednej transakcji. Status i adres IP kiosku ustawia zwykły raport wysyłany przed zgłoszeniem zbiorczym.
+@app.route('/api/device/<string:serial_number>/heartbeats', methods=['POST'])
+def ingest_device_heartbeats(serial_number):
+    data = request.get_json(silent=True) or {}
+    samples = data.get('samples')
+    if not isinstance(samples, list) or not samples:
+        return jsonify({"status": "error", "message": "Brak próbek (samples)"}), 400
+    if len(samples) > HEARTBEAT_BULK_MAX_SAMPLES:
+        return jsonify({"status": "error", "message": f"Za dużo próbek (maks. {HEARTBEAT_BULK_MAX_SAMPLES})"}), 413
+    if not known_serials.contains(serial_number):
+        return jsonify({
+            "status": "error",
+            "message": "Kiosk o podanym numerze seryjnym nie jest zarejestrowany w systemie"
+        }), 404
 
-    if mac_address:
-        update_query += ', mac_address = ?'
-        update_params.append(mac_address)
+    # Raspberry Pi bez RTC po zaniku zasilania może mieć przesunięty zegar - korekta według chwili wysłania
+    now = int(time.time())
+    skew = 0
+    try:
+        skew = now - int(data.get('sent_at'))
+    except (TypeError, ValueError):
+        pass
+    if abs(skew) <= HEARTBEAT_CLOCK_TOLERANCE:
+        skew = 0
 
-    update_query += ' WHERE serial_number = ?'
-    update_params.append(serial_number)
+    # Próbki spoza okresu przechowywania surowych heartbeatów lub z przyszłości są pomijane
+    oldest = now - HEARTBEAT_RAW_RETENTION_DAYS * ROLLUP_DAY
+    timestamps = set()
+    for sample in samples:
+        try:
+            ts = int(sample['ts']) + skew
+        except (TypeError, ValueError, KeyError):
+            continue
+        if oldest <= ts <= now:
+            timestamps.add(ts)
 
-    conn.execute(update_query, update_params)
+    conn = get_db_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    kiosk = conn.execute('SELECT id FROM kiosks WHERE serial_number = ?', (serial_number,)).fetchone()
+    if not kiosk:
+        conn.rollback()
+        conn.close()
+        return jsonify({"status": "error", "message": "Kiosk o podanym numerze seryjnym nie jest zarejestrowany w systemie"}), 404
+    if timestamps:
+        conn.executemany(
+            'INSERT OR IGNORE INTO heartbeats (ts, kiosk_id) VALUES (?, ?)',
+            [(ts, kiosk['id']) for ts in sorted(timestamps)]
+        )
+        # Próbki sprzed znacznika agregacji nie zostaną już objęte przez wątek w tle - agregowane od razu
+        done_until = rollup_done_until(conn)
+        if done_until is not None:
+            since = min(timestamps) // ROLLUP_MINUTE * ROLLUP_MINUTE
+            until = min(done_until, max(timestamps) // ROLLUP_MINUTE * ROLLUP_MINUTE + 2 * ROLLUP_MINUTE)
+            if since < until:
+                rollup_range(conn, since, until, done_until, kiosk['id'])
     conn.commit()
     conn.close()
 
-    # Zwróć prostą odpowiedź JSON bez żadnych nagłówków sterujących
-    return jsonify({"status": "ok", "action": "updated"})
+    return jsonify({"status": "ok", "accepted": len(timestamps), "skipped": len(samples) - len(timestamps)})
 
-@app.route('/api/ftp/connect', methods=['POST'])
-@token_required
-def test_ftp_connection():
-    data = request.json
-    
-    if not data or 'hostname' not in data or 'username' not in data or 'password' not in data:
-        return jsonify({"error": "Brakujące dane połączenia FTP"}), 400
-    
-    # Konwersja portu na int
-    port = 21
-    if 'port' in data:
-        try:
-            port = int(data['port'])
-        except (ValueError, TypeError):
-            return jsonify({"error": "Port musi być liczbą całkowitą"}), 400
+# Historia dostępności kiosków. Surowe heartbeaty (tabela heartbeats) są agregowane do przedziałów
+# 1-minutowych, 1-godzinnych i 1-dniowych (heartbeat_rollups: minuty online i liczba przerw),
+# a starsze dane każdego poziomu są usuwane. Minuta jest "online", jeśli w niej lub w poprzedniej
+# minucie przyszedł heartbeat - kiosk wysyła je co 30 s, a wątek statusów uznaje go za offline po 60 s.
+ROLLUP_MINUTE = 60
+ROLLUP_HOUR = 3600
+ROLLUP_DAY = 86400
+HEARTBEAT_ROLLUP_INTERVAL = 60                                               # co ile sekund agregować nowe heartbeaty
+HEARTBEAT_RAW_RETENTION_DAYS = int(os.getenv('HEARTBEAT_RAW_RETENTION_DAYS', '7'))
+HEARTBEAT_RETENTION_DAYS = {                                                 # po ilu dniach usuwać przedziały
+    ROLLUP_MINUTE: int(os.getenv('HEARTBEAT_MINUTE_RETENTION_DAYS', '30')),
+    ROLLUP_HOUR: int(os.getenv('HEARTBEAT_HOUR_RETENTION_DAYS', '400')),
+    ROLLUP_DAY: None                                                         # przedziały dzienne trzymane bez limitu
+}
+UPTIME_MAX_BUCKETS = 2000                                                    # maks. liczba przedziałów na kiosk w zapytaniu
+
+def heartbeat_epoch(timestamp):
+    return int(datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').timestamp())
+
+def epoch_to_timestamp(epoch):
+    return datetime.datetime.fromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S')
+
+# Do którego momentu (epoch, pełne minuty) heartbeaty zostały zagregowane
+def rollup_done_until(conn):
+    row = conn.execute('SELECT done_until FROM heartbeat_rollup_state WHERE resolution = ?', (ROLLUP_MINUTE,)).fetchone()
+    return row[0] if row else None
+
+# Agreguje heartbeaty z zakresu [since, until) do przedziałów minutowych i przelicza dotknięte godziny i dni
+# (opcjonalnie tylko jednego kiosku). done_until to znacznik agregacji - minuty przed nim są zakończone,
+# więc wiadomo, czy po minucie online nastąpiła przerwa. Przerwa liczona jest w przedziale,
+# w którym wypada ostatnia minuta online przed nią. Każdy krok jest idempotentny.
+def rollup_range(conn, since, until, done_until, kiosk_id=None):
+    kiosk_filter = 'AND kiosk_id = :kiosk_id' if kiosk_id is not None else ''
+    params = {
+        'minute': ROLLUP_MINUTE, 'hour': ROLLUP_HOUR, 'day': ROLLUP_DAY,
+        'since': since, 'until': until, 'done_until': done_until, 'kiosk_id': kiosk_id,
+        # Przeliczane są przedziały od minuty przed since, bo dopiero teraz wiadomo, czy po niej była przerwa
+        'hour_start': (since - ROLLUP_MINUTE) // ROLLUP_HOUR * ROLLUP_HOUR,
+        'hour_end': -(-until // ROLLUP_HOUR) * ROLLUP_HOUR,
+        'day_start': (since - ROLLUP_MINUTE) // ROLLUP_DAY * ROLLUP_DAY,
+        'day_end': -(-until // ROLLUP_DAY) * ROLLUP_DAY
+    }
+
+    # Minuty: heartbeat oznacza swoją minutę i następną
+    conn.execute(
+        'INSERT OR IGNORE INTO heartbeat_rollups (resolution, kiosk_id, bucket, up_minutes) '
+        'SELECT DISTINCT :minute, kiosk_id, bucket, 1 FROM ('
+        f'    SELECT kiosk_id, ts / 60 * 60 AS bucket FROM heartbeats WHERE ts >= :since AND ts < :until {kiosk_filter}'
+        f'    UNION SELECT kiosk_id, ts / 60 * 60 + 60 FROM heartbeats WHERE ts >= :since - 60 AND ts < :until {kiosk_filter}'
+        ') WHERE bucket >= :since AND bucket < :until',
+        params
+    )
+    # Godziny z minut, dni z godzin
+    conn.execute(
+        'INSERT OR REPLACE INTO heartbeat_rollups (resolution, kiosk_id, bucket, up_minutes, outages) '
+        'SELECT :hour, kiosk_id, bucket / :hour * :hour, COUNT(*), '
+        'SUM(bucket + 60 < :done_until AND NOT EXISTS (SELECT 1 FROM heartbeat_rollups n '
+        'WHERE n.resolution = :minute AND n.kiosk_id = m.kiosk_id AND n.bucket = m.bucket + 60)) '
+        f'FROM heartbeat_rollups m WHERE resolution = :minute AND bucket >= :hour_start AND bucket < :hour_end {kiosk_filter} '
+        'GROUP BY kiosk_id, bucket / :hour',
+        params
+    )
+    conn.execute(
+        'INSERT OR REPLACE INTO heartbeat_rollups (resolution, kiosk_id, bucket, up_minutes, outages) '
+        'SELECT :day, kiosk_id, bucket / :day * :day, SUM(up_minutes), SUM(outages) '
+        f'FROM heartbeat_rollups WHERE resolution = :hour AND bucket >= :day_start AND bucket < :day_end {kiosk_filter} '
+        'GROUP BY kiosk_id, bucket / :day',
+        params
+    )
+
+# Agreguje heartbeaty od ostatniego przebiegu (wątek w tle co HEARTBEAT_ROLLUP_INTERVAL s)
+def rollup_heartbeats(now=None):
+    now = int(now if now is not None else time.time())
+    minute_end = now // ROLLUP_MINUTE * ROLLUP_MINUTE
+    conn = get_db_connection()
+    conn.execute('BEGIN IMMEDIATE')
+
+    since = rollup_done_until(conn)
+    if since is None:
+        first = conn.execute('SELECT MIN(ts) FROM heartbeats').fetchone()[0]
+        since = first // ROLLUP_MINUTE * ROLLUP_MINUTE if first is not None else minute_end
+    # Zapisywane są tylko minuty zakończone
+    rollup_range(conn, since, minute_end, minute_end)
+
+    conn.execute(
+        'INSERT INTO heartbeat_rollup_state (resolution, done_until) VALUES (?, ?) '
+        'ON CONFLICT(resolution) DO UPDATE SET done_until = excluded.done_until',
+        (ROLLUP_MINUTE, minute_end)
+    )
+    conn.commit()
+    conn.close()
+
+# Usuwa dane starsze niż okres przechowywania danego poziomu (surowe - tylko już zagregowane)
+def prune_heartbeat_history(now=None):
+    now = int(now if now is not None else time.time())
+    conn = get_db_connection()
+    done_until = rollup_done_until(conn) or 0
+    raw_cutoff = min(now - HEARTBEAT_RAW_RETENTION_DAYS * ROLLUP_DAY, done_until - ROLLUP_MINUTE)
+    conn.execute('DELETE FROM heartbeats WHERE ts < ?', (raw_cutoff,))
+    for resolution, days in HEARTBEAT_RETENTION_DAYS.items():
+        if days is not None:
+            conn.execute(
+                'DELETE FROM heartbeat_rollups WHERE resolution = ? AND bucket < ?',
+                (resolution, now - days * ROLLUP_DAY)
+            )
+    conn.commit()
+    conn.close()
+
+def heartbeat_rollup_worker():
+    last_prune = None
+    while True:
+        time.sleep(HEARTBEAT_ROLLUP_INTERVAL)
+        try:
+            rollup_heartbeats()
+            if last_prune is None or time.monotonic() - last_prune > 3600:
+                prune_heartbeat_history()
+                last_prune = time.monotonic()
+        except Exception as e:
+            print(f"Błąd agregacji historii heartbeatów: {e}")
+
+# Najdokładniejszy poziom, który jeszcze obejmuje początek zakresu i mieści się w limicie przedziałów
+def uptime_resolution(start, end, now):
+    for resolution in (ROLLUP_MINUTE, ROLLUP_HOUR):
+        days = HEARTBEAT_RETENTION_DAYS[resolution]
+        if start >= now - days * ROLLUP_DAY and (end - start) // resolution <= UPTIME_MAX_BUCKETS:
+            return resolution
+    return ROLLUP_DAY
+
+# Zakres z parametrów ?start=&end= (domyślnie ostatnie 7 dni), wyrównany do przedziałów wybranego poziomu
+# i obcięty do momentu, do którego dane są zagregowane
+def parse_uptime_range(conn):
+    now = int(time.time())
+    try:
+        end = request.args.get('end')
+        end = int(datetime.datetime.fromisoformat(end).timestamp()) if end else now
+        start = request.args.get('start')
+        start = int(datetime.datetime.fromisoformat(start).timestamp()) if start else end - 7 * ROLLUP_DAY
+    except ValueError:
+        raise ValueError('Nieprawidłowy format daty - użyj YYYY-MM-DD lub YYYY-MM-DD HH:MM:SS')
+    if start >= end:
+        raise ValueError('Początek zakresu musi być wcześniejszy niż koniec')
+    resolution = uptime_resolution(start, end, now)
+    start = start // resolution * resolution
+    end = max(min(end, rollup_done_until(conn) or start), start)
+    return start, end, resolution
+
+# Początek liczenia dostępności kiosku: jeśli historia kiosku zaczyna się w zakresie,
+# czas przed pierwszym heartbeatem nie jest liczony jako przerwa
+def uptime_start(start, first_bucket, history_start):
+    if first_bucket is not None and history_start is not None and first_bucket < history_start + ROLLUP_DAY:
+        return max(start, first_bucket)
+    return start
+
+# Przerwy z przedziałów minutowych (dokładne) lub godzinnych/dziennych (przedziały bez pełnego czasu online)
+def outage_intervals(buckets, start, end, resolution):
+    outages = []
+    cursor = start
+    for bucket, up_minutes in buckets:
+        if resolution == ROLLUP_MINUTE:
+            if bucket > cursor:
+                outages.append([cursor, bucket])
+            cursor = bucket + resolution
+            continue
+        expected = (min(bucket + resolution, end) - max(bucket, start)) // 60
+        if bucket > cursor:
+            outages.append([cursor, bucket])
+        if up_minutes < expected:
+            if outages and outages[-1][1] == bucket:
+                outages[-1][1] = bucket + resolution
+            else:
+                outages.append([bucket, bucket + resolution])
+        cursor = bucket + resolution
+    if cursor < end:
+        outages.append([cursor, end])
+    return [
+        {"start": epoch_to_timestamp(a), "end": epoch_to_timestamp(min(b, end)), "duration": min(b, end) - a}
+        for a, b in outages
+    ]
+
+@app.route('/api/kiosks/<int:kiosk_id>/uptime', methods=['GET'])
+@token_required
+def get_kiosk_uptime(kiosk_id):
+    conn = get_db_connection()
+    try:
+        start, end, resolution = parse_uptime_range(conn)
+    except ValueError as e:
+        conn.close()
+        return jsonify({"error": str(e)}), 400
+    
+    kiosk = conn.execute('SELECT id, name FROM kiosks WHERE id = ?', (kiosk_id,)).fetchone()
+    if not kiosk:
+        conn.close()
+        return jsonify({"error": "Kiosk nie znaleziony"}), 404
+    buckets = conn.execute(
+        'SELECT bucket, up_minutes, outages FROM heartbeat_rollups WHERE resolution = ? AND kiosk_id = ? AND bucket >= ? AND bucket < ? ORDER BY bucket',
+        (resolution, kiosk_id, start, end)
+    ).fetchall()
+    history_start = conn.execute(
+        'SELECT MIN(bucket) FROM heartbeat_rollups WHERE resolution = ? AND kiosk_id = ?', (ROLLUP_DAY, kiosk_id)
+    ).fetchone()[0]
+    conn.close()
+    
+    if not buckets:
+        return jsonify({
+            "kiosk_id": kiosk['id'],
+            "name": kiosk['name'],
+            "start": epoch_to_timestamp(start),
+            "end": epoch_to_timestamp(end),
+            "resolution": resolution,
+            "uptime_percent": None,
+            "up_minutes": 0,
+            "total_minutes": 0,
+            "outage_count": 0,
+            "outages": []
+        })
+    
+    start = uptime_start(start, buckets[0]['bucket'], history_start)
+    total_minutes = max((end - start) // 60, 1)
+    up_minutes = min(sum(row['up_minutes'] for row in buckets), total_minutes)
+    outages = outage_intervals([(row['bucket'], row['up_minutes']) for row in buckets], start, end, resolution)
+    # W przedziałach godzinnych/dziennych kilka przerw może się zlać w jeden przedział - liczba z agregatów
+    outage_count = len(outages) if resolution == ROLLUP_MINUTE else sum(row['outages'] for row in buckets)
+    
+    return jsonify({
+        "kiosk_id": kiosk['id'],
+        "name": kiosk['name'],
+        "start": epoch_to_timestamp(start),
+        "end": epoch_to_timestamp(end),
+        "resolution": resolution,
+        "uptime_percent": round(100 * up_minutes / total_minutes, 3),
+        "up_minutes": up_minutes,
+        "total_minutes": total_minutes,
+        "outage_count": outage_count,
+        "outages": outages
+    })
+
+# Dostępność całej floty w zakresie - kioski z największą liczbą przerw (niestabilne) na początku
+@app.route('/api/kiosks/uptime', methods=['GET'])
+@token_required
+def get_fleet_uptime():
+    conn = get_db_connection()
+    try:
+        start, end, resolution = parse_uptime_range(conn)
+    except ValueError as e:
+        conn.close()
+        return jsonify({"error": str(e)}), 400
+    
+    # Przerwy zapisywane są w przedziałach godzinnych i dziennych
+    outage_resolution = max(resolution, ROLLUP_HOUR)
+    rows = conn.execute(
+        'SELECT k.id, k.name, k.status, u.up_minutes, u.first_bucket, o.outages, '
+        '(SELECT MIN(bucket) FROM heartbeat_rollups h WHERE h.resolution = ? AND h.kiosk_id = k.id) AS history_start '
+        'FROM kiosks k '
+        'LEFT JOIN (SELECT kiosk_id, SUM(up_minutes) AS up_minutes, MIN(bucket) AS first_bucket FROM heartbeat_rollups '
+        'WHERE resolution = ? AND bucket >= ? AND bucket < ? GROUP BY kiosk_id) u ON u.kiosk_id = k.id '
+        'LEFT JOIN (SELECT kiosk_id, SUM(outages) AS outages FROM heartbeat_rollups '
+        'WHERE resolution = ? AND bucket >= ? AND bucket < ? GROUP BY kiosk_id) o ON o.kiosk_id = k.id',
+        (ROLLUP_DAY, resolution, start, end, outage_resolution, start // outage_resolution * outage_resolution, end)
+    ).fetchall()
+    conn.close()
+    
+    kiosks = []
+    for row in rows:
+        uptime_percent = None
+        if row['up_minutes']:
+            total_minutes = max((end - uptime_start(start, row['first_bucket'], row['history_start'])) // 60, 1)
+            uptime_percent = round(100 * min(row['up_minutes'], total_minutes) / total_minutes, 3)
+        kiosks.append({
+            "kiosk_id": row['id'],
+            "name": row['name'],
+            "status": row['status'],
+            "uptime_percent": uptime_percent,
+            "outage_count": row['outages'] or 0
+        })
+    kiosks.sort(key=lambda k: (-k['outage_count'], k['uptime_percent'] if k['uptime_percent'] is not None else 101))
+    
+    return jsonify({
+        "start": epoch_to_timestamp(start),
+        "end": epoch_to_timestamp(end),
+        "resolution": resolution,
+        "kiosks": kiosks
+    })
+
+@app.route('/api/ftp/connect', methods=['POST'])
+@token_required
+def test_ftp_connection():
+    data = request.json
+    
+    if not data or 'hostname' not in data or 'username' not in data or 'password' not in data:
+        return jsonify({"error": "Brakujące dane połączenia FTP"}), 400
+    
+    # Konwersja portu na int
+    port = 21
+    if 'port' in data:
+        try:
+            port = int(data['port'])
+        except (ValueError, TypeError):
+            return jsonify({"error": "Port musi być liczbą całkowitą"}), 400
     
     ftp = ftp_connect(data['hostname'], data['username'], data['password'], port)
     
@@ -466,6 +1780,266 @@ def test_ftp_connection():
     else:
         return jsonify({"error": "Nie można połączyć się z serwerem FTP"}), 500
 
+# Cache listingów katalogów FTP kluczowany (host, port, użytkownik, ścieżka).
+# Wpisy wygasają po FTP_LISTING_TTL sekundach lub są unieważniane przez operacje zmieniające katalog.
+FTP_LISTING_TTL = float(os.getenv('FTP_LISTING_TTL', '30'))
+FTP_LISTING_CACHE_SIZE = 256
+
+class DirectoryListingCache:
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(hostname, port, username, path):
+        return (hostname, port, username, posixpath.normpath(path))
+
+    def get(self, key, password):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            listing, etag, cached_password, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+        # Listing z cache tylko dla tych samych danych logowania
+        if not hmac.compare_digest(cached_password.encode('utf-8'), password.encode('utf-8')):
+            return None
+        return listing, etag
+
+    def put(self, key, password, files):
+        etag = '"' + hashlib.sha1(json.dumps(files, sort_keys=True).encode('utf-8')).hexdigest() + '"'
+        listing = CompactListing(files)
+        with self._lock:
+            self._entries[key] = (listing, etag, password, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return listing, etag
+
+    # Unieważnia katalogi nadrzędne zmienionych ścieżek (oraz same ścieżki i ich podkatalogi)
+    def invalidate(self, hostname, paths):
+        targets = [posixpath.normpath(path) for path in paths]
+        parents = {posixpath.dirname(path) for path in targets}
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] != hostname:
+                    continue
+                cached_path = key[3]
+                if cached_path in parents or any(cached_path == t or cached_path.startswith(t.rstrip('/') + '/') for t in targets):
+                    del self._entries[key]
+
+listing_cache = DirectoryListingCache(FTP_LISTING_TTL, FTP_LISTING_CACHE_SIZE)
+
+FTP_LISTING_SORT_FIELDS = ('name', 'size', 'modified')
+FTP_LISTING_PAGE_DEFAULT = 100
+FTP_LISTING_PAGE_MAX = 1000
+
+# Listing katalogu w postaci kolumnowej (osobna lista na każde pole) - zajmuje mniej pamięci
+# niż lista słowników, a posortowane klucze są liczone raz na listing i sposób sortowania
+class CompactListing:
+    __slots__ = ('paths', 'names', 'sizes', 'modified', 'is_dir', 'lower_names', '_sorted', '_lock')
+
+    def __init__(self, file_info):
+        self.paths = [f['path'] for f in file_info]
+        self.names = [f['name'] for f in file_info]
+        self.sizes = [f['size'] for f in file_info]
+        self.modified = [f['modified'] for f in file_info]
+        self.is_dir = [f['is_directory'] for f in file_info]
+        self.lower_names = [name.lower() for name in self.names]
+        self._sorted = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def row(self, i):
+        return {
+            "name": self.names[i],
+            "path": self.paths[i],
+            "is_directory": self.is_dir[i],
+            "size": self.sizes[i],
+            "modified": self.modified[i]
+        }
+
+    def to_list(self):
+        return [self.row(i) for i in range(len(self))]
+
+    def sort_key(self, i, sort, dirs_first):
+        value = {'name': self.lower_names, 'size': self.sizes, 'modified': self.modified}[sort][i]
+        return (not self.is_dir[i] if dirs_first else False, value, self.names[i])
+
+    # Posortowane rosnąco pary (klucz, indeks) - liczone przy pierwszym użyciu
+    def sorted_keys(self, sort, dirs_first):
+        cache_key = (sort, dirs_first)
+        with self._lock:
+            entry = self._sorted.get(cache_key)
+        if entry is None:
+            pairs = sorted((self.sort_key(i, sort, dirs_first), i) for i in range(len(self)))
+            entry = ([key for key, _ in pairs], [i for _, i in pairs])
+            with self._lock:
+                self._sorted[cache_key] = entry
+        return entry
+
+    def make_filter(self, extensions=None, name=None, is_directory=None):
+        name = name.lower() if name else None
+        def matches(i):
+            if is_directory is not None and self.is_dir[i] != is_directory:
+                return False
+            if name and name not in self.lower_names[i]:
+                return False
+            if extensions and (self.is_dir[i] or posixpath.splitext(self.lower_names[i])[1].lstrip('.') not in extensions):
+                return False
+            return True
+        return matches
+
+    def count(self, matches):
+        return sum(1 for i in range(len(self)) if matches(i))
+
+    # Strona wyników po kluczu ostatniego elementu poprzedniej strony (keyset) - stabilna,
+    # nawet jeśli między pobraniami stron w katalogu pojawią się lub znikną pliki
+    def page(self, sort, descending, dirs_first, after_key, limit, matches):
+        keys, order = self.sorted_keys(sort, dirs_first)
+        if descending:
+            # Katalogi nadal pierwsze - odwracana jest tylko kolejność wewnątrz grup
+            split = bisect.bisect_left(keys, (True,))
+            if after_key is None:
+                positions = itertools.chain(range(split - 1, -1, -1), range(len(keys) - 1, split - 1, -1))
+            else:
+                start = bisect.bisect_left(keys, after_key) - 1
+                if after_key[0]:
+                    positions = range(start, split - 1, -1)
+                else:
+                    positions = itertools.chain(range(start, -1, -1), range(len(keys) - 1, split - 1, -1))
+        else:
+            start = 0 if after_key is None else bisect.bisect_right(keys, after_key)
+            positions = range(start, len(keys))
+
+        rows = []
+        last_key = None
+        for position in positions:
+            i = order[position]
+            if not matches(i):
+                continue
+            if len(rows) == limit:
+                return rows, last_key
+            rows.append(self.row(i))
+            last_key = keys[position]
+        return rows, None
+
+def encode_listing_cursor(sort, order, dirs_first, key):
+    return base64.urlsafe_b64encode(json.dumps({"s": sort, "o": order, "d": dirs_first, "k": key}).encode('utf-8')).decode('ascii')
+
+def decode_listing_cursor(cursor, sort, order, dirs_first):
+    data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    if not isinstance(data, dict) or data.get('s') != sort or data.get('o') != order or data.get('d') != dirs_first:
+        raise ValueError('Kursor nie pasuje do sortowania')
+    if not isinstance(data.get('k'), list) or len(data['k']) != 3:
+        raise ValueError('Nieprawidłowy kursor')
+    return tuple(data['k'])
+
+# ETag strony listingu - zależy od całego listingu i od parametrów strony,
+# więc 304 dostaje tylko klient, który ma już dokładnie tę stronę
+def listing_page_etag(listing_etag, params):
+    key = listing_etag + json.dumps(params, sort_keys=True)
+    return '"' + hashlib.sha1(key.encode('utf-8')).hexdigest() + '"'
+
+# Wywoływane po każdej operacji zmieniającej pliki na kiosku
+def ftp_paths_changed(hostname, paths, recursive=False):
+    listing_cache.invalidate(hostname, paths)
+    manifest_forget(hostname, paths, recursive=recursive)
+    schedule_store.forget(hostname, paths, recursive=recursive)
+
+# Serwery, które nie obsługują MLSD (np. vsftpd) - dla nich od razu używany jest LIST
+ftp_mlsd_unsupported = set()
+
+def parse_mlsd_entries(entries, remote_path):
+    file_info = []
+    for name, facts in entries:
+        entry_type = facts.get('type', '')
+        if entry_type in ('cdir', 'pdir') or name in ('.', '..'):
+            continue
+        try:
+            size_num = int(facts.get('size', 0))
+        except ValueError:
+            size_num = 0
+        try:
+            # MLSD podaje czas w UTC - konwersja na czas lokalny, jak w LIST
+            mod_date = datetime.datetime.strptime(facts['modify'][:14], '%Y%m%d%H%M%S')
+            modified = mod_date.replace(tzinfo=datetime.timezone.utc).astimezone().strftime('%Y-%m-%d %H:%M:%S')
+        except (KeyError, ValueError):
+            modified = "Nieznana data"
+        file_info.append({
+            "name": name,
+            "path": os.path.join(remote_path, name),
+            "is_directory": entry_type == 'dir',
+            "size": size_num,
+            "modified": modified
+        })
+    return file_info
+
+def parse_list_lines(lines, remote_path):
+    current_year = datetime.datetime.now().year
+    file_info = []
+    for line in lines:
+        # Parsujemy dane z formatu DIR - typowy format Unix
+        parts = line.split(None, 8)
+        if len(parts) < 9:
+            continue
+            
+        permissions = parts[0]
+        size = parts[4]
+        date_str = f"{parts[5]} {parts[6]} {parts[7]}"
+        name = parts[8]
+        
+        # Sprawdzanie, czy to katalog (pierwszy znak permissions to 'd')
+        is_dir = permissions.startswith('d')
+        
+        try:
+            # Próba przekształcenia rozmiaru na liczbę
+            size_num = int(size)
+        except ValueError:
+            size_num = 0
+            
+        # Tworzenie ścieżki
+        full_path = os.path.join(remote_path, name)
+            
+        # Formatowanie daty modyfikacji
+        try:
+            if ':' in parts[7]:  # Format "Oct 14 13:45" (rok bieżący)
+                mod_date = datetime.datetime.strptime(f"{date_str} {current_year}", "%b %d %H:%M %Y")
+            else:  # Format "Oct 14 2022" (rok podany)
+                mod_date = datetime.datetime.strptime(date_str, "%b %d %Y")
+            modified = mod_date.strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            modified = "Nieznana data"
+            
+        file_info.append({
+            "name": name,
+            "path": full_path,
+            "is_directory": is_dir,
+            "size": size_num,
+            "modified": modified
+        })
+    return file_info
+
+# Listing katalogu - MLSD (ustrukturyzowany, bez parsowania dat), a gdy serwer go nie obsługuje - LIST
+def ftp_list_directory(ftp, remote_path):
+    ftp.cwd(remote_path)
+    if ftp.host not in ftp_mlsd_unsupported:
+        try:
+            return parse_mlsd_entries(ftp.mlsd(facts=['type', 'size', 'modify']), remote_path)
+        except ftplib.error_perm as e:
+            if str(e)[:3] not in ('500', '501', '502', '504'):
+                raise
+            ftp_mlsd_unsupported.add(ftp.host)
+    lines = []
+    ftp.dir(lines.append)
+    return parse_list_lines(lines, remote_path)
+
 @app.route('/api/ftp/files', methods=['POST'])
 @token_required
 def list_ftp_files():
@@ -484,70 +2058,91 @@ def list_ftp_files():
         except (ValueError, TypeError):
             return jsonify({"error": "Port musi być liczbą całkowitą"}), 400
     
-    ftp = ftp_connect(data['hostname'], data['username'], data['password'], port)
+    # Stronicowanie, sortowanie i filtrowanie po stronie serwera (opcjonalne - bez tych
+    # parametrów zwracana jest cała lista, jak dotychczas)
+    paginated = any(field in data for field in ('limit', 'cursor', 'sort', 'order', 'extension', 'name', 'is_directory', 'include_total'))
+    if paginated:
+        sort = data.get('sort', 'name')
+        order = data.get('order', 'asc')
+        if sort not in FTP_LISTING_SORT_FIELDS or order not in ('asc', 'desc'):
+            return jsonify({"error": f"Nieprawidłowe sortowanie. Dozwolone pola: {', '.join(FTP_LISTING_SORT_FIELDS)}, kolejność: asc/desc"}), 400
+        try:
+            limit = min(max(int(data.get('limit', FTP_LISTING_PAGE_DEFAULT)), 1), FTP_LISTING_PAGE_MAX)
+        except (ValueError, TypeError):
+            return jsonify({"error": "Limit musi być liczbą całkowitą"}), 400
+        dirs_first = data.get('dirs_first', True)
+        if isinstance(dirs_first, str):
+            dirs_first = dirs_first.lower() == 'true'
+        dirs_first = bool(dirs_first)
+        after_key = None
+        if data.get('cursor'):
+            try:
+                after_key = decode_listing_cursor(data['cursor'], sort, order, dirs_first)
+            except Exception:
+                return jsonify({"error": "Nieprawidłowy kursor"}), 400
+        extensions = data.get('extension')
+        if isinstance(extensions, str):
+            extensions = [e for e in extensions.split(',') if e.strip()]
+        extensions = {e.strip().lower().lstrip('.') for e in extensions} if extensions else None
+        is_directory = data.get('is_directory')
+        if isinstance(is_directory, str):
+            is_directory = is_directory.lower() == 'true'
     
-    if not ftp:
-        return jsonify({"error": "Nie można połączyć się z serwerem FTP"}), 500
+    cache_key = DirectoryListingCache.key(data['hostname'], port, data['username'], remote_path)
+    cached = None if data.get('refresh') else listing_cache.get(cache_key, data['password'])
     
-    try:
-        # Zmieniamy katalog na podany
-        ftp.cwd(remote_path)
+    if cached:
+        listing, etag = cached
+    else:
+        ftp = ftp_connect(data['hostname'], data['username'], data['password'], port)
         
-        # Pobieramy listę plików i katalogów
-        files = []
-        ftp.dir(lambda line: files.append(line))
+        if not ftp:
+            return jsonify({"error": "Nie można połączyć się z serwerem FTP"}), 500
         
-        file_info = []
-        for line in files:
-            # Parsujemy dane z formatu DIR - typowy format Unix
-            parts = line.split(None, 8)
-            if len(parts) < 9:
-                continue
-                
-            permissions = parts[0]
-            size = parts[4]
-            date_str = f"{parts[5]} {parts[6]} {parts[7]}"
-            name = parts[8]
-            
-            # Sprawdzanie, czy to katalog (pierwszy znak permissions to 'd')
-            is_dir = permissions.startswith('d')
-            
-            try:
-                # Próba przekształcenia rozmiaru na liczbę
-                size_num = int(size)
-            except ValueError:
-                size_num = 0
-                
-            # Tworzenie ścieżki
-            full_path = os.path.join(remote_path, name)
-                
-            # Formatowanie daty modyfikacji
-            try:
-                if ':' in parts[7]:  # Format "Oct 14 13:45" (rok bieżący)
-                    current_year = datetime.datetime.now().year
-                    mod_date = datetime.datetime.strptime(f"{date_str} {current_year}", "%b %d %H:%M %Y")
-                else:  # Format "Oct 14 2022" (rok podany)
-                    mod_date = datetime.datetime.strptime(date_str, "%b %d %Y")
-                modified = mod_date.strftime('%Y-%m-%d %H:%M:%S')
-            except ValueError:
-                modified = "Nieznana data"
-                
-            file_info.append({
-                "name": name,
-                "path": full_path,
-                "is_directory": is_dir,
-                "size": size_num,
-                "modified": modified
-            })
-                
-        ftp.quit()
-        return jsonify(file_info)
-    except Exception as e:
         try:
+            file_info = ftp_list_directory(ftp, remote_path)
             ftp.quit()
-        except:
-            pass
-        return jsonify({"error": f"Błąd podczas listowania plików: {str(e)}"}), 500
+        except Exception as e:
+            try:
+                ftp.quit()
+            except:
+                pass
+            return jsonify({"error": f"Błąd podczas listowania plików: {str(e)}"}), 500
+        
+        listing, etag = listing_cache.put(cache_key, data['password'], file_info)
+        manifest_reconcile(data['hostname'], remote_path, file_info)
+    
+    if paginated:
+        etag = listing_page_etag(etag, {
+            "sort": sort, "order": order, "dirs_first": dirs_first, "limit": limit,
+            "cursor": list(after_key) if after_key else None,
+            "extension": sorted(extensions) if extensions else None,
+            "name": data.get('name'), "is_directory": is_directory,
+            "include_total": bool(data.get('include_total'))
+        })
+    
+    # Klient z aktualnym listingiem (lub stroną) dostaje 304 bez treści
+    if request.headers.get('If-None-Match') == etag:
+        response = app.response_class(status=304)
+    elif paginated:
+        matches = listing.make_filter(extensions, data.get('name'), is_directory)
+        try:
+            rows, last_key = listing.page(sort, order == 'desc', dirs_first, after_key, limit, matches)
+        except TypeError:
+            return jsonify({"error": "Nieprawidłowy kursor"}), 400
+        result = {
+            "files": rows,
+            "path": remote_path,
+            "next_cursor": encode_listing_cursor(sort, order, dirs_first, list(last_key)) if last_key else None
+        }
+        if data.get('include_total'):
+            result["total"] = listing.count(matches)
+        response = jsonify(result)
+    else:
+        response = jsonify(listing.to_list())
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/ftp/upload', methods=['POST'])
 @token_required
@@ -582,6 +2177,14 @@ def upload_ftp_file():
     except Exception as e:
         return jsonify({"error": f"Błąd dekodowania danych pliku: {str(e)}"}), 400
     
+    # Wysyłka w tle - plik czeka na swoją kolej w magazynie multimediów
+    if wants_background(data):
+        sha256, size = store_request_file(file_name, io.BytesIO(file_bytes))
+        try:
+            return submit_ftp_job('ftp_upload', data, port, path=remote_path, file_name=file_name, sha256=sha256, size=size)
+        finally:
+            media_store.unpin(sha256)
+    
     # Połączenie z serwerem FTP
     ftp = ftp_connect(data['hostname'], data['username'], data['password'], port)
     
@@ -605,6 +2208,7 @@ def upload_ftp_file():
         os.remove(temp_file_path)
         
         ftp.quit()
+        ftp_paths_changed(data['hostname'], [posixpath.join(remote_path, file_name)])
         return jsonify({"message": f"Plik {file_name} został pomyślnie przesłany"})
     except Exception as e:
         try:
@@ -620,112 +2224,1714 @@ def upload_ftp_file():
             
         return jsonify({"error": f"Błąd podczas przesyłania pliku: {str(e)}"}), 500
 
-@app.route('/api/ftp/delete', methods=['POST'])
+# Przesyłanie pliku strumieniowo - treść żądania (surowe bajty pliku) trafia prosto do STOR
+# porcjami o stałym rozmiarze, bez base64, kopii w pamięci i pliku tymczasowego
+@app.route('/api/ftp/upload-stream', methods=['POST', 'PUT'])
 @token_required
-def delete_ftp_file():
-    data = request.json
+def upload_ftp_file_stream():
+    hostname = request.args.get('hostname')
+    username = request.args.get('username')
+    # Hasło w nagłówku (zakodowane jak w URL), a nie w query - nie trafia do logów dostępu serwera i proxy
+    password = unquote(request.headers.get('X-FTP-Password', ''))
+    remote_path = request.args.get('path', '/home/kiosk/MediaPionowe')
+    file_name = request.args.get('file_name')
     
-    if not data or 'hostname' not in data or 'username' not in data or 'password' not in data or 'path' not in data:
-        return jsonify({"error": "Brakujące dane do usunięcia pliku"}), 400
+    if not hostname or not username or not password:
+        return jsonify({"error": "Brakujące dane do przesłania pliku"}), 400
     
-    file_path = data['path']
-    is_directory = data.get('is_directory', False)
+    if not file_name or '/' in file_name or '\\' in file_name:
+        return jsonify({"error": "Brak lub nieprawidłowa nazwa pliku"}), 400
     
     # Konwersja portu na int
-    port = 21
-    if 'port' in data:
+    try:
+        port = int(request.args.get('port', 21))
+    except (ValueError, TypeError):
+        return jsonify({"error": "Port musi być liczbą całkowitą"}), 400
+    
+    if wants_background():
         try:
-            port = int(data['port'])
-        except (ValueError, TypeError):
-            return jsonify({"error": "Port musi być liczbą całkowitą"}), 400
+            sha256, size = store_request_file(file_name)
+        except Exception as e:
+            return jsonify({"error": f"Błąd podczas odbierania pliku: {str(e)}"}), 500
+        connection = {"hostname": hostname, "username": username, "password": password}
+        try:
+            return submit_ftp_job('ftp_upload', connection, port, path=remote_path, file_name=file_name, sha256=sha256, size=size)
+        finally:
+            media_store.unpin(sha256)
     
     # Połączenie z serwerem FTP
-    ftp = ftp_connect(data['hostname'], data['username'], data['password'], port)
+    ftp = ftp_connect(hostname, username, password, port)
     
     if not ftp:
         return jsonify({"error": "Nie można połączyć się z serwerem FTP"}), 500
     
     try:
-        # Usunięcie pliku lub katalogu
-        result = ftp_delete_file(ftp, file_path, is_directory)
+        # Zmieniamy katalog na podany
+        ftp.cwd(remote_path)
         
-        ftp.quit()
+        transferred = 0
+        def count_block(block):
+            nonlocal transferred
+            transferred += len(block)
         
-        if result:
-            return jsonify({"message": f"{'Katalog' if is_directory else 'Plik'} został pomyślnie usunięty"})
-        else:
-            return jsonify({"error": f"Nie można usunąć {'katalogu' if is_directory else 'pliku'}"}), 500
+        ftp.storbinary(f'STOR {file_name}', request.stream, blocksize=FTP_STREAM_CHUNK_SIZE, callback=count_block)
+        
+        ftp.quit()
+        ftp_paths_changed(hostname, [posixpath.join(remote_path, file_name)])
+        return jsonify({
+            "message": f"Plik {file_name} został pomyślnie przesłany",
+            "size": transferred
+        })
     except Exception as e:
         try:
             ftp.quit()
         except:
             pass
-        return jsonify({"error": f"Błąd podczas usuwania: {str(e)}"}), 500
+        return jsonify({"error": f"Błąd podczas przesyłania pliku: {str(e)}"}), 500
 
-@app.route('/api/ftp/delete-multiple', methods=['POST'])
-@token_required
-def delete_multiple_ftp_files():
-    data = request.json
-    
-    if not data or 'hostname' not in data or 'username' not in data or 'password' not in data or 'files' not in data:
-        return jsonify({"error": "Brakujące dane do usunięcia plików"}), 400
-    
-    files = data['files']
-    
-    if not isinstance(files, list) or len(files) == 0:
-        return jsonify({"error": "Lista plików do usunięcia jest pusta lub nieprawidłowa"}), 400
-    
-    # Konwersja portu na int
-    port = 21
-    if 'port' in data:
+# Magazyn plików multimedialnych adresowanych treścią (klucz SHA-256) z usuwaniem
+# najdawniej używanych plików po przekroczeniu budżetu dyskowego
+MEDIA_STORE_DIR = os.getenv('MEDIA_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media_store'))
+MEDIA_STORE_BUDGET_MB = int(os.getenv('MEDIA_STORE_BUDGET_MB', '10240'))
+
+class MediaStore:
+    def __init__(self, root, budget_bytes):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self._pinned = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    # Zapisuje strumień do magazynu, licząc skrót w trakcie zapisu - zwraca (sha256, rozmiar).
+    # Plik jest przypięty, zanim stanie się widoczny (evict() go nie usunie) - wywołujący zwalnia go przez unpin()
+    def add_stream(self, stream, original_name):
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
         try:
-            port = int(data['port'])
-        except (ValueError, TypeError):
-            return jsonify({"error": "Port musi być liczbą całkowitą"}), 400
-    
-    # Połączenie z serwerem FTP
-    ftp = ftp_connect(data['hostname'], data['username'], data['password'], port)
-    
-    if not ftp:
-        return jsonify({"error": "Nie można połączyć się z serwerem FTP"}), 500
-    
-    try:
-        results = []
-        for file_info in files:
-            path = file_info.get('path')
-            is_directory = file_info.get('isDirectory', False)
-            
-            if not path:
-                results.append({"path": "Nieznana ścieżka", "success": False, "error": "Brak ścieżki"})
-                continue
-                
+            with os.fdopen(fd, 'wb') as file:
+                while True:
+                    chunk = stream.read(FTP_STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    file.write(chunk)
+                    size += len(chunk)
+            sha256 = digest.hexdigest()
+        except Exception:
             try:
-                result = ftp_delete_file(ftp, path, is_directory)
-                results.append({"path": path, "success": result, "is_directory": is_directory})
-            except Exception as e:
-                results.append({"path": path, "success": False, "error": str(e), "is_directory": is_directory})
-        
-        ftp.quit()
-        
-        # Sprawdź, czy były jakieś błędy
-        had_errors = any(not r['success'] for r in results)
-        
-        if had_errors:
-            return jsonify({
-                "message": "Niektóre pliki nie zostały usunięte",
-                "results": results
-            }), 207  # 207 Multi-Status
-        else:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        self.pin(sha256)
+        try:
+            final_path = self.path_for(sha256)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            if os.path.exists(final_path):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, final_path)
+            now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            conn = get_db_connection()
+            conn.execute(
+                'INSERT INTO media_files (sha256, size, original_name, created_at, last_used) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(sha256) DO UPDATE SET last_used = excluded.last_used',
+                (sha256, size, original_name, now, now)
+            )
+            conn.commit()
+            conn.close()
+        except Exception:
+            self.unpin(sha256)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return sha256, size
+
+    def get(self, sha256):
+        conn = get_db_connection()
+        row = conn.execute('SELECT sha256, size, original_name FROM media_files WHERE sha256 = ?', (sha256,)).fetchone()
+        conn.close()
+        if row and os.path.exists(self.path_for(sha256)):
+            return dict(row)
+        return None
+
+    def touch(self, sha256):
+        conn = get_db_connection()
+        conn.execute(
+            'UPDATE media_files SET last_used = ? WHERE sha256 = ?',
+            (datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), sha256)
+        )
+        conn.commit()
+        conn.close()
+
+    # Pliki używane przez trwające zadania nie mogą zostać usunięte
+    def pin(self, sha256):
+        with self._lock:
+            self._pinned[sha256] = self._pinned.get(sha256, 0) + 1
+
+    def unpin(self, sha256):
+        with self._lock:
+            self._pinned[sha256] -= 1
+            if not self._pinned[sha256]:
+                del self._pinned[sha256]
+
+    def evict(self):
+        conn = get_db_connection()
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM media_files').fetchone()[0]
+        if total <= self.budget_bytes:
+            conn.close()
+            return 0
+        removed = 0
+        for row in conn.execute('SELECT sha256, size FROM media_files ORDER BY last_used').fetchall():
+            if total <= self.budget_bytes:
+                break
+            # Plik i wpis usuwane razem pod blokadą - add_stream() przypina plik przed jego zapisem
+            with self._lock:
+                if row['sha256'] in self._pinned:
+                    continue
+                try:
+                    os.remove(self.path_for(row['sha256']))
+                except FileNotFoundError:
+                    pass
+                conn.execute('DELETE FROM media_files WHERE sha256 = ?', (row['sha256'],))
+            total -= row['size']
+            removed += 1
+        conn.commit()
+        conn.close()
+        return removed
+
+media_store = MediaStore(MEDIA_STORE_DIR, MEDIA_STORE_BUDGET_MB * 1024 * 1024)
+
+# Manifest plików na kioskach - co (jaki skrót) zostało wysłane pod daną ścieżkę
+def manifest_lookup(kiosk_id, remote_file):
+    conn = get_db_connection()
+    row = conn.execute('SELECT sha256, size FROM kiosk_media WHERE kiosk_id = ? AND path = ?', (kiosk_id, remote_file)).fetchone()
+    conn.close()
+    return row
+
+def manifest_record(kiosk_id, remote_file, sha256, size):
+    conn = get_db_connection()
+    conn.execute(
+        'INSERT OR REPLACE INTO kiosk_media (kiosk_id, path, sha256, size, synced_at) VALUES (?, ?, ?, ?, ?)',
+        (kiosk_id, remote_file, sha256, size, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    )
+    conn.commit()
+    conn.close()
+
+# Usuwa z manifestu ścieżki zmienione poza synchronizacją (usunięte, nadpisane) na kiosku o danym IP
+def manifest_forget(hostname, paths, recursive=False):
+    conn = get_db_connection()
+    for path in paths:
+        conn.execute(
+            'DELETE FROM kiosk_media WHERE kiosk_id IN (SELECT id FROM kiosks WHERE ip_address = ?) AND path = ?',
+            (hostname, path)
+        )
+        if recursive:
+            conn.execute(
+                'DELETE FROM kiosk_media WHERE kiosk_id IN (SELECT id FROM kiosks WHERE ip_address = ?) AND substr(path, 1, ?) = ?',
+                (hostname, len(path.rstrip('/')) + 1, path.rstrip('/') + '/')
+            )
+    conn.commit()
+    conn.close()
+
+# Porównuje manifest z bieżącym listingiem katalogu - wpisy plików, których już nie ma
+# lub które mają inny rozmiar, są usuwane (zostaną wysłane ponownie przy synchronizacji)
+def manifest_reconcile(hostname, remote_path, file_info):
+    directory = remote_path.rstrip('/') + '/'
+    present = {posixpath.join(directory, f['name']): f['size'] for f in file_info if not f['is_directory']}
+    conn = get_db_connection()
+    rows = conn.execute(
+        'SELECT kiosk_id, path, size FROM kiosk_media '
+        'WHERE kiosk_id IN (SELECT id FROM kiosks WHERE ip_address = ?) AND substr(path, 1, ?) = ?',
+        (hostname, len(directory), directory)
+    ).fetchall()
+    stale = [
+        (row['kiosk_id'], row['path']) for row in rows
+        if '/' not in row['path'][len(directory):] and present.get(row['path']) != row['size']
+    ]
+    if stale:
+        conn.executemany('DELETE FROM kiosk_media WHERE kiosk_id = ? AND path = ?', stale)
+        conn.commit()
+    conn.close()
+
+# Dystrybucja plików do wielu kiosków - pliki z magazynu są wysyłane równolegle na FTP
+# każdego kiosku z danymi zapisanymi w tabeli kiosks; pliki już obecne są pomijane
+DISTRIBUTE_WORKERS = int(os.getenv('DISTRIBUTE_WORKERS', '16'))  # maks. liczba równoległych wysyłek
+DISTRIBUTE_JOBS_KEPT = 50                                         # ile ostatnich zadań trzymać w pamięci
+
+distribute_executor = ThreadPoolExecutor(max_workers=DISTRIBUTE_WORKERS, thread_name_prefix='distribute')
+
+class DistributionJob:
+    def __init__(self, files, remote_path, kiosk_ids):
+        self.id = uuid.uuid4().hex
+        self.files = files
+        self.remote_path = remote_path
+        self.created_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.finished_at = None
+        self.results = OrderedDict(
+            (kiosk_id, {
+                "kiosk_id": kiosk_id, "name": None, "status": "pending",
+                "transferred": 0, "uploaded": 0, "skipped": 0, "error": None
+            })
+            for kiosk_id in kiosk_ids
+        )
+        self._remaining = len(self.results)
+        self._lock = threading.Lock()
+        for item in files:
+            media_store.pin(item['sha256'])
+
+    def update(self, kiosk_id, **fields):
+        with self._lock:
+            self.results[kiosk_id].update(fields)
+
+    def add_progress(self, kiosk_id, size):
+        with self._lock:
+            self.results[kiosk_id]['transferred'] += size
+
+    def count(self, kiosk_id, field):
+        with self._lock:
+            self.results[kiosk_id][field] += 1
+
+    def finish_kiosk(self, kiosk_id, **fields):
+        with self._lock:
+            self.results[kiosk_id].update(fields)
+            self._remaining -= 1
+            finished = self._remaining == 0
+            if finished:
+                self.finished_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # Po obsłużeniu wszystkich kiosków pliki mogą zostać usunięte z magazynu
+        if finished:
+            for item in self.files:
+                media_store.unpin(item['sha256'])
+
+    def to_dict(self):
+        with self._lock:
+            kiosks = [dict(result) for result in self.results.values()]
+            remaining = self._remaining
+        done = sum(1 for k in kiosks if k['status'] == 'done')
+        if remaining:
+            status = 'running'
+        elif done == len(kiosks):
+            status = 'done'
+        else:
+            status = 'error' if done == 0 else 'partial'
+        return {
+            "id": self.id,
+            "files": self.files,
+            "path": self.remote_path,
+            "size": sum(item['size'] for item in self.files),
+            "status": status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "done": done,
+            "failed": sum(1 for k in kiosks if k['status'] == 'error'),
+            "total": len(kiosks),
+            "kiosks": kiosks
+        }
+
+distribution_jobs = OrderedDict()
+distribution_jobs_lock = threading.Lock()
+
+# Hasło FTP kiosku może być zapisane w postaci zaszyfrowanej (prefiks ENC:)
+def kiosk_ftp_password(kiosk):
+    password = kiosk['ftp_password'] or ''
+    if password.startswith('ENC:'):
+        password = decrypt_data(password[4:])
+    return password
+
+# Plik jest aktualny, jeśli manifest wskazuje ten sam skrót, a serwer potwierdza rozmiar
+def kiosk_has_file(ftp, kiosk_id, remote_file, item):
+    synced = manifest_lookup(kiosk_id, remote_file)
+    if not synced or synced['sha256'] != item['sha256']:
+        return False
+    try:
+        return ftp.size(remote_file) == item['size']
+    except ftplib.error_perm:
+        return False
+
+def distribute_to_kiosk(job, kiosk, port):
+    kiosk_id = kiosk['id']
+    job.update(kiosk_id, status='uploading')
+    
+    ftp = ftp_connect(kiosk['ip_address'], kiosk['ftp_username'], kiosk_ftp_password(kiosk), port)
+    if not ftp:
+        job.finish_kiosk(kiosk_id, status='error', error='Nie można połączyć się z serwerem FTP')
+        return
+    
+    try:
+        ftp.cwd(job.remote_path)
+        ftp.voidcmd('TYPE I')
+        for item in job.files:
+            remote_file = posixpath.join(job.remote_path, item['file_name'])
+            if kiosk_has_file(ftp, kiosk_id, remote_file, item):
+                job.count(kiosk_id, 'skipped')
+                continue
+            with open(media_store.path_for(item['sha256']), 'rb') as file:
+                ftp.storbinary(
+                    f'STOR {item["file_name"]}', file,
+                    blocksize=FTP_STREAM_CHUNK_SIZE,
+                    callback=lambda block: job.add_progress(kiosk_id, len(block))
+                )
+            manifest_record(kiosk_id, remote_file, item['sha256'], item['size'])
+            listing_cache.invalidate(kiosk['ip_address'], [remote_file])
+            job.count(kiosk_id, 'uploaded')
+        ftp.quit()
+        job.finish_kiosk(kiosk_id, status='done')
+    except Exception as e:
+        try:
+            ftp.quit()
+        except:
+            pass
+        job.finish_kiosk(kiosk_id, status='error', error=str(e))
+
+def start_distribution(files, remote_path, kiosk_ids):
+    conn = get_db_connection()
+    placeholders = ', '.join('?' for _ in kiosk_ids)
+    kiosks = conn.execute(
+        f'SELECT id, name, ip_address, ftp_username, ftp_password FROM kiosks WHERE id IN ({placeholders})',
+        kiosk_ids
+    ).fetchall()
+    ftp_port = default_ftp_port(conn)
+    conn.close()
+    
+    job = DistributionJob(files, remote_path, kiosk_ids)
+    with distribution_jobs_lock:
+        distribution_jobs[job.id] = job
+        while len(distribution_jobs) > DISTRIBUTE_JOBS_KEPT:
+            distribution_jobs.popitem(last=False)
+    
+    for item in files:
+        media_store.touch(item['sha256'])
+    
+    found = {kiosk['id']: kiosk for kiosk in kiosks}
+    for kiosk_id in kiosk_ids:
+        kiosk = found.get(kiosk_id)
+        if not kiosk:
+            job.finish_kiosk(kiosk_id, status='error', error='Kiosk nie znaleziony')
+            continue
+        job.update(kiosk_id, name=kiosk['name'])
+        if not kiosk['ip_address'] or not kiosk['ftp_username']:
+            job.finish_kiosk(kiosk_id, status='error', error='Kiosk nie ma przypisanego adresu IP lub danych FTP')
+            continue
+        distribute_executor.submit(distribute_to_kiosk, job, dict(kiosk), ftp_port)
+    
+    return job
+
+def parse_kiosk_ids(value):
+    if isinstance(value, str):
+        value = [k for k in value.split(',') if k.strip()]
+    return list(OrderedDict.fromkeys(int(k) for k in value))
+
+def valid_file_name(file_name):
+    return bool(file_name) and '/' not in file_name and '\\' not in file_name
+
+# Zapis przesłanego pliku do magazynu (domyślnie treść żądania = surowe bajty pliku).
+# Plik pozostaje przypięty - wywołujący zwalnia go przez media_store.unpin(), gdy przekaże go dalej
+def store_request_file(file_name, stream=None):
+    sha256, size = media_store.add_stream(stream or request.stream, file_name)
+    try:
+        media_store.evict()
+    except Exception:
+        media_store.unpin(sha256)
+        raise
+    return sha256, size
+
+@app.route('/api/media', methods=['POST'])
+@token_required
+def upload_media():
+    file_name = request.args.get('file_name')
+    if not valid_file_name(file_name):
+        return jsonify({"error": "Brak lub nieprawidłowa nazwa pliku"}), 400
+    
+    try:
+        sha256, size = store_request_file(file_name)
+    except Exception as e:
+        return jsonify({"error": f"Błąd podczas odbierania pliku: {str(e)}"}), 500
+    
+    media_store.unpin(sha256)
+    return jsonify({"sha256": sha256, "size": size, "file_name": file_name}), 201
+
+@app.route('/api/media', methods=['GET'])
+@token_required
+def list_media():
+    conn = get_db_connection()
+    media = conn.execute('SELECT sha256, size, original_name, created_at, last_used FROM media_files ORDER BY last_used DESC').fetchall()
+    conn.close()
+    return jsonify([dict(item) for item in media])
+
+@app.route('/api/distribute', methods=['POST'])
+@token_required
+def create_distribution_job():
+    file_name = request.args.get('file_name')
+    remote_path = request.args.get('path', '/home/kiosk/MediaPionowe')
+    
+    if not valid_file_name(file_name):
+        return jsonify({"error": "Brak lub nieprawidłowa nazwa pliku"}), 400
+    
+    try:
+        kiosk_ids = parse_kiosk_ids(request.args.get('kiosk_ids', ''))
+    except ValueError:
+        return jsonify({"error": "Nieprawidłowa lista kiosków"}), 400
+    
+    if not kiosk_ids:
+        return jsonify({"error": "Lista kiosków jest pusta"}), 400
+    
+    # Plik z żądania zapisywany jest raz do magazynu - identyczna treść nie zajmuje miejsca ponownie
+    try:
+        sha256, size = store_request_file(file_name)
+    except Exception as e:
+        return jsonify({"error": f"Błąd podczas odbierania pliku: {str(e)}"}), 500
+    
+    try:
+        job = start_distribution([{"sha256": sha256, "file_name": file_name, "size": size}], remote_path, kiosk_ids)
+    finally:
+        media_store.unpin(sha256)
+    return jsonify(job.to_dict()), 202
+
+# Synchronizacja zestawu plików z magazynu - wysyłane są tylko brakujące lub zmienione pliki
+@app.route('/api/media/sync', methods=['POST'])
+@token_required
+def sync_media():
+    data = request.json
+    
+    if not data or 'kiosk_ids' not in data or 'files' not in data:
+        return jsonify({"error": "Brakujące dane: wymagane kiosk_ids i files"}), 400
+    
+    remote_path = data.get('path', '/home/kiosk/MediaPionowe')
+    
+    try:
+        kiosk_ids = parse_kiosk_ids(data['kiosk_ids'])
+    except (ValueError, TypeError):
+        return jsonify({"error": "Nieprawidłowa lista kiosków"}), 400
+    
+    if not kiosk_ids or not isinstance(data['files'], list) or not data['files']:
+        return jsonify({"error": "Lista kiosków lub plików jest pusta"}), 400
+    
+    files = []
+    missing = []
+    for entry in data['files']:
+        if not isinstance(entry, dict) or not isinstance(entry.get('sha256'), str) or not isinstance(entry.get('file_name') or '', str):
+            return jsonify({"error": "Każdy element files musi być obiektem { sha256, file_name? }"}), 400
+        stored = media_store.get(entry['sha256'])
+        file_name = entry.get('file_name') or (stored and stored['original_name'])
+        if not stored:
+            missing.append(entry.get('sha256'))
+        elif not valid_file_name(file_name):
+            return jsonify({"error": f"Nieprawidłowa nazwa pliku: {file_name}"}), 400
+        else:
+            files.append({"sha256": stored['sha256'], "file_name": file_name, "size": stored['size']})
+    
+    if missing:
+        return jsonify({"error": "Brak plików w magazynie - prześlij je przez /api/media", "missing": missing}), 409
+    
+    job = start_distribution(files, remote_path, kiosk_ids)
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/distribute', methods=['GET'])
+@token_required
+def list_distribution_jobs():
+    with distribution_jobs_lock:
+        jobs = list(distribution_jobs.values())
+    return jsonify([job.to_dict() for job in reversed(jobs)])
+
+@app.route('/api/distribute/<string:job_id>', methods=['GET'])
+@token_required
+def get_distribution_job(job_id):
+    with distribution_jobs_lock:
+        job = distribution_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Zadanie nie znalezione"}), 404
+    return jsonify(job.to_dict())
+
+# Harmonogram odtwarzacza (schedule.json: { "plik": liczba_odtworzeń }) - serwer trzyma przetworzoną,
+# wersjonowaną kopię każdego kiosku w tabeli kiosk_schedules, więc edycja nie wymaga pobierania pliku
+# z kiosku, a publikacja pomija wysyłkę, gdy treść (skrót SHA-256) się nie zmieniła
+SCHEDULE_PATH = '/schedule.json'   # ścieżka pliku na FTP kiosku (pliki multimediów w tym samym katalogu)
+SCHEDULE_MAX_SIZE = 1024 * 1024    # maks. rozmiar pliku harmonogramu (B)
+
+class ScheduleError(Exception):
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+def default_ftp_port(conn):
+    row = conn.execute('SELECT value FROM settings WHERE key = "defaultFtpPort"').fetchone()
+    return int(row['value']) if row else 21
+
+# Kiosk z danymi FTP z tabeli kiosks
+def load_kiosk_ftp(kiosk_id):
+    conn = get_db_connection()
+    kiosk = conn.execute(
+        'SELECT id, name, ip_address, ftp_username, ftp_password FROM kiosks WHERE id = ?', (kiosk_id,)
+    ).fetchone()
+    port = default_ftp_port(conn)
+    conn.close()
+    if not kiosk:
+        raise ScheduleError('Kiosk nie znaleziony', 404)
+    if not kiosk['ip_address'] or not kiosk['ftp_username']:
+        raise ScheduleError('Kiosk nie ma przypisanego adresu IP lub danych FTP', 409)
+    return dict(kiosk, ftp_password=kiosk_ftp_password(kiosk)), port
+
+def validate_schedule(schedule):
+    if not isinstance(schedule, dict):
+        raise ScheduleError('Harmonogram musi być obiektem JSON { "plik": liczba_odtworzeń }')
+    for file_name, count in schedule.items():
+        if not valid_file_name(file_name):
+            raise ScheduleError(f'Nieprawidłowa nazwa pliku w harmonogramie: {file_name!r}')
+        if isinstance(count, bool) or not isinstance(count, int) or count < 1:
+            raise ScheduleError(f'Liczba odtworzeń pliku {file_name} musi być dodatnią liczbą całkowitą')
+
+# Treść pliku w tym samym formacie, co zapisywał edytor playlisty (JSON.stringify z wcięciem 2)
+def schedule_content(schedule):
+    return json.dumps(schedule, indent=2, ensure_ascii=False).encode('utf-8')
+
+# Atomowa podmiana pliku: STOR pod tymczasową nazwą w tym samym katalogu, potem RNFR/RNTO -
+# odtwarzacz na kiosku widzi starą albo nową wersję, nigdy częściowo zapisaną
+def ftp_store_atomic(ftp, path, data):
+    directory, name = posixpath.split(path)
+    temp_path = posixpath.join(directory, f'.{name}.{uuid.uuid4().hex[:8]}.tmp')
+    ftp.storbinary(f'STOR {temp_path}', io.BytesIO(data))
+    try:
+        try:
+            ftp.rename(temp_path, path)
+        except ftplib.error_perm:
+            # Serwer, który nie nadpisuje pliku przy RNTO - usunięcie i ponowienie (krótkie okno bez pliku)
+            try:
+                ftp.delete(path)
+            except ftplib.error_perm:
+                pass
+            ftp.rename(temp_path, path)
+    except Exception:
+        try:
+            ftp.delete(temp_path)
+        except Exception:
+            pass
+        raise
+
+# Listing katalogu z harmonogramem (z cache listingów, a przy jego braku przez podaną lub nową sesję)
+def kiosk_schedule_listing(kiosk, port, ftp=None):
+    directory = posixpath.dirname(SCHEDULE_PATH)
+    cache_key = DirectoryListingCache.key(kiosk['ip_address'], port, kiosk['ftp_username'], directory)
+    cached = listing_cache.get(cache_key, kiosk['ftp_password'])
+    if cached:
+        return cached[0]
+    session = ftp or ftp_connect(kiosk['ip_address'], kiosk['ftp_username'], kiosk['ftp_password'], port)
+    if not session:
+        raise ScheduleError('Nie można połączyć się z serwerem FTP', 502)
+    try:
+        file_info = ftp_list_directory(session, directory)
+    finally:
+        if ftp is None:
+            session.quit()
+    listing, _ = listing_cache.put(cache_key, kiosk['ftp_password'], file_info)
+    manifest_reconcile(kiosk['ip_address'], directory, file_info)
+    return listing
+
+def schedule_missing_files(schedule, listing):
+    present = {listing.names[i] for i in range(len(listing)) if not listing.is_dir[i]}
+    return [file_name for file_name in schedule if file_name not in present]
+
+class ScheduleStore:
+    def __init__(self):
+        self._parsed = {}                                   # kiosk_id -> (wersja, słownik harmonogramu)
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    # Publikacje na ten sam kiosk wykonywane są po kolei
+    def kiosk_lock(self, kiosk_id):
+        with self._lock:
+            return self._locks.setdefault(kiosk_id, threading.Lock())
+
+    def get(self, kiosk_id):
+        conn = get_db_connection()
+        row = conn.execute('SELECT * FROM kiosk_schedules WHERE kiosk_id = ?', (kiosk_id,)).fetchone()
+        conn.close()
+        if not row:
+            return None
+        with self._lock:
+            cached = self._parsed.get(kiosk_id)
+        if cached and cached[0] == row['version']:
+            schedule = cached[1]
+        else:
+            schedule = json.loads(row['content'])
+            with self._lock:
+                self._parsed[kiosk_id] = (row['version'], schedule)
+        return {
+            "kiosk_id": kiosk_id,
+            "version": row['version'],
+            "sha256": row['sha256'],
+            "schedule": schedule,
+            "fetched_at": row['fetched_at'],
+            "published_at": row['published_at']
+        }
+
+    # Zapis stanu pliku na kiosku - wersja rośnie tylko przy zmianie treści
+    def save(self, kiosk_id, content, published=False):
+        sha256 = hashlib.sha256(content).hexdigest()
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn = get_db_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(
+            'INSERT INTO kiosk_schedules (kiosk_id, version, sha256, content, fetched_at, published_at) VALUES (?, 1, ?, ?, ?, ?) '
+            'ON CONFLICT(kiosk_id) DO UPDATE SET '
+            'version = version + (sha256 != excluded.sha256), sha256 = excluded.sha256, content = excluded.content, '
+            'fetched_at = COALESCE(excluded.fetched_at, fetched_at), published_at = COALESCE(excluded.published_at, published_at)',
+            (kiosk_id, sha256, content.decode('utf-8'), None if published else now, now if published else None)
+        )
+        conn.commit()
+        conn.close()
+        return self.get(kiosk_id)
+
+    # Plik zmieniony poza API harmonogramów (np. put-file-content, usunięcie) - kopia jest nieaktualna:
+    # pusty skrót wymusza ponowne pobranie przy odczycie i wysyłkę przy publikacji, a wersja rośnie dalej
+    def forget(self, hostname, paths, recursive=False):
+        target = posixpath.normpath(SCHEDULE_PATH)
+        for path in paths:
+            path = posixpath.normpath(path)
+            if path == target or (recursive and target.startswith(path.rstrip('/') + '/')):
+                conn = get_db_connection()
+                conn.execute(
+                    "UPDATE kiosk_schedules SET sha256 = '', version = version + 1 "
+                    'WHERE kiosk_id IN (SELECT id FROM kiosks WHERE ip_address = ?)',
+                    (hostname,)
+                )
+                conn.commit()
+                conn.close()
+                return
+
+schedule_store = ScheduleStore()
+
+# Pobranie harmonogramu z kiosku i zapis kopii
+def fetch_kiosk_schedule(kiosk, port):
+    ftp = ftp_connect(kiosk['ip_address'], kiosk['ftp_username'], kiosk['ftp_password'], port)
+    if not ftp:
+        raise ScheduleError('Nie można połączyć się z serwerem FTP', 502)
+    # Sesja zwalniana w jednym miejscu - przy wyjściu z bloku with
+    try:
+        with ftp:
+            content = ftp_read_bytes(ftp, SCHEDULE_PATH, SCHEDULE_MAX_SIZE)
+            listing = kiosk_schedule_listing(kiosk, port, ftp)
+    except ftplib.error_perm as e:
+        if str(e).startswith('550'):
+            raise ScheduleError(f'Kiosk nie ma pliku {SCHEDULE_PATH}', 404)
+        raise ScheduleError(f'Błąd podczas pobierania harmonogramu: {str(e)}', 502)
+    except ScheduleError:
+        raise
+    except Exception as e:
+        raise ScheduleError(f'Błąd podczas pobierania harmonogramu: {str(e)}', 502)
+    
+    try:
+        schedule = json.loads(content.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        raise ScheduleError(f'Plik {SCHEDULE_PATH} na kiosku nie jest prawidłowym JSON', 422)
+    if not isinstance(schedule, dict):
+        raise ScheduleError(f'Plik {SCHEDULE_PATH} na kiosku nie jest obiektem JSON', 422)
+    # Zapisywana postać kanoniczna - plik różniący się tylko formatowaniem nie będzie wysyłany ponownie
+    return schedule_store.save(kiosk['id'], schedule_content(schedule)), listing
+
+# Publikacja harmonogramu na kiosku. Pomijana, gdy skrót treści zgadza się z kopią serwera
+# (czyli z plikiem na kiosku - zmiany poza tym API unieważniają kopię).
+def publish_kiosk_schedule(kiosk, port, schedule, expected_version=None, allow_missing=False):
+    validate_schedule(schedule)
+    content = schedule_content(schedule)
+    sha256 = hashlib.sha256(content).hexdigest()
+    
+    with schedule_store.kiosk_lock(kiosk['id']):
+        current = schedule_store.get(kiosk['id'])
+        if expected_version is not None and current and current['version'] != expected_version:
+            raise ScheduleError(
+                'Harmonogram został w międzyczasie zmieniony - wczytaj go ponownie',
+                409, version=current['version']
+            )
+        if current and current['sha256'] == sha256:
+            return dict(current, unchanged=True)
+        
+        ftp = ftp_connect(kiosk['ip_address'], kiosk['ftp_username'], kiosk['ftp_password'], port)
+        if not ftp:
+            raise ScheduleError('Nie można połączyć się z serwerem FTP', 502)
+        try:
+            listing = kiosk_schedule_listing(kiosk, port, ftp)
+            missing = schedule_missing_files(schedule, listing)
+            if missing and not allow_missing:
+                ftp.quit()
+                raise ScheduleError('Harmonogram zawiera pliki, których nie ma na kiosku', 422, missing_files=missing)
+            ftp_store_atomic(ftp, SCHEDULE_PATH, content)
+            ftp.quit()
+        except ScheduleError:
+            raise
+        except Exception as e:
+            try:
+                ftp.quit()
+            except:
+                pass
+            raise ScheduleError(f'Błąd podczas publikacji harmonogramu: {str(e)}', 502)
+        
+        listing_cache.invalidate(kiosk['ip_address'], [SCHEDULE_PATH])
+        manifest_forget(kiosk['ip_address'], [SCHEDULE_PATH])
+        return dict(schedule_store.save(kiosk['id'], content, published=True), unchanged=False, missing_files=missing)
+
+def schedule_error_response(error):
+    return jsonify({"error": str(error), **error.details}), error.status
+
+@app.route('/api/kiosks/<int:kiosk_id>/schedule', methods=['GET'])
+@token_required
+def get_kiosk_schedule(kiosk_id):
+    try:
+        kiosk, port = load_kiosk_ftp(kiosk_id)
+        record = None if request.args.get('refresh') else schedule_store.get(kiosk_id)
+        if record is None or not record['sha256']:
+            record, listing = fetch_kiosk_schedule(kiosk, port)
+        else:
+            listing = kiosk_schedule_listing(kiosk, port)
+    except ScheduleError as e:
+        return schedule_error_response(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    # Pliki z harmonogramu, których kiosk nie ma (na podstawie listingu katalogu)
+    return jsonify(dict(record, missing_files=schedule_missing_files(record['schedule'], listing)))
+
+@app.route('/api/kiosks/<int:kiosk_id>/schedule', methods=['PUT'])
+@token_required
+def put_kiosk_schedule(kiosk_id):
+    data = request.get_json(silent=True)
+    if not data or 'schedule' not in data:
+        return jsonify({"error": "Brakujące dane: wymagane schedule"}), 400
+    
+    expected_version = data.get('version')
+    if expected_version is not None and (isinstance(expected_version, bool) or not isinstance(expected_version, int)):
+        return jsonify({"error": "Wersja musi być liczbą całkowitą"}), 400
+    
+    try:
+        kiosk, port = load_kiosk_ftp(kiosk_id)
+        result = publish_kiosk_schedule(kiosk, port, data['schedule'], expected_version, bool(data.get('allow_missing')))
+    except ScheduleError as e:
+        return schedule_error_response(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    return jsonify(result)
+
+# Szablony harmonogramów i grupy kiosków - szablon przypisany do grupy jest renderowany dla każdego
+# kiosku grupy i publikowany przez trwałą kolejkę zadań (jedno zadanie na kiosk); kiosk, którego kopia
+# harmonogramu ma już ten sam skrót treści, jest pomijany bez łączenia się z FTP
+SCHEDULE_ROLLOUTS_KEPT = 50                        # ile ostatnich wdrożeń trzymać w bazie
+SCHEDULE_TEMPLATE_FIELDS = ('serial', 'id')        # pola kiosku wstawiane w nazwy plików: {serial}, {id}
+
+# Harmonogram konkretnego kiosku z szablonu, np. "promo_{serial}.mp4" -> "promo_10000000abcd.mp4"
+def render_schedule_template(schedule, kiosk):
+    values = {'serial': kiosk['serial_number'] or '', 'id': str(kiosk['id'])}
+    rendered = {}
+    for file_name, count in schedule.items():
+        for field in SCHEDULE_TEMPLATE_FIELDS:
+            file_name = file_name.replace('{' + field + '}', values[field])
+        rendered[file_name] = count
+    return rendered
+
+def schedule_template_dict(row):
+    return {
+        "id": row['id'],
+        "name": row['name'],
+        "version": row['version'],
+        "sha256": row['sha256'],
+        "schedule": json.loads(row['content']),
+        "created_at": row['created_at'],
+        "updated_at": row['updated_at']
+    }
+
+def kiosk_group_dict(conn, row):
+    members = conn.execute(
+        'SELECT kiosk_id FROM kiosk_group_members WHERE group_id = ? ORDER BY kiosk_id', (row['id'],)
+    ).fetchall()
+    return {
+        "id": row['id'],
+        "name": row['name'],
+        "template_id": row['template_id'],
+        "kiosk_ids": [member['kiosk_id'] for member in members],
+        "created_at": row['created_at'],
+        "updated_at": row['updated_at']
+    }
+
+def schedule_rollout_dict(conn, rollout):
+    kiosks, finished = [], [rollout['created_at']]
+    for row in conn.execute(
+        'SELECT * FROM schedule_rollout_kiosks WHERE rollout_id = ? ORDER BY position', (rollout['id'],)
+    ):
+        if row['finished_at']:
+            finished.append(row['finished_at'])
+        kiosks.append({
+            "kiosk_id": row['kiosk_id'], "name": row['name'], "template_id": row['template_id'],
+            "group_id": row['group_id'], "job_id": row['job_id'], "status": row['status'], "version": row['version'],
+            "missing_files": json.loads(row['missing_files']) if row['missing_files'] else [], "error": row['error']
+        })
+    counts = {status: sum(1 for k in kiosks if k['status'] == status) for status in ('done', 'skipped', 'error')}
+    remaining = len(kiosks) - sum(counts.values())
+    if remaining:
+        status = 'running'
+    elif counts['error'] == 0:
+        status = 'done'
+    else:
+        status = 'error' if counts['error'] == len(kiosks) else 'partial'
+    return {
+        "id": rollout['id'],
+        "status": status,
+        "allow_missing": bool(rollout['allow_missing']),
+        "created_at": rollout['created_at'],
+        "finished_at": None if remaining else max(finished),
+        "published": counts['done'],
+        "skipped": counts['skipped'],
+        "failed": counts['error'],
+        "total": len(kiosks),
+        "kiosks": kiosks
+    }
+
+def get_schedule_rollouts(rollout_id=None):
+    conn = get_db_connection()
+    if rollout_id is None:
+        rollouts = conn.execute('SELECT * FROM schedule_rollouts ORDER BY created_at DESC, rowid DESC').fetchall()
+    else:
+        rollouts = conn.execute('SELECT * FROM schedule_rollouts WHERE id = ?', (rollout_id,)).fetchall()
+    result = [schedule_rollout_dict(conn, rollout) for rollout in rollouts]
+    conn.close()
+    return result
+
+def update_rollout_kiosk(rollout_id, kiosk_id, finished=False, **fields):
+    if 'missing_files' in fields:
+        fields['missing_files'] = json.dumps(fields['missing_files'], ensure_ascii=False)
+    if finished:
+        fields['finished_at'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_db_connection()
+    conn.execute(
+        f'UPDATE schedule_rollout_kiosks SET {", ".join(f"{column} = ?" for column in fields)} '
+        'WHERE rollout_id = ? AND kiosk_id = ?',
+        (*fields.values(), rollout_id, kiosk_id)
+    )
+    conn.commit()
+    conn.close()
+
+# Publikacja harmonogramu na jednym kiosku wdrożenia (zadanie kolejki). Harmonogram jest renderowany
+# przy tworzeniu wdrożenia i zapisany w zadaniu, dane FTP kiosku - odczytywane z bazy przy wykonaniu.
+# Błąd połączenia jest ponawiany przez kolejkę, pozostałe błędy kończą publikację na kiosku.
+def schedule_publish_job(job_id, payload, secrets):
+    rollout_id, kiosk_id = payload['rollout_id'], payload['kiosk_id']
+    update_rollout_kiosk(rollout_id, kiosk_id, status='publishing')
+    try:
+        kiosk, port = load_kiosk_ftp(kiosk_id)
+        result = publish_kiosk_schedule(kiosk, port, payload['schedule'], allow_missing=payload['allow_missing'])
+    except ScheduleError as e:
+        if e.status == 502:
+            update_rollout_kiosk(rollout_id, kiosk_id, status='pending', error=str(e))
+            raise JobError(str(e), retry=True)
+        update_rollout_kiosk(
+            rollout_id, kiosk_id, finished=True, status='error', error=str(e),
+            missing_files=e.details.get('missing_files', [])
+        )
+        raise JobError(str(e))
+    update_rollout_kiosk(
+        rollout_id, kiosk_id, finished=True, status='skipped' if result['unchanged'] else 'done',
+        version=result['version'], missing_files=result.get('missing_files', []), error=None
+    )
+    return {"kiosk_id": kiosk_id, "version": result['version'], "unchanged": result['unchanged']}
+
+# Zadanie zakończone bez wyniku na kiosku (wyczerpane próby, inny błąd, anulowanie) - błąd z kolejki
+def schedule_publish_finished(payload):
+    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_db_connection()
+    conn.execute(
+        "UPDATE schedule_rollout_kiosks SET status = 'error', finished_at = ?, "
+        "error = COALESCE((SELECT COALESCE(jobs.error, 'Zadanie anulowane') FROM jobs WHERE jobs.id = job_id), error, 'Publikacja przerwana') "
+        "WHERE rollout_id = ? AND kiosk_id = ? AND status IN ('pending', 'publishing')",
+        (now, payload['rollout_id'], payload['kiosk_id'])
+    )
+    conn.commit()
+    conn.close()
+
+# targets: lista (kiosk_id, template_id, group_id) - każdy kiosk co najwyżej raz
+def start_schedule_rollout(targets, allow_missing):
+    rollout_id = uuid.uuid4().hex
+    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    kiosk_ids = [target[0] for target in targets]
+    template_ids = list({target[1] for target in targets})
+    conn = get_db_connection()
+    kiosks = conn.execute(
+        f'SELECT k.id, k.name, k.serial_number, k.ip_address, k.ftp_username, s.sha256 AS schedule_sha256 '
+        f'FROM kiosks k LEFT JOIN kiosk_schedules s ON s.kiosk_id = k.id '
+        f'WHERE k.id IN ({", ".join("?" for _ in kiosk_ids)})',
+        kiosk_ids
+    ).fetchall()
+    templates = conn.execute(
+        f'SELECT id, content FROM schedule_templates WHERE id IN ({", ".join("?" for _ in template_ids)})',
+        template_ids
+    ).fetchall()
+    
+    # Kiosk rozstrzygnięty od razu (brak kiosku lub szablonu, plik aktualny) nie trafia do kolejki
+    found = {kiosk['id']: kiosk for kiosk in kiosks}
+    schedules = {template['id']: json.loads(template['content']) for template in templates}
+    rows, publish = [], []
+    for position, (kiosk_id, template_id, group_id) in enumerate(targets):
+        kiosk = found.get(kiosk_id)
+        status, error, schedule = 'pending', None, None
+        if not kiosk:
+            status, error = 'error', 'Kiosk nie znaleziony'
+        elif template_id not in schedules:
+            status, error = 'error', 'Szablon nie znaleziony'
+        else:
+            schedule = render_schedule_template(schedules[template_id], kiosk)
+            # Ten sam skrót co kopia serwera - plik na kiosku jest aktualny
+            if kiosk['schedule_sha256'] == hashlib.sha256(schedule_content(schedule)).hexdigest():
+                status = 'skipped'
+            elif not kiosk['ip_address'] or not kiosk['ftp_username']:
+                status, error = 'error', 'Kiosk nie ma przypisanego adresu IP lub danych FTP'
+            else:
+                publish.append((kiosk, schedule))
+        rows.append((
+            rollout_id, kiosk_id, position, kiosk['name'] if kiosk else None, template_id, group_id,
+            status, error, None if status == 'pending' else now
+        ))
+    
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute('INSERT INTO schedule_rollouts (id, allow_missing, created_at) VALUES (?, ?, ?)', (rollout_id, int(allow_missing), now))
+    conn.executemany(
+        'INSERT INTO schedule_rollout_kiosks (rollout_id, kiosk_id, position, name, template_id, group_id, status, error, finished_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        rows
+    )
+    # Starsze wdrożenia ponad limit są usuwane
+    stale = [row[0] for row in conn.execute(
+        'SELECT id FROM schedule_rollouts ORDER BY created_at DESC, rowid DESC LIMIT -1 OFFSET ?', (SCHEDULE_ROLLOUTS_KEPT,)
+    )]
+    if stale:
+        placeholders = ', '.join('?' for _ in stale)
+        conn.execute(f'DELETE FROM schedule_rollout_kiosks WHERE rollout_id IN ({placeholders})', stale)
+        conn.execute(f'DELETE FROM schedule_rollouts WHERE id IN ({placeholders})', stale)
+    conn.commit()
+    conn.close()
+    
+    for kiosk, schedule in publish:
+        job = job_queue.submit('schedule_publish', kiosk['ip_address'], {
+            "rollout_id": rollout_id, "kiosk_id": kiosk['id'], "schedule": schedule, "allow_missing": allow_missing
+        })
+        update_rollout_kiosk(rollout_id, kiosk['id'], job_id=job['id'])
+    return get_schedule_rollouts(rollout_id)[0]
+
+def parse_template_request(data, partial=False):
+    fields = {}
+    if 'name' in data or not partial:
+        name = data.get('name')
+        if not isinstance(name, str) or not name.strip():
+            raise ScheduleError('Nazwa szablonu jest wymagana')
+        fields['name'] = name.strip()
+    if 'schedule' in data or not partial:
+        validate_schedule(data.get('schedule'))
+        content = schedule_content(data['schedule']).decode('utf-8')
+        fields['content'] = content
+        fields['sha256'] = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    return fields
+
+@app.route('/api/schedule-templates', methods=['GET'])
+@token_required
+def list_schedule_templates():
+    conn = get_db_connection()
+    templates = conn.execute('SELECT * FROM schedule_templates ORDER BY name').fetchall()
+    conn.close()
+    return jsonify([schedule_template_dict(template) for template in templates])
+
+@app.route('/api/schedule-templates', methods=['POST'])
+@token_required
+def create_schedule_template():
+    data = request.get_json(silent=True) or {}
+    try:
+        fields = parse_template_request(data)
+    except ScheduleError as e:
+        return schedule_error_response(e)
+    
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(
+            'INSERT INTO schedule_templates (name, version, sha256, content) VALUES (?, 1, ?, ?)',
+            (fields['name'], fields['sha256'], fields['content'])
+        )
+        conn.commit()
+        template = conn.execute('SELECT * FROM schedule_templates WHERE id = ?', (cursor.lastrowid,)).fetchone()
+        conn.close()
+        return jsonify(schedule_template_dict(template)), 201
+    except sqlite3.IntegrityError:
+        conn.close()
+        return jsonify({"error": "Szablon o tej nazwie już istnieje"}), 409
+
+@app.route('/api/schedule-templates/<int:template_id>', methods=['GET'])
+@token_required
+def get_schedule_template(template_id):
+    conn = get_db_connection()
+    template = conn.execute('SELECT * FROM schedule_templates WHERE id = ?', (template_id,)).fetchone()
+    conn.close()
+    if not template:
+        return jsonify({"error": "Szablon nie znaleziony"}), 404
+    return jsonify(schedule_template_dict(template))
+
+@app.route('/api/schedule-templates/<int:template_id>', methods=['PUT'])
+@token_required
+def update_schedule_template(template_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        fields = parse_template_request(data, partial=True)
+    except ScheduleError as e:
+        return schedule_error_response(e)
+    if not fields:
+        return jsonify({"error": "Brak ważnych pól do aktualizacji"}), 400
+    
+    conn = get_db_connection()
+    current = conn.execute('SELECT version, sha256 FROM schedule_templates WHERE id = ?', (template_id,)).fetchone()
+    if not current:
+        conn.close()
+        return jsonify({"error": "Szablon nie znaleziony"}), 404
+    # Wersja rośnie tylko przy zmianie treści
+    if 'sha256' in fields:
+        fields['version'] = current['version'] + (current['sha256'] != fields['sha256'])
+    fields['updated_at'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        query = 'UPDATE schedule_templates SET ' + ', '.join(f'{k} = ?' for k in fields) + ' WHERE id = ?'
+        conn.execute(query, list(fields.values()) + [template_id])
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        conn.close()
+        return jsonify({"error": "Szablon o tej nazwie już istnieje"}), 409
+    template = conn.execute('SELECT * FROM schedule_templates WHERE id = ?', (template_id,)).fetchone()
+    conn.close()
+    return jsonify(schedule_template_dict(template))
+
+@app.route('/api/schedule-templates/<int:template_id>', methods=['DELETE'])
+@token_required
+def delete_schedule_template(template_id):
+    conn = get_db_connection()
+    deleted = conn.execute('DELETE FROM schedule_templates WHERE id = ?', (template_id,)).rowcount
+    conn.execute('UPDATE kiosk_groups SET template_id = NULL WHERE template_id = ?', (template_id,))
+    conn.commit()
+    conn.close()
+    if not deleted:
+        return jsonify({"error": "Szablon nie znaleziony"}), 404
+    return '', 204
+
+# template_id z treści żądania - liczba całkowita (także jako tekst) lub null
+def parse_template_id(value):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ScheduleError('template_id musi być liczbą całkowitą')
+    try:
+        return int(value)
+    except ValueError:
+        raise ScheduleError('template_id musi być liczbą całkowitą')
+
+def parse_group_request(conn, data, partial=False):
+    fields = {}
+    if 'name' in data or not partial:
+        name = data.get('name')
+        if not isinstance(name, str) or not name.strip():
+            raise ScheduleError('Nazwa grupy jest wymagana')
+        fields['name'] = name.strip()
+    if 'template_id' in data:
+        template_id = parse_template_id(data['template_id'])
+        if template_id is not None and not conn.execute(
+            'SELECT 1 FROM schedule_templates WHERE id = ?', (template_id,)
+        ).fetchone():
+            raise ScheduleError('Szablon nie znaleziony', 404)
+        fields['template_id'] = template_id
+    kiosk_ids = None
+    if 'kiosk_ids' in data:
+        try:
+            kiosk_ids = parse_kiosk_ids(data['kiosk_ids'] or [])
+        except (ValueError, TypeError):
+            raise ScheduleError('Nieprawidłowa lista kiosków')
+    return fields, kiosk_ids
+
+def set_group_members(conn, group_id, kiosk_ids):
+    conn.execute('DELETE FROM kiosk_group_members WHERE group_id = ?', (group_id,))
+    conn.executemany(
+        'INSERT INTO kiosk_group_members (group_id, kiosk_id) SELECT ?, id FROM kiosks WHERE id = ?',
+        [(group_id, kiosk_id) for kiosk_id in kiosk_ids]
+    )
+
+@app.route('/api/kiosk-groups', methods=['GET'])
+@token_required
+def list_kiosk_groups():
+    conn = get_db_connection()
+    groups = [kiosk_group_dict(conn, group) for group in conn.execute('SELECT * FROM kiosk_groups ORDER BY name').fetchall()]
+    conn.close()
+    return jsonify(groups)
+
+@app.route('/api/kiosk-groups', methods=['POST'])
+@token_required
+def create_kiosk_group():
+    data = request.get_json(silent=True) or {}
+    conn = get_db_connection()
+    try:
+        fields, kiosk_ids = parse_group_request(conn, data)
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.execute(
+            'INSERT INTO kiosk_groups (name, template_id) VALUES (?, ?)', (fields['name'], fields.get('template_id'))
+        )
+        set_group_members(conn, cursor.lastrowid, kiosk_ids or [])
+        conn.commit()
+        group = kiosk_group_dict(conn, conn.execute('SELECT * FROM kiosk_groups WHERE id = ?', (cursor.lastrowid,)).fetchone())
+        conn.close()
+        return jsonify(group), 201
+    except ScheduleError as e:
+        conn.close()
+        return schedule_error_response(e)
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        conn.close()
+        return jsonify({"error": "Grupa o tej nazwie już istnieje"}), 409
+
+@app.route('/api/kiosk-groups/<int:group_id>', methods=['PUT'])
+@token_required
+def update_kiosk_group(group_id):
+    data = request.get_json(silent=True) or {}
+    conn = get_db_connection()
+    try:
+        fields, kiosk_ids = parse_group_request(conn, data, partial=True)
+        if not fields and kiosk_ids is None:
+            conn.close()
+            return jsonify({"error": "Brak ważnych pól do aktualizacji"}), 400
+        conn.execute('BEGIN IMMEDIATE')
+        fields['updated_at'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        query = 'UPDATE kiosk_groups SET ' + ', '.join(f'{k} = ?' for k in fields) + ' WHERE id = ?'
+        if not conn.execute(query, list(fields.values()) + [group_id]).rowcount:
+            conn.rollback()
+            conn.close()
+            return jsonify({"error": "Grupa nie znaleziona"}), 404
+        if kiosk_ids is not None:
+            set_group_members(conn, group_id, kiosk_ids)
+        conn.commit()
+        group = kiosk_group_dict(conn, conn.execute('SELECT * FROM kiosk_groups WHERE id = ?', (group_id,)).fetchone())
+        conn.close()
+        return jsonify(group)
+    except ScheduleError as e:
+        conn.close()
+        return schedule_error_response(e)
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        conn.close()
+        return jsonify({"error": "Grupa o tej nazwie już istnieje"}), 409
+
+@app.route('/api/kiosk-groups/<int:group_id>', methods=['DELETE'])
+@token_required
+def delete_kiosk_group(group_id):
+    conn = get_db_connection()
+    deleted = conn.execute('DELETE FROM kiosk_groups WHERE id = ?', (group_id,)).rowcount
+    conn.execute('DELETE FROM kiosk_group_members WHERE group_id = ?', (group_id,))
+    conn.commit()
+    conn.close()
+    if not deleted:
+        return jsonify({"error": "Grupa nie znaleziona"}), 404
+    return '', 204
+
+# Wdrożenie: grupy (każda ze swoim szablonem albo podanym template_id) i/lub pojedyncze kiosk_ids (z template_id)
+@app.route('/api/schedule-rollouts', methods=['POST'])
+@token_required
+def create_schedule_rollout():
+    data = request.get_json(silent=True) or {}
+    try:
+        template_id = parse_template_id(data.get('template_id'))
+    except ScheduleError as e:
+        return schedule_error_response(e)
+    try:
+        group_ids = parse_kiosk_ids(data.get('group_ids') or [])
+        kiosk_ids = parse_kiosk_ids(data.get('kiosk_ids') or [])
+    except (ValueError, TypeError):
+        return jsonify({"error": "Nieprawidłowa lista grup lub kiosków"}), 400
+    if not group_ids and not kiosk_ids:
+        return jsonify({"error": "Brakujące dane: wymagane group_ids lub kiosk_ids"}), 400
+    if kiosk_ids and template_id is None:
+        return jsonify({"error": "Wdrożenie na wybrane kiosk_ids wymaga template_id"}), 400
+    
+    conn = get_db_connection()
+    if template_id is not None and not conn.execute('SELECT 1 FROM schedule_templates WHERE id = ?', (template_id,)).fetchone():
+        conn.close()
+        return jsonify({"error": "Szablon nie znaleziony"}), 404
+    
+    # Kiosk należący do kilku wybranych grup dostaje szablon pierwszej z nich
+    targets = OrderedDict()
+    for group_id in group_ids:
+        group = conn.execute('SELECT id, template_id FROM kiosk_groups WHERE id = ?', (group_id,)).fetchone()
+        if not group:
+            conn.close()
+            return jsonify({"error": f"Grupa {group_id} nie znaleziona"}), 404
+        group_template = template_id if template_id is not None else group['template_id']
+        if group_template is None:
+            conn.close()
+            return jsonify({"error": f"Grupa {group_id} nie ma przypisanego szablonu"}), 400
+        for member in conn.execute('SELECT kiosk_id FROM kiosk_group_members WHERE group_id = ? ORDER BY kiosk_id', (group_id,)):
+            targets.setdefault(member['kiosk_id'], (member['kiosk_id'], group_template, group_id))
+    conn.close()
+    for kiosk_id in kiosk_ids:
+        targets.setdefault(kiosk_id, (kiosk_id, template_id, None))
+    
+    rollout = start_schedule_rollout(list(targets.values()), bool(data.get('allow_missing')))
+    return jsonify(rollout), 202
+
+@app.route('/api/schedule-rollouts', methods=['GET'])
+@token_required
+def list_schedule_rollouts():
+    return jsonify(get_schedule_rollouts())
+
+@app.route('/api/schedule-rollouts/<string:rollout_id>', methods=['GET'])
+@token_required
+def get_schedule_rollout(rollout_id):
+    rollouts = get_schedule_rollouts(rollout_id)
+    if not rollouts:
+        return jsonify({"error": "Wdrożenie nie znalezione"}), 404
+    return jsonify(rollouts[0])
+
+@app.route('/api/ftp/delete', methods=['POST'])
+@token_required
+def delete_ftp_file():
+    data = request.json
+    
+    if not data or 'hostname' not in data or 'username' not in data or 'password' not in data or 'path' not in data:
+        return jsonify({"error": "Brakujące dane do usunięcia pliku"}), 400
+    
+    file_path = data['path']
+    is_directory = data.get('is_directory', False)
+    
+    # Konwersja portu na int
+    port = 21
+    if 'port' in data:
+        try:
+            port = int(data['port'])
+        except (ValueError, TypeError):
+            return jsonify({"error": "Port musi być liczbą całkowitą"}), 400
+    
+    if wants_background(data):
+        return submit_ftp_job('ftp_delete', data, port, files=[{"path": file_path, "is_directory": bool(is_directory)}])
+    
+    # Połączenie z serwerem FTP
+    ftp = ftp_connect(data['hostname'], data['username'], data['password'], port)
+    
+    if not ftp:
+        return jsonify({"error": "Nie można połączyć się z serwerem FTP"}), 500
+    
+    try:
+        # Usunięcie pliku lub katalogu
+        result = ftp_delete_file(ftp, file_path, is_directory)
+        
+        ftp.quit()
+        
+        if result:
+            ftp_paths_changed(data['hostname'], [file_path], recursive=is_directory)
+            return jsonify({"message": f"{'Katalog' if is_directory else 'Plik'} został pomyślnie usunięty"})
+        else:
+            return jsonify({"error": f"Nie można usunąć {'katalogu' if is_directory else 'pliku'}"}), 500
+    except Exception as e:
+        try:
+            ftp.quit()
+        except:
+            pass
+        return jsonify({"error": f"Błąd podczas usuwania: {str(e)}"}), 500
+
+@app.route('/api/ftp/delete-multiple', methods=['POST'])
+@token_required
+def delete_multiple_ftp_files():
+    data = request.json
+    
+    if not data or 'hostname' not in data or 'username' not in data or 'password' not in data or 'files' not in data:
+        return jsonify({"error": "Brakujące dane do usunięcia plików"}), 400
+    
+    files = data['files']
+    
+    if not isinstance(files, list) or len(files) == 0:
+        return jsonify({"error": "Lista plików do usunięcia jest pusta lub nieprawidłowa"}), 400
+    
+    # Konwersja portu na int
+    port = 21
+    if 'port' in data:
+        try:
+            port = int(data['port'])
+        except (ValueError, TypeError):
+            return jsonify({"error": "Port musi być liczbą całkowitą"}), 400
+    
+    if wants_background(data):
+        paths = [
+            {"path": file_info['path'], "is_directory": bool(file_info.get('isDirectory', False))}
+            for file_info in files if file_info.get('path')
+        ]
+        if not paths:
+            return jsonify({"error": "Lista plików do usunięcia jest pusta lub nieprawidłowa"}), 400
+        return submit_ftp_job('ftp_delete', data, port, files=paths)
+    
+    # Połączenie z serwerem FTP
+    ftp = ftp_connect(data['hostname'], data['username'], data['password'], port)
+    
+    if not ftp:
+        return jsonify({"error": "Nie można połączyć się z serwerem FTP"}), 500
+    
+    try:
+        results = []
+        for file_info in files:
+            path = file_info.get('path')
+            is_directory = file_info.get('isDirectory', False)
+            
+            if not path:
+                results.append({"path": "Nieznana ścieżka", "success": False, "error": "Brak ścieżki"})
+                continue
+                
+            try:
+                result = ftp_delete_file(ftp, path, is_directory)
+                results.append({"path": path, "success": result, "is_directory": is_directory})
+                if result:
+                    ftp_paths_changed(data['hostname'], [path], recursive=is_directory)
+            except Exception as e:
+                results.append({"path": path, "success": False, "error": str(e), "is_directory": is_directory})
+        
+        ftp.quit()
+        
+        # Sprawdź, czy były jakieś błędy
+        had_errors = any(not r['success'] for r in results)
+        
+        if had_errors:
+            return jsonify({
+                "message": "Niektóre pliki nie zostały usunięte",
+                "results": results
+            }), 207  # 207 Multi-Status
+        else:
             return jsonify({
                 "message": "Wszystkie pliki zostały pomyślnie usunięte",
                 "results": results
             })
     except Exception as e:
         try:
-            ftp.quit()
-        except:
-            pass
-        return jsonify({"error": f"Błąd podczas usuwania plików: {str(e)}"}), 500
+            ftp.quit()
+        except:
+            pass
+        return jsonify({"error": f"Błąd podczas usuwania plików: {str(e)}"}), 500
+
+# Operacje rekurencyjne na drzewie katalogów FTP (usuwanie, kopiowanie, przenoszenie).
+# Drzewo jest przeglądane równolegle na kilku sesjach do tego samego kiosku, a polecenia
+# DELE/RMD/MKD wysyłane są potokowo (wiele poleceń przed odczytem odpowiedzi).
+FTP_TREE_SESSIONS = min(4, FTP_POOL_MAX_PER_KIOSK)  # maks. liczba sesji do kiosku na jedno zadanie
+FTP_TREE_SPOOL_SIZE = 8 * 1024 * 1024               # kopiowanie jedną sesją: większe pliki buforowane na dysku (B)
+FTP_PIPELINE_BATCH = 32                             # ile poleceń wysyłać przed odczytem odpowiedzi
+FTP_TREE_OPERATIONS = ('delete', 'copy', 'move')
+
+# Zadania w trakcie wykonywania (postęp na żywo) - same zadania przechowuje kolejka
+ftp_tree_jobs = OrderedDict()
+ftp_tree_jobs_lock = threading.Lock()
+
+class FtpTreeJob:
+    MAX_ERRORS = 100
+
+    def __init__(self, operation, hostname, source, destination=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.operation = operation
+        self.hostname = hostname
+        self.source = source
+        self.destination = destination
+        self.status = 'pending'
+        self.stage = None
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.errors = []
+        self.created_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage, total=None):
+        with self._lock:
+            self.status = 'running'
+            self.stage = stage
+            if total is not None:
+                self.total += total
+
+    def advance(self, path, error=None):
+        with self._lock:
+            if error is None:
+                self.done += 1
+            else:
+                self.failed += 1
+                if len(self.errors) < self.MAX_ERRORS:
+                    self.errors.append({"path": path, "error": error})
+
+    def finish(self, error=None):
+        with self._lock:
+            if error is not None:
+                self.status = 'error'
+                self.errors.append({"path": self.source, "error": error})
+            else:
+                self.status = 'partial' if self.failed else 'done'
+            self.finished_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "operation": self.operation,
+                "source": self.source,
+                "destination": self.destination,
+                "status": self.status,
+                "stage": self.stage,
+                "total": self.total,
+                "done": self.done,
+                "failed": self.failed,
+                "errors": list(self.errors),
+                "created_at": self.created_at,
+                "finished_at": self.finished_at
+            }
+
+# Wysyła polecenia partiami bez czekania na odpowiedź każdego z osobna - zwraca (polecenie, błąd lub None)
+def ftp_pipeline(ftp, commands):
+    results = []
+    for start in range(0, len(commands), FTP_PIPELINE_BATCH):
+        batch = commands[start:start + FTP_PIPELINE_BATCH]
+        for command in batch:
+            ftp.putcmd(command)
+        for command in batch:
+            try:
+                ftp.getresp()
+                results.append((command, None))
+            except ftplib.Error as e:
+                results.append((command, str(e)))
+    return results
+
+def ftp_is_directory(ftp, path):
+    try:
+        ftp.cwd(path)
+        return True
+    except ftplib.error_perm:
+        return False
+
+# Dzieli pracę po równo między sesje i wykonuje ją równolegle (jeden wątek na sesję)
+def ftp_parallel(sessions, items, worker):
+    chunks = [items[i::len(sessions)] for i in range(len(sessions))]
+    with ThreadPoolExecutor(max_workers=len(sessions)) as pool:
+        return [result for chunk in pool.map(worker, sessions, chunks) for result in chunk]
+
+# Przegląda drzewo poziomami - katalogi jednego poziomu listowane są równolegle na wszystkich sesjach.
+# Zwraca listę plików (ścieżka, rozmiar) i katalogów (głębokość, ścieżka), łącznie z katalogiem głównym.
+def ftp_walk_tree(sessions, root):
+    files = []
+    directories = [(0, root)]
+    level = [root]
+    depth = 0
+    while level:
+        depth += 1
+        listings = ftp_parallel(sessions, level, lambda ftp, paths: [(path, ftp_list_directory(ftp, path)) for path in paths])
+        level = []
+        for path, entries in listings:
+            for entry in entries:
+                full_path = posixpath.join(path, entry['name'])
+                if entry['is_directory']:
+                    directories.append((depth, full_path))
+                    level.append(full_path)
+                else:
+                    files.append((full_path, entry['size']))
+    return files, directories
+
+def ftp_pipeline_job(job, sessions, commands):
+    def worker(ftp, chunk):
+        return ftp_pipeline(ftp, chunk)
+    for command, error in ftp_parallel(sessions, commands, worker):
+        job.advance(command.split(' ', 1)[1], error)
+
+def ftp_tree_delete(job, sessions, root):
+    if not ftp_is_directory(sessions[0], root):
+        job.set_stage('delete', total=1)
+        ftp_pipeline_job(job, sessions[:1], [f'DELE {root}'])
+        return
+    job.set_stage('scan')
+    files, directories = ftp_walk_tree(sessions, root)
+    job.set_stage('delete', total=len(files) + len(directories))
+    ftp_pipeline_job(job, sessions, [f'DELE {path}' for path, _ in files])
+    # Katalogi od najgłębszych - każdy poziom musi być pusty przed usunięciem rodzica
+    for depth in sorted({depth for depth, _ in directories}, reverse=True):
+        ftp_pipeline_job(job, sessions, [f'RMD {path}' for d, path in directories if d == depth])
+
+# Kopiowanie pliku strumieniem między dwiema sesjami (RETR na jednej, STOR na drugiej) bez pliku tymczasowego
+def ftp_copy_file(reader, writer, source, destination):
+    reader.voidcmd('TYPE I')
+    conn = reader.transfercmd(f'RETR {source}')
+    try:
+        with conn.makefile('rb') as stream:
+            writer.storbinary(f'STOR {destination}', stream, blocksize=FTP_STREAM_CHUNK_SIZE)
+    except BaseException:
+        # Odpowiedź na RETR musi zostać odczytana także po błędzie zapisu - sesja pozostaje zsynchronizowana.
+        # Przerwany transfer kończy się zwykle 426 - zgłaszany jest pierwotny błąd zapisu.
+        conn.close()
+        try:
+            reader.voidresp()
+        except Exception:
+            pass
+        raise
+    conn.close()
+    reader.voidresp()
+
+# Kopiowanie w obrębie jednej sesji (gdy pula nie wydała drugiej) - przez bufor na serwerze
+def ftp_copy_file_buffered(ftp, source, destination):
+    with tempfile.SpooledTemporaryFile(max_size=FTP_TREE_SPOOL_SIZE) as buffer:
+        ftp.retrbinary(f'RETR {source}', buffer.write, blocksize=FTP_STREAM_CHUNK_SIZE)
+        buffer.seek(0)
+        ftp.storbinary(f'STOR {destination}', buffer, blocksize=FTP_STREAM_CHUNK_SIZE)
+
+def ftp_tree_copy(job, sessions, source, destination):
+    # Każdy wątek kopiujący potrzebuje pary sesji: odczyt i zapis. Przy jednej sesji kopiowanie
+    # odbywa się po kolei przez bufor.
+    pairs = list(zip(sessions[0::2], sessions[1::2])) or [(sessions[0], sessions[0])]
+
+    if not ftp_is_directory(sessions[0], source):
+        job.set_stage('copy', total=1)
+        files, directories = [(source, 0)], []
+        target = lambda path: destination
+    else:
+        job.set_stage('scan')
+        files, directories = ftp_walk_tree(sessions, source)
+        job.set_stage('copy', total=len(files) + len(directories))
+        target = lambda path: destination + path[len(source.rstrip('/')):]
+        # Struktura katalogów docelowych od najpłytszych
+        for depth in sorted({depth for depth, _ in directories}):
+            ftp_pipeline_job(job, sessions[:1], [f'MKD {target(path)}' for d, path in directories if d == depth])
+
+    def worker(pair, chunk):
+        reader, writer = pair
+        for path, _ in chunk:
+            try:
+                if reader is writer:
+                    ftp_copy_file_buffered(reader, path, target(path))
+                else:
+                    ftp_copy_file(reader, writer, path, target(path))
+                job.advance(path)
+            except ftplib.Error as e:
+                job.advance(path, str(e))
+        return []
+    ftp_parallel(pairs, files, worker)
+
+def ftp_tree_move(job, sessions, source, destination):
+    # RNFR/RNTO przenosi całe drzewo jednym poleceniem - kopiowanie tylko, gdy serwer odmówi
+    job.set_stage('rename')
+    try:
+        sessions[0].rename(source, destination)
+        job.set_stage('rename', total=1)
+        job.advance(source)
+        return
+    except ftplib.error_perm:
+        pass
+    ftp_tree_copy(job, sessions, source, destination)
+    if not job.failed:
+        ftp_tree_delete(job, sessions, source)
+
+def run_ftp_tree_job(job, connection):
+    hostname, username, password, port = connection
+    sessions = []
+    try:
+        sessions.append(ftp_pool.acquire(hostname, username, password, port))
+        # Dodatkowe sesje tylko jeśli są od razu dostępne w limicie puli
+        for _ in range(FTP_TREE_SESSIONS - 1):
+            try:
+                sessions.append(ftp_pool.acquire(hostname, username, password, port, wait_timeout=0))
+            except Exception:
+                break
+        # Kopiowanie strumieniem potrzebuje drugiej sesji - warto na nią poczekać (limit czasu puli);
+        # jeśli i tak jej nie będzie, pliki kopiowane są po kolei przez bufor
+        if job.operation != 'delete' and len(sessions) < 2:
+            try:
+                sessions.append(ftp_pool.acquire(hostname, username, password, port))
+            except Exception:
+                pass
+
+        if job.operation == 'delete':
+            ftp_tree_delete(job, sessions, job.source)
+        elif job.operation == 'copy':
+            ftp_tree_copy(job, sessions, job.source, job.destination)
+        else:
+            ftp_tree_move(job, sessions, job.source, job.destination)
+        job.finish()
+    except Exception as e:
+        job.finish(error=str(e))
+    finally:
+        for ftp in sessions:
+            ftp_pool.release(ftp, discard=job.status == 'error')
+        changed = [job.source] + ([job.destination] if job.destination else [])
+        ftp_paths_changed(hostname, changed, recursive=True)
+
+@app.route('/api/ftp/tree-operation', methods=['POST'])
+@token_required
+def create_ftp_tree_job():
+    data = request.json
+    
+    if not data or 'hostname' not in data or 'username' not in data or 'password' not in data or 'path' not in data:
+        return jsonify({"error": "Brakujące dane połączenia FTP lub ścieżka"}), 400
+    
+    operation = data.get('operation', 'delete')
+    if operation not in FTP_TREE_OPERATIONS:
+        return jsonify({"error": f"Nieznana operacja. Dostępne: {', '.join(FTP_TREE_OPERATIONS)}"}), 400
+    
+    source = data['path'].rstrip('/') or '/'
+    destination = (data.get('destination') or '').rstrip('/')
+    if source == '/':
+        return jsonify({"error": "Nie można wykonać operacji na katalogu głównym"}), 400
+    if operation != 'delete':
+        if not destination:
+            return jsonify({"error": "Brak ścieżki docelowej"}), 400
+        if destination == source or destination.startswith(source + '/'):
+            return jsonify({"error": "Ścieżka docelowa nie może leżeć wewnątrz źródłowej"}), 400
+    
+    # Konwersja portu na int
+    port = 21
+    if 'port' in data:
+        try:
+            port = int(data['port'])
+        except (ValueError, TypeError):
+            return jsonify({"error": "Port musi być liczbą całkowitą"}), 400
+    
+    # Zadanie trafia do wspólnej kolejki - powtórzenie tylko przy błędzie przed jakąkolwiek zmianą
+    payload = {
+        "operation": operation, "source": source, "destination": destination or None,
+        "hostname": data['hostname'], "username": data['username'], "port": port
+    }
+    job = job_queue.submit('ftp_tree', data['hostname'], payload, secrets={'password': data['password']})
+    return jsonify(ftp_tree_job_status(job)), 202
+
+# Postęp na żywo z wykonywanego zadania, a po jego zakończeniu - wynik zapisany w kolejce
+def ftp_tree_job_status(job):
+    if job['status'] == 'running':
+        with ftp_tree_jobs_lock:
+            live = ftp_tree_jobs.get(job['id'])
+        if live:
+            return live.to_dict()
+    if job['result']:
+        return job['result']
+    payload = job['payload']
+    return {
+        "id": job['id'],
+        "operation": payload['operation'],
+        "source": payload['source'],
+        "destination": payload['destination'],
+        "status": 'pending' if job['status'] in ('queued', 'running') else 'error',
+        "stage": None,
+        "total": 0,
+        "done": 0,
+        "failed": 0,
+        "errors": [{"path": payload['source'], "error": job['error']}] if job['error'] else [],
+        "created_at": job['created_at'],
+        "finished_at": job['finished_at']
+    }
+
+@app.route('/api/ftp/tree-operation/<string:job_id>', methods=['GET'])
+@token_required
+def get_ftp_tree_job(job_id):
+    job = job_queue.get(job_id)
+    if not job or job['type'] != 'ftp_tree':
+        return jsonify({"error": "Zadanie nie znalezione"}), 404
+    return jsonify(ftp_tree_job_status(job))
 
 @app.route('/api/kiosks/<int:kiosk_id>/ftp-credentials', methods=['GET'])
 @token_required
@@ -772,6 +3978,9 @@ def create_ftp_directory():
         except (ValueError, TypeError):
             return jsonify({"error": "Port musi być liczbą całkowitą"}), 400
     
+    if wants_background(data):
+        return submit_ftp_job('ftp_mkdir', data, port, path=parent_path, folder_name=folder_name)
+    
     # Połączenie z serwerem FTP
     ftp = ftp_connect(data['hostname'], data['username'], data['password'], port)
     
@@ -788,6 +3997,9 @@ def create_ftp_directory():
         
         ftp.quit()
         
+        if result:
+            ftp_paths_changed(data['hostname'], [new_dir_path])
+        
         if result:
             return jsonify({"message": f"Katalog {folder_name} został pomyślnie utworzony", "path": new_dir_path})
         else:
@@ -799,6 +4011,33 @@ def create_ftp_directory():
             pass
         return jsonify({"error": f"Błąd podczas tworzenia katalogu: {str(e)}"}), 500
 
+# Generator przekazujący dane z połączenia danych FTP bezpośrednio do odpowiedzi HTTP.
+# Sesja wraca do puli tylko po odczytaniu całego transferu - przerwany transfer ją zamyka.
+# Strumień pliku z połączenia danych FTP; state['completed'] = transfer zakończony poprawnie
+# (sesję zwalnia release_ftp_stream zarejestrowane w Response.call_on_close)
+def ftp_stream_file(ftp, conn, length=None, state=None):
+    try:
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = conn.recv(FTP_STREAM_CHUNK_SIZE if remaining is None else min(FTP_STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+        if length is None or remaining == 0 and not conn.recv(1):
+            conn.close()
+            ftp.voidresp()
+            state['completed'] = True
+    finally:
+        conn.close()
+
+# Wywoływane przy zamknięciu odpowiedzi - także gdy klient przerwał pobieranie przed pierwszą porcją
+# (generator, który nie wystartował, nie wykonuje swojego finally)
+def release_ftp_stream(ftp, conn, state):
+    conn.close()
+    ftp_pool.release(ftp, discard=not state['completed'])
+
 @app.route('/api/ftp/download', methods=['GET'])
 def download_ftp_file():
     # Pobierz parametry z zapytania GET
@@ -807,6 +4046,7 @@ def download_ftp_file():
     username = request.args.get('username')
     password = request.args.get('password')
     path = request.args.get('path')
+    disposition = 'inline' if request.args.get('inline') == '1' else 'attachment'
     
     # Sprawdzenie wymaganych parametrów
     if not hostname or not username or not password or not path:
@@ -833,52 +4073,235 @@ def download_ftp_file():
             if directory:
                 ftp.cwd(directory)
             
-            # Tworzenie tymczasowego pliku do pobrania zawartości
-            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                temp_file_path = temp_file.name
-                
-                # Pobierz plik z serwera FTP
-                ftp.retrbinary(f'RETR {file_name}', temp_file.write)
-            
-            # Zamknij połączenie FTP
-            ftp.quit()
+            # Rozmiar pliku jest potrzebny do Content-Length i obsługi nagłówka Range
+            ftp.voidcmd('TYPE I')
+            try:
+                file_size = ftp.size(file_name)
+            except ftplib.error_perm:
+                file_size = None
             
-            # Przygotuj odpowiedź z plikiem
-            @after_this_request
-            def remove_file(response):
-                # Usuń plik tymczasowy po wysłaniu odpowiedzi
-                try:
-                    os.unlink(temp_file_path)
-                except Exception as error:
-                    app.logger.error(f"Błąd podczas usuwania pliku tymczasowego: {error}")
-                return response
-                
-            # Wyślij plik jako odpowiedź do pobrania
-            return send_file(
-                temp_file_path,
-                as_attachment=True,
-                download_name=file_name,
-                mimetype='application/octet-stream'
-            )
+            status = 200
+            headers = {
+                'Content-Disposition': f"{disposition}; filename*=UTF-8''{quote(file_name)}"
+            }
+            start, length = 0, file_size
+            if file_size is not None:
+                headers['Accept-Ranges'] = 'bytes'
+                if request.range:
+                    # Zakres HTTP mapowany na REST - przeglądarka może przewijać i wznawiać pobieranie
+                    byte_range = request.range.range_for_length(file_size)
+                    if byte_range is None:
+                        ftp.quit()
+                        return Response(status=416, headers={'Content-Range': f'bytes */{file_size}'})
+                    start, stop = byte_range
+                    length = stop - start
+                    status = 206
+                    headers['Content-Range'] = f'bytes {start}-{stop - 1}/{file_size}'
+                headers['Content-Length'] = str(length)
             
+            # Otwórz połączenie danych - dane trafiają do klienta w miarę ich odbierania
+            conn = ftp.transfercmd(f'RETR {file_name}', rest=start or None)
         except Exception as e:
             # Zamknij połączenie FTP w przypadku błędu
             try:
                 ftp.quit()
             except:
                 pass
-                
-            # Usuń plik tymczasowy w przypadku błędu
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
-                
             return jsonify({"error": f"Błąd podczas pobierania pliku: {str(e)}"}), 500
+        
+        mimetype = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+        # Sesja jest potrzebna jeszcze po zakończeniu handlera - zwalnia ją zamknięcie odpowiedzi
+        ftp_pool.detach(ftp)
+        state = {'completed': False}
+        response = Response(
+            ftp_stream_file(ftp, conn, length if status == 206 else None, state),
+            status=status,
+            headers=headers,
+            mimetype=mimetype
+        )
+        # Bez direct_passthrough - wtedy serwer WSGI wywołuje Response.close(), a z nim call_on_close
+        response.call_on_close(lambda: release_ftp_stream(ftp, conn, state))
+        return response
             
     except Exception as e:
         return jsonify({"error": f"Nieoczekiwany błąd: {str(e)}"}), 500
 
+# Obsługa SSH - klucz prywatny wczytywany jest raz, a połączenia do kiosków
+# utrzymywane (z keepalive) i współdzielone przez kolejne polecenia
+SSH_KEY_PATH = os.path.join(os.path.dirname(__file__), 'ssh_keys', 'kiosk_id_rsa')
+SSH_CONNECT_TIMEOUT = 10                                     # s
+SSH_COMMAND_TIMEOUT = 10                                     # s
+SSH_KEEPALIVE_INTERVAL = 30                                  # s
+SSH_IDLE_TIMEOUT = float(os.getenv('SSH_IDLE_TIMEOUT', '300'))  # po ilu sekundach bezczynności połączenie jest zamykane
+SSH_WORKERS = int(os.getenv('SSH_WORKERS', '16'))             # maks. liczba kiosków obsługiwanych równolegle
+
+# Polecenia dostępne dla operacji zbiorczych - kolejne pozycje są próbowane, gdy poprzednia się nie powiedzie
+SSH_COMMANDS = {
+    'restart-service': [
+        "sudo systemctl restart kiosk.service",
+        "systemctl --user restart kiosk.service"
+    ],
+    'rotate-right': ["bash -lc 'export DISPLAY=:0; xrandr -o right'"],
+    'rotate-normal': ["bash -lc 'export DISPLAY=:0; xrandr -o 0'"]
+}
+
+_ssh_key = None
+_ssh_key_mtime = None
+_ssh_key_lock = threading.Lock()
+
+# Klucz jest parsowany ponownie tylko po zmianie pliku
+def load_ssh_key():
+    global _ssh_key, _ssh_key_mtime
+    import paramiko
+    mtime = os.path.getmtime(SSH_KEY_PATH)
+    with _ssh_key_lock:
+        if _ssh_key is None or _ssh_key_mtime != mtime:
+            _ssh_key = paramiko.RSAKey.from_private_key_file(SSH_KEY_PATH)
+            _ssh_key_mtime = mtime
+        return _ssh_key
+
+class SshClientCache:
+    def __init__(self, idle_timeout):
+        self.idle_timeout = idle_timeout
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        # Wywoływane z założoną blokadą - zwraca klientów do zamknięcia
+        deadline = time.monotonic() - self.idle_timeout
+        expired = [key for key, (client, last_used) in self._clients.items() if last_used < deadline]
+        return [self._clients.pop(key)[0] for key in expired]
+
+    def get(self, hostname, port, username):
+        import paramiko
+        key = (hostname, port, username)
+        with self._lock:
+            to_close = self._prune()
+            entry = self._clients.get(key)
+        for client in to_close:
+            client.close()
+
+        if entry:
+            client = entry[0]
+            transport = client.get_transport()
+            if transport and transport.is_active():
+                with self._lock:
+                    self._clients[key] = (client, time.monotonic())
+                return client
+            self.discard(hostname, port, username)
+
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
+            hostname=hostname,
+            port=port,
+            username=username,
+            pkey=load_ssh_key(),
+            timeout=SSH_CONNECT_TIMEOUT
+        )
+        client.get_transport().set_keepalive(SSH_KEEPALIVE_INTERVAL)
+        with self._lock:
+            existing = self._clients.get(key)
+            if existing and existing[0].get_transport() and existing[0].get_transport().is_active():
+                # Inny wątek zdążył nawiązać połączenie - użyj jego
+                client.close()
+                client = existing[0]
+            self._clients[key] = (client, time.monotonic())
+        return client
+
+    def discard(self, hostname, port, username):
+        with self._lock:
+            entry = self._clients.pop((hostname, port, username), None)
+        if entry:
+            entry[0].close()
+
+ssh_clients = SshClientCache(SSH_IDLE_TIMEOUT)
+ssh_executor = ThreadPoolExecutor(max_workers=SSH_WORKERS, thread_name_prefix='ssh')
+
+# Wykonuje kolejne warianty polecenia aż do pierwszego zakończonego sukcesem
+# Nie udało się otworzyć kanału SSH - żadne polecenie nie zostało wysłane, więc można ponowić
+class SshChannelError(Exception):
+    pass
+
+def ssh_run_commands(client, commands, timeout=SSH_COMMAND_TIMEOUT):
+    for index, command in enumerate(commands):
+        print(f"Executing command: {command}")
+        try:
+            transport = client.get_transport()
+            if transport is None or not transport.is_active():
+                raise EOFError('Połączenie SSH zostało zamknięte')
+            channel = transport.open_session(timeout=timeout)
+        except Exception as e:
+            if index == 0:
+                raise SshChannelError(str(e)) from e
+            raise
+        channel.settimeout(timeout)
+        channel.exec_command(command)
+        out = channel.makefile('rb').read().decode('utf-8', errors='ignore').strip()
+        err = channel.makefile_stderr('rb').read().decode('utf-8', errors='ignore').strip()
+        exit_code = channel.recv_exit_status()
+        if exit_code == 0:
+            break
+    return command, exit_code, out, err
+
+def get_ssh_settings(conn):
+    settings = conn.execute('SELECT key, value FROM settings WHERE key IN ("defaultSshUsername", "defaultSshPort")').fetchall()
+    return {setting['key']: setting['value'] for setting in settings}
+
+def mark_kiosk_online(kiosk_id):
+    conn = get_db_connection()
+    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute('BEGIN IMMEDIATE')
+    kiosk = conn.execute('SELECT status FROM kiosks WHERE id = ?', (kiosk_id,)).fetchone()
+    conn.execute(
+        'UPDATE kiosks SET last_connection = ?, status = ?, updated_at = ? WHERE id = ?',
+        (now, 'online', now, kiosk_id)
+    )
+    conn.commit()
+    conn.close()
+    kiosk_snapshot.invalidate()
+    if kiosk and kiosk['status'] != 'online':
+        kiosk_events.publish([kiosk_event('online', kiosk_id, status='online', last_connection=now)])
+
+# Wykonanie nazwanego polecenia na jednym kiosku (używane przez operacje zbiorcze)
+def run_kiosk_command(kiosk, command_name, ssh_username, ssh_port):
+    result = {"kiosk_id": kiosk['id'], "name": kiosk['name'], "command": command_name, "success": False}
+    if not kiosk['ip_address']:
+        result["error"] = "Kiosk nie ma przypisanego adresu IP"
+        return result
+
+    started = time.monotonic()
+    for attempt in range(2):
+        sent = False
+        try:
+            client = ssh_clients.get(kiosk['ip_address'], ssh_port, ssh_username)
+            sent = True
+            command, exit_code, out, err = ssh_run_commands(client, SSH_COMMANDS[command_name])
+            break
+        except Exception as e:
+            ssh_clients.discard(kiosk['ip_address'], ssh_port, ssh_username)
+            # Ponowna próba (na świeżym połączeniu) tylko, gdy polecenie na pewno nie zostało wysłane:
+            # błąd połączenia/logowania lub zerwane połączenie z cache. Po wysłaniu polecenia
+            # (np. przekroczony czas odpowiedzi) powtórzenie mogłoby wykonać je drugi raz.
+            sent = sent and not isinstance(e, SshChannelError)
+            if attempt or sent:
+                result["error"] = f"Błąd SSH: {str(e)}"
+                result["command_sent"] = sent
+                result["duration"] = round(time.monotonic() - started, 3)
+                return result
+
+    result.update({
+        "success": exit_code == 0,
+        "exit_code": exit_code,
+        "stdout": out,
+        "duration": round(time.monotonic() - started, 3)
+    })
+    if exit_code != 0:
+        result["error"] = err or 'nieznany błąd'
+    elif command_name == 'restart-service':
+        mark_kiosk_online(kiosk['id'])
+    return result
+
 @app.route('/api/kiosks/<int:kiosk_id>/restart-service', methods=['POST'])
 def restart_kiosk_service(kiosk_id):
     # Pobierz dane z żądania (jeśli istnieją)
@@ -896,56 +4319,42 @@ def restart_kiosk_service(kiosk_id):
         conn.close()
         return jsonify({"error": "Kiosk nie ma przypisanego adresu IP"}), 400
     
-    conn.close()
-    
     # Pobierz ustawienia SSH z bazy danych (użyjemy ich, jeśli nie podano w żądaniu)
-    conn = get_db_connection()
-    settings = conn.execute('SELECT key, value FROM settings WHERE key IN ("defaultSshUsername", "defaultSshPort", "defaultSshService")').fetchall()
+    settings_dict = get_ssh_settings(conn)
     conn.close()
     
-    # Zamień ustawienia na słownik
-    settings_dict = {setting['key']: setting['value'] for setting in settings}
-    
     # Nazwa użytkownika SSH jest stała lub z ustawień (uwierzytelnianie zawsze przez klucz SSH)
     ssh_username = request_data.get('username') or settings_dict.get('defaultSshUsername', 'kiosk')
     
-    # Określamy ścieżkę do klucza SSH - zawsze używamy stałej nazwy pliku
-    ssh_key_path = os.path.join(os.path.dirname(__file__), 'ssh_keys', 'kiosk_id_rsa')
-    
     # Sprawdzenie czy klucz SSH istnieje
-    if not os.path.exists(ssh_key_path):
-        print(f"Nie znaleziono klucza SSH ({ssh_key_path})")
+    if not os.path.exists(SSH_KEY_PATH):
+        print(f"Nie znaleziono klucza SSH ({SSH_KEY_PATH})")
         return jsonify({"error": f"Nie znaleziono klucza SSH. Upewnij się, że klucz istnieje w folderze backend/ssh_keys/kiosk_id_rsa"}), 500
     
     ssh_port = int(request_data.get('port') or settings_dict.get('defaultSshPort', 22))
     
+    if wants_background(request_data):
+        return jsonify(submit_kiosk_command_job(kiosk, 'restart-service', ssh_username, ssh_port)), 202
+    
     # Wypisz informacje diagnostyczne dla celów debugowania
     print(f"Restarting service kiosk on kiosk {kiosk['name'] or kiosk['id']} ({kiosk['ip_address']})")
-    print(f"SSH connection details: {ssh_username}@{kiosk['ip_address']}:{ssh_port} using key authentication from {ssh_key_path}")
+    print(f"SSH connection details: {ssh_username}@{kiosk['ip_address']}:{ssh_port} using key authentication from {SSH_KEY_PATH}")
     
     try:
-        import paramiko
-        
-        # Utwórz klienta SSH
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
+        # Załaduj klucz SSH (z cache, jeśli plik się nie zmienił)
         try:
-            # Załaduj klucz SSH
-            try:
-                private_key = paramiko.RSAKey.from_private_key_file(ssh_key_path)
-            except Exception as key_error:
-                print(f"Błąd podczas ładowania klucza SSH: {key_error}")
-                return jsonify({"error": f"Błąd podczas ładowania klucza SSH: {str(key_error)}"}), 500
-
-            # Połącz z kioskiem przez SSH używając klucza
-            ssh.connect(
-                hostname=kiosk['ip_address'],
-                port=ssh_port,
-                username=ssh_username,
-                pkey=private_key,
-                timeout=10
-            )
+            load_ssh_key()
+        except ImportError:
+            raise
+        except Exception as key_error:
+            print(f"Błąd podczas ładowania klucza SSH: {key_error}")
+            return jsonify({"error": f"Błąd podczas ładowania klucza SSH: {str(key_error)}"}), 500
+
+        # Połącz z kioskiem przez SSH (lub użyj utrzymywanego połączenia)
+        try:
+            ssh = ssh_clients.get(kiosk['ip_address'], ssh_port, ssh_username)
+        except ImportError:
+            raise
         except Exception as e:
             return jsonify({
                 "error": f"Nie można połączyć się z kioskiem przez SSH: {str(e)}"
@@ -953,42 +4362,22 @@ def restart_kiosk_service(kiosk_id):
         
         # Wykonaj komendę restartu usługi
         try:
-            # Spróbuj użyć sudo (bez hasła, jeśli kiosk ma skonfigurowany sudo bez hasła)
-            restart_cmd = f"sudo systemctl restart kiosk.service"
-            print(f"Executing command: {restart_cmd}")
-            stdin, stdout, stderr = ssh.exec_command(restart_cmd, timeout=10)
-            exit_code = stdout.channel.recv_exit_status()
+            # Spróbuj użyć sudo (bez hasła, jeśli kiosk ma skonfigurowany sudo bez hasła),
+            # a jeśli nie zadziała - systemctl bez sudo
+            restart_cmd, exit_code, out, err_output = ssh_run_commands(ssh, SSH_COMMANDS['restart-service'])
             
             if exit_code != 0:
-                # Jeśli sudo nie zadziałało, spróbuj użyć systemctl bez sudo
-                restart_cmd = f"systemctl --user restart kiosk.service"
-                print(f"First command failed, trying: {restart_cmd}")
-                stdin, stdout, stderr = ssh.exec_command(restart_cmd, timeout=10)
-                exit_code = stdout.channel.recv_exit_status()
-                
-                if exit_code != 0:
-                    # Logowanie błędów
-                    err_output = stderr.read().decode('utf-8').strip()
-                    return jsonify({
-                        "error": f"Błąd podczas restartu usługi: {err_output}",
-                        "command": restart_cmd,
-                        "exit_code": exit_code
-                    }), 500
+                return jsonify({
+                    "error": f"Błąd podczas restartu usługi: {err_output}",
+                    "command": restart_cmd,
+                    "exit_code": exit_code
+                }), 500
         except Exception as e:
+            ssh_clients.discard(kiosk['ip_address'], ssh_port, ssh_username)
             return jsonify({"error": f"Błąd wykonania komendy: {str(e)}"}), 500
-        finally:
-            # Zawsze zamknij połączenie SSH
-            ssh.close()
         
         # Zaktualizuj czas ostatniego połączenia i status kiosku
-        conn = get_db_connection()
-        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        conn.execute(
-            'UPDATE kiosks SET last_connection = ?, status = ?, updated_at = ? WHERE id = ?',
-            (now, 'online', now, kiosk_id)
-        )
-        conn.commit()
-        conn.close()
+        mark_kiosk_online(kiosk_id)
         
         return jsonify({
             "message": f"Usługa kiosk została pomyślnie zrestartowana na kiosku {kiosk['name'] or kiosk['id']}"
@@ -1014,6 +4403,12 @@ def api_get_file_content():
     username = data['username']
     password = data['password']
     file_path = data['path']
+    raw = bool(data.get('raw'))
+    
+    try:
+        encoding = file_content_encoding(data)
+    except LookupError:
+        return jsonify({"error": f"Nieznane lub nietekstowe kodowanie: {data.get('encoding')}"}), 400
     
     # Jeśli hasło jest zaszyfrowane, odszyfruj je
     if password.startswith('ENC:'):
@@ -1025,31 +4420,61 @@ def api_get_file_content():
         return jsonify({"error": "Nie można połączyć się z serwerem FTP"}), 500
     
     try:
-        # Pobierz zawartość pliku
+        # Pobierz zawartość pliku (do pamięci, z limitem rozmiaru)
         content = ftp_get_file_content(ftp, file_path)
-        if content is None:
-            return jsonify({"error": f"Nie można pobrać zawartości pliku {file_path}"}), 500
-        
-        return jsonify({
-            "content": content,
-            "path": file_path,
-            "message": "Zawartość pliku pobrana pomyślnie"
-        })
+        ftp.quit()
+    except FtpFileTooLarge as e:
+        ftp.quit()
+        return jsonify({"error": str(e)}), 413
+    except ftplib.error_perm as e:
+        ftp.quit()
+        status = 404 if str(e).startswith('550') else 500
+        return jsonify({"error": f"Nie można pobrać zawartości pliku {file_path}: {str(e)}"}), status
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
         try:
             ftp.quit()
         except:
             pass
+        return jsonify({"error": f"Nie można pobrać zawartości pliku {file_path}: {str(e)}"}), 500
+    
+    etag = content_etag(content)
+    if request.headers.get('If-None-Match') == etag:
+        return Response(status=304, headers={'ETag': etag})
+    
+    # Tryb surowy - bajty pliku bez dekodowania (np. pliki binarne lub w nieznanym kodowaniu)
+    if raw:
+        return Response(content, mimetype='application/octet-stream', headers={'ETag': etag})
+    
+    try:
+        text = content.decode(encoding)
+    except UnicodeDecodeError:
+        return jsonify({"error": f"Plik {file_path} nie jest tekstem w kodowaniu {encoding} - użyj trybu raw"}), 422
+    
+    response = jsonify({
+        "content": text,
+        "path": file_path,
+        "encoding": encoding,
+        "size": len(content),
+        "message": "Zawartość pliku pobrana pomyślnie"
+    })
+    response.headers['ETag'] = etag
+    return response
+
+# Treść pliku do zapisu: content (tekst w podanym kodowaniu) lub content_base64 (surowe bajty)
+def file_content_bytes(data):
+    if data.get('content_base64') is not None:
+        return base64.b64decode(data['content_base64'], validate=True)
+    return data['content'].encode(file_content_encoding(data))
 
 @app.route('/api/ftp/put-file-content', methods=['POST'])
 @token_required
 def api_put_file_content():
     data = request.json
-    required_fields = ['hostname', 'username', 'password', 'path', 'content']
+    required_fields = ['hostname', 'username', 'password', 'path']
     
-    if not data or not all(field in data for field in required_fields):
+    if not data or not all(field in data for field in required_fields) or (
+        data.get('content') is None and data.get('content_base64') is None
+    ):
         return jsonify({"error": "Brakujące dane połączenia FTP lub zawartość pliku"}), 400
     
     hostname = data['hostname']
@@ -1057,7 +4482,23 @@ def api_put_file_content():
     username = data['username']
     password = data['password']
     file_path = data['path']
-    content = data['content']
+    
+    try:
+        content = file_content_bytes(data)
+    except LookupError:
+        return jsonify({"error": f"Nieznane lub nietekstowe kodowanie: {data.get('encoding')}"}), 400
+    except UnicodeEncodeError as e:
+        return jsonify({"error": f"Treści nie można zapisać w kodowaniu {data.get('encoding')}: {str(e)}"}), 400
+    except (ValueError, TypeError, AttributeError):
+        return jsonify({"error": "Nieprawidłowa treść pliku (content lub content_base64)"}), 400
+    
+    if len(content) > FTP_FILE_CONTENT_MAX_SIZE:
+        return jsonify({"error": f"Plik przekracza limit {FTP_FILE_CONTENT_MAX_SIZE} B"}), 413
+    
+    if wants_background(data):
+        # Kolejka przechowuje treść jako base64 - bajty trafiają na kiosk bez ponownego kodowania
+        return submit_ftp_job('ftp_put_content', data, port, path=file_path,
+                              content_base64=base64.b64encode(content).decode('ascii'))
     
     # Jeśli hasło jest zaszyfrowane, odszyfruj je
     if password.startswith('ENC:'):
@@ -1069,22 +4510,24 @@ def api_put_file_content():
         return jsonify({"error": "Nie można połączyć się z serwerem FTP"}), 500
     
     try:
-        # Zapisz zawartość pliku
-        success = ftp_put_file_content(ftp, file_path, content)
-        if not success:
-            return jsonify({"error": f"Nie można zapisać zawartości pliku {file_path}"}), 500
-        
-        return jsonify({
-            "path": file_path,
-            "message": "Zawartość pliku zapisana pomyślnie"
-        })
+        # Zapisz zawartość pliku prosto z bufora w pamięci
+        ftp_put_file_content(ftp, file_path, content)
+        ftp.quit()
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
         try:
             ftp.quit()
         except:
             pass
+        return jsonify({"error": f"Nie można zapisać zawartości pliku {file_path}: {str(e)}"}), 500
+    ftp_paths_changed(hostname, [file_path])
+    
+    response = jsonify({
+        "path": file_path,
+        "size": len(content),
+        "message": "Zawartość pliku zapisana pomyślnie"
+    })
+    response.headers['ETag'] = content_etag(content)
+    return response
 
 # Obracanie ekranu kiosku przez SSH za pomocą xrandr
 @app.route('/api/kiosks/<int:kiosk_id>/rotate-display', methods=['POST'])
@@ -1094,43 +4537,38 @@ def rotate_kiosk_display(kiosk_id):
     orientation = (data.get('orientation') or '').strip().lower()
     if orientation not in ['right', '0', 'normal']:
         return jsonify({"error": "Nieprawidłowa orientacja. Użyj 'right' lub '0' (normal)."}), 400
-    if orientation == 'normal':
-        orientation = '0'
+    command_name = 'rotate-right' if orientation == 'right' else 'rotate-normal'
 
     conn = get_db_connection()
     kiosk = conn.execute('SELECT id, name, ip_address FROM kiosks WHERE id = ?', (kiosk_id,)).fetchone()
-    conn.close()
     if not kiosk:
+        conn.close()
         return jsonify({"error": "Kiosk nie znaleziony"}), 404
     if not kiosk['ip_address']:
+        conn.close()
         return jsonify({"error": "Kiosk nie ma przypisanego adresu IP"}), 400
 
     # Pobierz ustawienia SSH
-    conn = get_db_connection()
-    settings = conn.execute('SELECT key, value FROM settings WHERE key IN ("defaultSshUsername", "defaultSshPort")').fetchall()
+    settings_dict = get_ssh_settings(conn)
     conn.close()
-    settings_dict = {s['key']: s['value'] for s in settings}
     ssh_username = settings_dict.get('defaultSshUsername', 'kiosk')
     ssh_port = int(settings_dict.get('defaultSshPort', 22))
 
-    ssh_key_path = os.path.join(os.path.dirname(__file__), 'ssh_keys', 'kiosk_id_rsa')
-    if not os.path.exists(ssh_key_path):
+    if not os.path.exists(SSH_KEY_PATH):
         return jsonify({"error": "Brak klucza SSH backend/ssh_keys/kiosk_id_rsa"}), 500
 
+    if wants_background(data):
+        return jsonify(submit_kiosk_command_job(kiosk, command_name, ssh_username, ssh_port)), 202
+
     try:
-        import paramiko
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        key = paramiko.RSAKey.from_private_key_file(ssh_key_path)
-        ssh.connect(kiosk['ip_address'], port=ssh_port, username=ssh_username, pkey=key, timeout=10)
+        ssh = ssh_clients.get(kiosk['ip_address'], ssh_port, ssh_username)
 
         # Wykonaj polecenie xrandr na ekranie :0
-        cmd = f"bash -lc 'export DISPLAY=:0; xrandr -o {orientation}'"
-        stdin, stdout, stderr = ssh.exec_command(cmd, timeout=10)
-        out = stdout.read().decode('utf-8', errors='ignore').strip()
-        err = stderr.read().decode('utf-8', errors='ignore').strip()
-        code = stdout.channel.recv_exit_status()
-        ssh.close()
+        try:
+            cmd, code, out, err = ssh_run_commands(ssh, SSH_COMMANDS[command_name])
+        except Exception:
+            ssh_clients.discard(kiosk['ip_address'], ssh_port, ssh_username)
+            raise
 
         if code != 0:
             return jsonify({"error": f"Błąd xrandr: {err or 'nieznany błąd'}", "stdout": out}), 500
@@ -1141,5 +4579,488 @@ def rotate_kiosk_display(kiosk_id):
     except Exception as e:
         return jsonify({"error": f"Nieoczekiwany błąd: {str(e)}"}), 500
 
+# Wykonanie nazwanego polecenia na wielu kioskach równolegle.
+# Wyniki są strumieniowane (NDJSON - jeden obiekt JSON na linię) w kolejności zakończenia.
+@app.route('/api/kiosks/bulk-command', methods=['POST'])
+@token_required
+def bulk_kiosk_command():
+    data = request.json
+    
+    if not data or 'command' not in data or 'kiosk_ids' not in data:
+        return jsonify({"error": "Brakujące dane: wymagane command i kiosk_ids"}), 400
+    
+    command_name = data['command']
+    if command_name not in SSH_COMMANDS:
+        return jsonify({"error": f"Nieznane polecenie. Dostępne: {', '.join(SSH_COMMANDS)}"}), 400
+    
+    try:
+        kiosk_ids = parse_kiosk_ids(data['kiosk_ids'])
+    except (ValueError, TypeError):
+        return jsonify({"error": "Nieprawidłowa lista kiosków"}), 400
+    
+    if not kiosk_ids:
+        return jsonify({"error": "Lista kiosków jest pusta"}), 400
+    
+    if not os.path.exists(SSH_KEY_PATH):
+        return jsonify({"error": "Brak klucza SSH backend/ssh_keys/kiosk_id_rsa"}), 500
+    
+    try:
+        load_ssh_key()
+    except ImportError:
+        return jsonify({"error": "Brak biblioteki paramiko. Zainstaluj: pip install paramiko"}), 500
+    except Exception as e:
+        return jsonify({"error": f"Błąd podczas ładowania klucza SSH: {str(e)}"}), 500
+    
+    conn = get_db_connection()
+    placeholders = ', '.join('?' for _ in kiosk_ids)
+    kiosks = conn.execute(f'SELECT id, name, ip_address FROM kiosks WHERE id IN ({placeholders})', kiosk_ids).fetchall()
+    settings_dict = get_ssh_settings(conn)
+    conn.close()
+    ssh_username = data.get('username') or settings_dict.get('defaultSshUsername', 'kiosk')
+    ssh_port = int(data.get('port') or settings_dict.get('defaultSshPort', 22))
+    
+    found = {kiosk['id']: dict(kiosk) for kiosk in kiosks}
+    
+    # W tle - po jednym zadaniu na kiosk (z limitem współbieżności i ponowieniami kolejki)
+    if wants_background(data):
+        jobs = []
+        for kiosk_id in kiosk_ids:
+            kiosk = found.get(kiosk_id)
+            if not kiosk or not kiosk['ip_address']:
+                error = "Kiosk nie znaleziony" if not kiosk else "Kiosk nie ma przypisanego adresu IP"
+                jobs.append({"kiosk_id": kiosk_id, "command": command_name, "success": False, "error": error})
+                continue
+            jobs.append(submit_kiosk_command_job(kiosk, command_name, ssh_username, ssh_port))
+        return jsonify(jobs), 202
+    
+    futures = [
+        ssh_executor.submit(run_kiosk_command, found[kiosk_id], command_name, ssh_username, ssh_port)
+        for kiosk_id in kiosk_ids if kiosk_id in found
+    ]
+    missing = [kiosk_id for kiosk_id in kiosk_ids if kiosk_id not in found]
+    
+    def generate():
+        succeeded = 0
+        for kiosk_id in missing:
+            yield json.dumps({"kiosk_id": kiosk_id, "command": command_name, "success": False, "error": "Kiosk nie znaleziony"}, ensure_ascii=False) + '\n'
+        for future in as_completed(futures):
+            result = future.result()
+            succeeded += result['success']
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+        yield json.dumps({"summary": True, "total": len(kiosk_ids), "succeeded": succeeded, "failed": len(kiosk_ids) - succeeded}) + '\n'
+    
+    return app.response_class(generate(), mimetype='application/x-ndjson')
+
+# Trwała kolejka zadań w tle (tabela jobs) - długie operacje na kioskach (FTP, SSH) wykonywane są
+# przez pulę wątków roboczych zamiast w handlerze żądania. Na jeden kiosk (host) przypada najwyżej
+# JOB_KIOSK_CONCURRENCY jednocześnie wykonywanych zadań; błędy przejściowe są ponawiane z narastającym opóźnieniem.
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '8'))                      # liczba wątków roboczych
+JOB_KIOSK_CONCURRENCY = int(os.getenv('JOB_KIOSK_CONCURRENCY', '2'))  # maks. liczba zadań naraz na jeden kiosk
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))            # liczba prób zanim zadanie zostanie uznane za nieudane
+JOB_RETRY_DELAY = 5                                                   # opóźnienie pierwszej ponownej próby (s), dalej x2
+JOB_RETRY_MAX_DELAY = 300                                             # maks. opóźnienie ponownej próby (s)
+JOB_POLL_INTERVAL = 2                                                 # co ile sekund bezczynne wątki sprawdzają kolejkę
+JOB_RETENTION_DAYS = 7                                                # po ilu dniach zakończone zadania są usuwane
+JOB_FINISHED_STATUSES = ('done', 'error', 'cancelled')
+
+# Błąd zadania z informacją, czy ma sens ponowna próba
+class JobError(Exception):
+    def __init__(self, message, retry=False):
+        super().__init__(message)
+        self.retry = retry
+
+# Błędy, których ponowienie nic nie zmieni (brak pliku, brak uprawnień, błędne dane)
+JOB_PERMANENT_ERRORS = (ftplib.error_perm, ValueError, KeyError)
+
+def job_should_retry(error):
+    if isinstance(error, JobError):
+        return error.retry
+    return not isinstance(error, JOB_PERMANENT_ERRORS)
+
+def job_timestamp(offset=0):
+    return (datetime.datetime.now() + datetime.timedelta(seconds=offset)).strftime('%Y-%m-%d %H:%M:%S')
+
+class JobQueue:
+    def __init__(self, workers, per_kiosk):
+        self.workers = workers
+        self.per_kiosk = per_kiosk
+        self._handlers = {}
+        # Hasła nie trafiają do bazy - po restarcie serwera zadanie korzysta z danych z tabeli kiosks
+        self._secrets = {}
+        self._running = {}
+        self._cond = threading.Condition()
+        self._started = False
+        self._last_prune = 0
+
+    # prepare/finalize - wywoływane przy przyjęciu zadania (także po restarcie) i po jego zakończeniu
+    def register(self, job_type, handler, prepare=None, finalize=None):
+        self._handlers[job_type] = (handler, prepare, finalize)
+
+    def start(self):
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        conn = get_db_connection()
+        # Zadania przerwane przez restart wracają do kolejki (o ile zostały im próby)
+        conn.execute(
+            'UPDATE jobs SET status = "error", error = "Przerwane przez restart serwera", finished_at = ? '
+            'WHERE status = "running" AND attempts >= max_attempts',
+            (job_timestamp(),)
+        )
+        conn.execute('UPDATE jobs SET status = "queued" WHERE status = "running"')
+        conn.commit()
+        queued = conn.execute('SELECT type, payload FROM jobs WHERE status = "queued"').fetchall()
+        conn.close()
+        for row in queued:
+            self._call_hook(row['type'], 1, json.loads(row['payload']))
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True).start()
+
+    def _call_hook(self, job_type, index, payload):
+        hook = self._handlers.get(job_type, (None, None, None))[index]
+        if hook:
+            try:
+                hook(payload)
+            except Exception as e:
+                print(f"Błąd obsługi zadania {job_type}: {e}")
+
+    def submit(self, job_type, kiosk_key, payload, secrets=None, max_attempts=JOB_MAX_ATTEMPTS):
+        if job_type not in self._handlers:
+            raise ValueError(f"Nieznany typ zadania: {job_type}")
+        job_id = uuid.uuid4().hex
+        now = job_timestamp()
+        self._call_hook(job_type, 1, payload)
+        if secrets:
+            self._secrets[job_id] = secrets
+        conn = get_db_connection()
+        conn.execute(
+            'INSERT INTO jobs (id, type, kiosk_key, payload, status, max_attempts, run_after, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, "queued", ?, ?, ?, ?)',
+            (job_id, job_type, kiosk_key, json.dumps(payload, ensure_ascii=False), max_attempts, now, now, now)
+        )
+        conn.commit()
+        conn.close()
+        with self._cond:
+            self._cond.notify()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        conn = get_db_connection()
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.close()
+        return self.to_dict(row) if row else None
+
+    def list(self, status=None, job_type=None, kiosk_key=None, limit=50):
+        query = 'SELECT * FROM jobs'
+        conditions, params = [], []
+        for column, value in (('status', status), ('type', job_type), ('kiosk_key', kiosk_key)):
+            if value:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY created_at DESC LIMIT ?'
+        params.append(limit)
+        conn = get_db_connection()
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+        return [self.to_dict(row) for row in rows]
+
+    # Anulować można tylko zadanie oczekujące w kolejce - zwraca False, jeśli już się wykonuje lub zakończyło
+    def cancel(self, job_id):
+        conn = get_db_connection()
+        now = job_timestamp()
+        cursor = conn.execute(
+            'UPDATE jobs SET status = "cancelled", finished_at = ?, updated_at = ? WHERE id = ? AND status = "queued"',
+            (now, now, job_id)
+        )
+        row = conn.execute('SELECT type, payload FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.commit()
+        conn.close()
+        if not cursor.rowcount:
+            return False
+        self._secrets.pop(job_id, None)
+        self._call_hook(row['type'], 2, json.loads(row['payload']))
+        return True
+
+    @staticmethod
+    def to_dict(row):
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['kiosk'] = job.pop('kiosk_key')
+        return job
+
+    # Pobiera pierwsze gotowe zadanie, którego kiosk nie przekroczył limitu współbieżności
+    def _claim(self):
+        now = job_timestamp()
+        conn = get_db_connection()
+        with self._cond:
+            # Kioski z kompletem uruchomionych zadań są pomijane już w zapytaniu - ich kolejka
+            # (choćby bardzo długa) nie zasłania zadań pozostałych kiosków
+            saturated = [key for key, running in self._running.items() if running >= self.per_kiosk]
+            row = conn.execute(
+                'SELECT id, type, kiosk_key, payload FROM jobs WHERE status = "queued" AND run_after <= ? '
+                f'AND kiosk_key NOT IN ({", ".join("?" * len(saturated))}) '
+                'ORDER BY run_after, created_at LIMIT 1',
+                (now, *saturated)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    'UPDATE jobs SET status = "running", attempts = attempts + 1, started_at = ?, updated_at = ? WHERE id = ?',
+                    (now, now, row['id'])
+                )
+                conn.commit()
+                self._running[row['kiosk_key']] = self._running.get(row['kiosk_key'], 0) + 1
+        conn.close()
+        return row
+
+    def _worker(self):
+        while True:
+            try:
+                row = self._claim()
+            except Exception as e:
+                print(f"Błąd pobierania zadania z kolejki: {e}")
+                row = None
+            if row is None:
+                self._prune()
+                with self._cond:
+                    self._cond.wait(JOB_POLL_INTERVAL)
+                continue
+            try:
+                self._execute(row)
+            finally:
+                with self._cond:
+                    self._running[row['kiosk_key']] -= 1
+                    if not self._running[row['kiosk_key']]:
+                        del self._running[row['kiosk_key']]
+                    # Zwolnione miejsce dla kiosku może odblokować kolejne zadanie
+                    self._cond.notify()
+
+    def _execute(self, row):
+        job_id = row['id']
+        handler, _, _ = self._handlers.get(row['type'], (None, None, None))
+        payload = json.loads(row['payload'])
+        result, error, retry = None, None, False
+        try:
+            if handler is None:
+                raise JobError(f"Nieznany typ zadania: {row['type']}")
+            result = handler(job_id, payload, self._secrets.get(job_id, {}))
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            retry = job_should_retry(e)
+
+        conn = get_db_connection()
+        now = job_timestamp()
+        attempts, max_attempts = conn.execute('SELECT attempts, max_attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if error is not None and retry and attempts < max_attempts:
+            delay = min(JOB_RETRY_DELAY * 2 ** (attempts - 1), JOB_RETRY_MAX_DELAY)
+            # Losowe rozrzucenie ponowień, żeby zadania do tego samego kiosku nie wracały jednocześnie
+            delay *= random.uniform(0.75, 1.25)
+            conn.execute(
+                'UPDATE jobs SET status = "queued", error = ?, run_after = ?, updated_at = ? WHERE id = ?',
+                (error, job_timestamp(delay), now, job_id)
+            )
+            conn.commit()
+            conn.close()
+            return
+        conn.execute(
+            'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, updated_at = ? WHERE id = ?',
+            (
+                'error' if error is not None else 'done',
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                error, now, now, job_id
+            )
+        )
+        conn.commit()
+        conn.close()
+        self._secrets.pop(job_id, None)
+        self._call_hook(row['type'], 2, payload)
+
+    def _prune(self):
+        if time.monotonic() - self._last_prune < 3600:
+            return
+        self._last_prune = time.monotonic()
+        try:
+            conn = get_db_connection()
+            conn.execute(
+                'DELETE FROM jobs WHERE status IN ("done", "error", "cancelled") AND finished_at < ?',
+                (job_timestamp(-JOB_RETENTION_DAYS * 86400),)
+            )
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Błąd usuwania starych zadań: {e}")
+
+job_queue = JobQueue(JOB_WORKERS, JOB_KIOSK_CONCURRENCY)
+
+# Czy klient prosi o wykonanie operacji w tle (?async=1 lub "async": true w treści)
+def wants_background(data=None):
+    flag = request.args.get('async')
+    if flag is None and isinstance(data, dict):
+        flag = data.get('async')
+    return str(flag).lower() in ('1', 'true', 'yes')
+
+# Hasło FTP dla zadania - z pamięci, a po restarcie serwera z tabeli kiosks
+def job_ftp_password(payload, secrets):
+    password = secrets.get('password')
+    if password is None:
+        conn = get_db_connection()
+        kiosk = conn.execute(
+            'SELECT ftp_password FROM kiosks WHERE ip_address = ? AND ftp_username = ?',
+            (payload['hostname'], payload['username'])
+        ).fetchone()
+        conn.close()
+        if not kiosk:
+            raise JobError('Brak hasła FTP - zadanie zostało przerwane restartem serwera')
+        password = kiosk['ftp_password'] or ''
+    if password.startswith('ENC:'):
+        password = decrypt_data(password[4:])
+    return password
+
+# Wykonuje operację na sesji z puli - po błędzie sesja jest zamykana, a nie zwracana do puli
+def run_ftp_job(payload, secrets, operation):
+    ftp = ftp_pool.acquire(payload['hostname'], payload['username'], job_ftp_password(payload, secrets), payload['port'])
+    try:
+        result = operation(ftp)
+    except Exception:
+        ftp_pool.release(ftp, discard=True)
+        raise
+    ftp.quit()
+    return result
+
+def submit_ftp_job(job_type, data, port, **payload):
+    payload.update(hostname=data['hostname'], username=data['username'], port=port)
+    job = job_queue.submit(job_type, data['hostname'], payload, secrets={'password': data['password']})
+    return jsonify(job), 202
+
+def ftp_upload_job(job_id, payload, secrets):
+    file_path = media_store.path_for(payload['sha256'])
+    if not os.path.exists(file_path):
+        raise JobError('Plik nie jest już dostępny w magazynie')
+    def upload(ftp):
+        ftp.cwd(payload['path'])
+        with open(file_path, 'rb') as file:
+            ftp.storbinary(f'STOR {payload["file_name"]}', file, blocksize=FTP_STREAM_CHUNK_SIZE)
+    run_ftp_job(payload, secrets, upload)
+    ftp_paths_changed(payload['hostname'], [posixpath.join(payload['path'], payload['file_name'])])
+    return {"message": f"Plik {payload['file_name']} został pomyślnie przesłany", "size": payload['size']}
+
+def ftp_delete_job(job_id, payload, secrets):
+    def delete(ftp):
+        results = []
+        for item in payload['files']:
+            try:
+                if item['is_directory']:
+                    ftp.rmd(item['path'])
+                else:
+                    ftp.delete(item['path'])
+                results.append({"path": item['path'], "success": True, "is_directory": item['is_directory']})
+                ftp_paths_changed(payload['hostname'], [item['path']], recursive=item['is_directory'])
+            except ftplib.error_perm as e:
+                results.append({"path": item['path'], "success": False, "error": str(e), "is_directory": item['is_directory']})
+        return results
+    results = run_ftp_job(payload, secrets, delete)
+    failed = sum(1 for r in results if not r['success'])
+    if failed == len(results):
+        raise JobError(f"Nie można usunąć: {results[0]['error']}" if len(results) == 1 else "Żaden plik nie został usunięty")
+    return {"results": results, "failed": failed}
+
+def ftp_mkdir_job(job_id, payload, secrets):
+    def mkdir(ftp):
+        ftp.cwd(payload['path'])
+        ftp.mkd(payload['folder_name'])
+    run_ftp_job(payload, secrets, mkdir)
+    new_dir_path = posixpath.join(payload['path'], payload['folder_name'])
+    ftp_paths_changed(payload['hostname'], [new_dir_path])
+    return {"message": f"Katalog {payload['folder_name']} został pomyślnie utworzony", "path": new_dir_path}
+
+def ftp_put_content_job(job_id, payload, secrets):
+    # Zadania sprzed zapisu treści jako base64 mają ją w polu content (tekst UTF-8)
+    if 'content_base64' in payload:
+        content = base64.b64decode(payload['content_base64'])
+    else:
+        content = payload['content'].encode(FTP_FILE_CONTENT_ENCODING)
+    run_ftp_job(payload, secrets, lambda ftp: ftp_put_file_content(ftp, payload['path'], content))
+    ftp_paths_changed(payload['hostname'], [payload['path']])
+    return {"path": payload['path'], "message": "Zawartość pliku zapisana pomyślnie"}
+
+def ftp_tree_job(job_id, payload, secrets):
+    job = FtpTreeJob(payload['operation'], payload['hostname'], payload['source'], payload['destination'], job_id=job_id)
+    with ftp_tree_jobs_lock:
+        ftp_tree_jobs[job.id] = job
+        while len(ftp_tree_jobs) > DISTRIBUTE_JOBS_KEPT:
+            ftp_tree_jobs.popitem(last=False)
+    password = job_ftp_password(payload, secrets)
+    run_ftp_tree_job(job, (payload['hostname'], payload['username'], password, payload['port']))
+    result = job.to_dict()
+    if job.status == 'error':
+        # Ponowienie ma sens tylko, gdy nic jeszcze nie zostało zmienione (np. brak połączenia)
+        raise JobError(result['errors'][-1]['error'], retry=job.done == 0 and job.failed == 0)
+    return result
+
+def kiosk_command_job(job_id, payload, secrets):
+    conn = get_db_connection()
+    kiosk = conn.execute('SELECT id, name, ip_address FROM kiosks WHERE id = ?', (payload['kiosk_id'],)).fetchone()
+    conn.close()
+    if not kiosk:
+        raise JobError('Kiosk nie znaleziony')
+    result = run_kiosk_command(dict(kiosk), payload['command'], payload['username'], payload['port'])
+    if not result['success']:
+        # Polecenie wykonane z błędem lub wysłane bez odpowiedzi nie jest ponawiane - tylko brak połączenia SSH
+        raise JobError(result['error'], retry='exit_code' not in result and not result.get('command_sent'))
+    return result
+
+def submit_kiosk_command_job(kiosk, command_name, ssh_username, ssh_port):
+    return job_queue.submit('kiosk_command', kiosk['ip_address'], {
+        "kiosk_id": kiosk['id'], "command": command_name, "username": ssh_username, "port": ssh_port
+    })
+
+# Pliki czekające w kolejce nie mogą zostać usunięte z magazynu
+job_queue.register(
+    'ftp_upload', ftp_upload_job,
+    prepare=lambda payload: media_store.pin(payload['sha256']),
+    finalize=lambda payload: media_store.unpin(payload['sha256'])
+)
+job_queue.register('ftp_delete', ftp_delete_job)
+job_queue.register('ftp_mkdir', ftp_mkdir_job)
+job_queue.register('ftp_put_content', ftp_put_content_job)
+job_queue.register('ftp_tree', ftp_tree_job)
+job_queue.register('kiosk_command', kiosk_command_job)
+job_queue.register('schedule_publish', schedule_publish_job, finalize=schedule_publish_finished)
+
+@app.route('/api/jobs', methods=['GET'])
+@token_required
+def list_jobs():
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError:
+        return jsonify({"error": "Parametr limit musi być liczbą całkowitą"}), 400
+    return jsonify(job_queue.list(
+        status=request.args.get('status'),
+        job_type=request.args.get('type'),
+        kiosk_key=request.args.get('kiosk'),
+        limit=limit
+    ))
+
+@app.route('/api/jobs/<string:job_id>', methods=['GET'])
+@token_required
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Zadanie nie znalezione"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<string:job_id>', methods=['DELETE'])
+@token_required
+def cancel_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Zadanie nie znalezione"}), 404
+    if not job_queue.cancel(job_id):
+        return jsonify({"error": f"Nie można anulować zadania w stanie {job['status']}"}), 409
+    return jsonify(job_queue.get(job_id))
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
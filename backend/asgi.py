@@ -0,0 +1,192 @@
+"""
+Tryb produkcyjny backendu - serwer ASGI (uvicorn) z tymi samymi trasami Flask co app.py.
+
+Połączenia HTTP obsługuje pętla zdarzeń, a kod Flask wykonywany jest w pulach wątków:
+operacje na kioskach (FTP, SSH, dystrybucja) mają osobną, dużą pulę, więc nawet setki
+wolnych kiosków nie blokują żądań panelu (lista kiosków, ustawienia, logowanie).
+Treść żądania i odpowiedzi jest przekazywana strumieniowo, bez buforowania w całości.
+
+Użycie:
+    uvicorn asgi:application --app-dir backend --host 0.0.0.0 --port 5000
+    python backend/asgi.py [--host 0.0.0.0] [--port 5000]
+"""
+import asyncio
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app
+
+ASGI_KIOSK_IO_THREADS = int(os.getenv('ASGI_KIOSK_IO_THREADS', '256'))  # wątki dla operacji FTP/SSH na kioskach
+ASGI_API_THREADS = int(os.getenv('ASGI_API_THREADS', '32'))             # wątki dla pozostałych żądań panelu
+
+# Trasy, które mogą czekać sekundami na kiosk (timeouty FTP/SSH), oraz długotrwały strumień zdarzeń
+KIOSK_IO_ROUTES = re.compile(
+    r'^/api/(ftp|distribute|media)(/|$)'
+    r'|^/api/kiosks/(\d+/(restart-service|rotate-display|ftp-credentials|schedule)|bulk-command|events)$'
+)
+
+kiosk_io_executor = ThreadPoolExecutor(max_workers=ASGI_KIOSK_IO_THREADS, thread_name_prefix='asgi-kiosk-io')
+api_executor = ThreadPoolExecutor(max_workers=ASGI_API_THREADS, thread_name_prefix='asgi-api')
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+# wsgi.input czytający treść żądania z kanału ASGI w miarę potrzeb (z wątku roboczego)
+class RequestBody:
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self._more = True
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+        self._buffer += message.get('body', b'')
+        self._more = message.get('more_body', False)
+
+    def read(self, size=-1):
+        while self._more and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self, size=-1):
+        while self._more and b'\n' not in self._buffer and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        data = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        # Treść bez Content-Length (chunked) jest czytana do końca strumienia
+        'wsgi.input_terminated': True,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            environ[name] = value
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+# Po odebraniu treści żądania kanał receive() zgłasza już tylko rozłączenie klienta
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            kiosk_io_executor.shutdown(wait=False)
+            api_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    loop = asyncio.get_running_loop()
+    executor = kiosk_io_executor if KIOSK_IO_ROUTES.match(scope['path']) else api_executor
+    environ = build_environ(scope, RequestBody(receive, loop))
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start['status'] = int(status.split(' ', 1)[0])
+        response_start['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    # Flask wykonywany w wątku z puli; kolejne porcje odpowiedzi (np. strumieniowanie z FTP)
+    # również pobierane są w wątku, a wysyłane przez pętlę zdarzeń
+    iterable = await loop.run_in_executor(executor, app.wsgi_app, environ, start_response)
+    chunks = iter(iterable)
+    # Serwer (np. h11 w uvicorn) po rozłączeniu klienta nie zgłasza błędu w send() - bez nasłuchu
+    # nieskończony strumień (SSE) lub pobieranie z FTP trwałyby dalej, zajmując wątek i sesję
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        started = False
+        while True:
+            pending = loop.run_in_executor(executor, next, chunks, None)
+            await asyncio.wait((pending, disconnect), return_when=asyncio.FIRST_COMPLETED)
+            if disconnect.done():
+                # Bieżąca porcja musi się zakończyć przed close() (generator nie może być wtedy wykonywany)
+                await asyncio.wait((pending,))
+                if not pending.cancelled():
+                    pending.exception()
+                return
+            chunk = pending.result()
+            if not started:
+                await send({'type': 'http.response.start', 'status': response_start['status'], 'headers': response_start['headers']})
+                started = True
+            if chunk is None:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        disconnect.cancel()
+        # close() zwalnia zasoby generatora odpowiedzi (np. sesję FTP z puli)
+        if hasattr(iterable, 'close'):
+            await loop.run_in_executor(executor, iterable.close)
+
+
+if __name__ == '__main__':
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='Backend Kiosk Manager w trybie ASGI')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+    uvicorn.run(application, host=args.host, port=args.port)
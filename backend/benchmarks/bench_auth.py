@@ -0,0 +1,62 @@
+"""
+Mikro-benchmark narzutu dekoratora token_required na pojedyncze żądanie.
+
+Porównuje weryfikację z cache tokenów (typowy przypadek - panel wysyła wiele
+żądań z tym samym tokenem) z pełną weryfikacją (dekodowanie JWT + zapytanie do bazy).
+
+Użycie:
+    python backend/benchmarks/bench_auth.py [--iterations 20000]
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(backend, view, token, iterations, use_cache):
+    headers = {'Authorization': f'Bearer {token}'}
+    with backend.app.test_request_context('/api/settings', headers=headers):
+        backend.token_cache.clear()
+        view()  # rozgrzewka
+        start = time.perf_counter()
+        for _ in range(iterations):
+            if not use_cache:
+                backend.token_cache.clear()
+            view()
+        elapsed = time.perf_counter() - start
+    return elapsed / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark weryfikacji tokenów JWT')
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='kiosk-bench-'), 'kiosks.db')
+    sys.path.insert(0, BACKEND_DIR)
+    import app as backend
+    import jwt
+
+    token = jwt.encode({
+        'username': 'admin',
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    }, backend.JWT_SECRET_KEY, algorithm="HS256")
+
+    # Pusty widok - mierzymy wyłącznie koszt dekoratora
+    view = backend.token_required(lambda: 'ok')
+
+    uncached = measure(backend, view, token, args.iterations, use_cache=False)
+    cached = measure(backend, view, token, args.iterations, use_cache=True)
+
+    print(f'Iteracji: {args.iterations}')
+    print(f'Bez cache:  {uncached:8.1f} µs/żądanie')
+    print(f'Z cache:    {cached:8.1f} µs/żądanie')
+    print(f'Przyspieszenie: {uncached / cached:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
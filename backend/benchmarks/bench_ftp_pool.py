@@ -0,0 +1,103 @@
+"""
+Benchmark puli sesji FTP dla sekwencji list -> odczyt -> zapis (jak w edytorze playlisty).
+
+Uruchamia lokalny serwer pyftpdlib jako zastępstwo kiosku (pip install pyftpdlib)
+i porównuje nowe połączenie na każdą operację z sesjami z puli ftp_pool.
+
+Użycie:
+    python backend/benchmarks/bench_ftp_pool.py [--rounds 200] [--latency-ms 0]
+"""
+import argparse
+import ftplib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import FTPServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERNAME = 'kiosk'
+PASSWORD = 'kiosk'
+
+
+def start_server(root, latency):
+    authorizer = DummyAuthorizer()
+    authorizer.add_user(USERNAME, PASSWORD, root, perm='elradfmwMT')
+
+    class SlowHandler(FTPHandler):
+        # Opcjonalne opóźnienie odpowiedzi symulujące RTT do Raspberry Pi w sieci
+        def on_connect(self):
+            if latency:
+                time.sleep(latency)
+
+    SlowHandler.authorizer = authorizer
+    server = FTPServer(('127.0.0.1', 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, kwargs={'handle_exit': False}, daemon=True).start()
+    return server.address[1]
+
+
+def plain_connect(hostname, username, password, port):
+    ftp = ftplib.FTP(timeout=30)
+    ftp.connect(hostname, port)
+    ftp.login(username, password)
+    return ftp
+
+
+def sequence(backend, connect, port):
+    ftp = connect('127.0.0.1', USERNAME, PASSWORD, port)
+    ftp.cwd('/')
+    lines = []
+    ftp.dir(lines.append)
+    ftp.quit()
+
+    ftp = connect('127.0.0.1', USERNAME, PASSWORD, port)
+    content = backend.ftp_get_file_content(ftp, '/schedule.json')
+    ftp.quit()
+
+    ftp = connect('127.0.0.1', USERNAME, PASSWORD, port)
+    backend.ftp_put_file_content(ftp, '/schedule.json', content)
+    ftp.quit()
+
+
+def run(backend, connect, port, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        sequence(backend, connect, port)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark puli sesji FTP')
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=0, help='sztuczne opóźnienie przy nawiązaniu połączenia')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='kiosk-bench-'), 'kiosks.db')
+    sys.path.insert(0, BACKEND_DIR)
+    import app as backend
+
+    root = tempfile.mkdtemp(prefix='kiosk-ftp-')
+    with open(os.path.join(root, 'schedule.json'), 'w') as f:
+        f.write('{"playlist": []}')
+    for i in range(50):
+        with open(os.path.join(root, f'video{i:03d}.mp4'), 'wb') as f:
+            f.write(b'\0' * 1024)
+
+    port = start_server(root, args.latency_ms / 1000)
+
+    plain = run(backend, plain_connect, port, args.rounds)
+    pooled = run(backend, backend.ftp_connect, port, args.rounds)
+
+    print(f'Sekwencji list -> odczyt -> zapis: {args.rounds}')
+    print(f'Nowe połączenie na operację: {plain:8.2f} ms/sekwencję')
+    print(f'Pula sesji FTP:              {pooled:8.2f} ms/sekwencję')
+    print(f'Przyspieszenie: {plain / pooled:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
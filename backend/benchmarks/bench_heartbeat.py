@@ -0,0 +1,89 @@
+"""
+Benchmark endpointu heartbeat /api/device/<serial>/ip.
+
+Uruchamia aplikację na tymczasowej kopii bazy (nie dotyka database/kiosks.db)
+i mierzy liczbę żądań na sekundę przy kilku równoległych wątkach.
+
+Użycie:
+    python backend/benchmarks/bench_heartbeat.py              # obecna warstwa połączeń (pula + WAL)
+    python backend/benchmarks/bench_heartbeat.py --legacy     # nowe połączenie sqlite3 na każde wywołanie
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy_get_db_connection(database_path):
+    # Odtworzenie dawnego zachowania: nowe połączenie przy każdym wywołaniu
+    def get_db_connection():
+        conn = sqlite3.connect(database_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+    return get_db_connection
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark heartbeatów kiosków')
+    parser.add_argument('--kiosks', type=int, default=300, help='liczba zarejestrowanych kiosków')
+    parser.add_argument('--requests', type=int, default=3000, help='łączna liczba żądań')
+    parser.add_argument('--threads', type=int, default=8, help='liczba równoległych wątków')
+    parser.add_argument('--legacy', action='store_true', help='użyj dawnego get_db_connection (bez puli i WAL)')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='kiosk-bench-')
+    database_path = os.path.join(work_dir, 'kiosks.db')
+    os.environ['DATABASE_PATH'] = database_path
+
+    sys.path.insert(0, BACKEND_DIR)
+    import app as backend
+
+    conn = sqlite3.connect(database_path)
+    if args.legacy:
+        conn.execute('PRAGMA journal_mode = DELETE')
+    conn.executemany(
+        'INSERT INTO kiosks (mac_address, serial_number, name) VALUES (?, ?, ?)',
+        [(f'00:00:00:00:{i // 256:02x}:{i % 256:02x}', f'BENCH{i:06d}', f'Kiosk {i}') for i in range(args.kiosks)]
+    )
+    conn.commit()
+    conn.close()
+
+    if args.legacy:
+        backend.get_db_connection = legacy_get_db_connection(database_path)
+
+    per_thread = args.requests // args.threads
+    errors = []
+
+    def worker(offset):
+        client = backend.app.test_client()
+        for i in range(per_thread):
+            serial = f'BENCH{(offset + i) % args.kiosks:06d}'
+            response = client.put(f'/api/device/{serial}/ip', json={'ip_address': '10.0.0.1'})
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=worker, args=(t * per_thread,)) for t in range(args.threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # Heartbeaty są zapisywane zbiorczo - dolicz ostatni zapis do czasu pomiaru
+    backend.heartbeat_buffer.flush()
+    elapsed = time.perf_counter() - start
+
+    total = per_thread * args.threads
+    mode = 'legacy' if args.legacy else 'pool+WAL'
+    print(f'Tryb: {mode}')
+    print(f'Żądań: {total}, wątków: {args.threads}, czas: {elapsed:.2f} s')
+    print(f'Przepustowość: {total / elapsed:.1f} req/s')
+    print(f'Błędy: {len(errors)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark wyszukiwania kiosków: GET /api/kiosks/query (filtry, kursor, wybór pól) vs pełna lista.
+
+Tworzy syntetyczną flotę z tagami i grupami w tymczasowej bazie (nie dotyka database/kiosks.db)
+i mierzy czas pierwszej i dalszej strony dla typowych filtrów panelu oraz przejścia całej floty
+stronami po 100 kiosków.
+
+Użycie:
+    python backend/benchmarks/bench_kiosk_query.py [--kiosks 5000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def generate_fleet(database_path, kiosks):
+    rng = random.Random(1)
+    conn = sqlite3.connect(database_path)
+    conn.executemany(
+        'INSERT INTO kiosks (mac_address, serial_number, name, ip_address, status, last_connection) VALUES (?, ?, ?, ?, ?, ?)',
+        [
+            (f'00:00:00:{i // 65536:02x}:{i // 256 % 256:02x}:{i % 256:02x}', f'BENCH{i:06d}', f'Kiosk {rng.randrange(10000):04d}',
+             f'10.{i // 65536}.{i // 256 % 256}.{i % 256}', 'online' if rng.random() < 0.9 else 'offline',
+             f'2026-10-{rng.randrange(1, 29):02d} {rng.randrange(24):02d}:00:00')
+            for i in range(kiosks)
+        ]
+    )
+    tags = ['lobby', 'vertical', 'outdoor', 'mall', 'airport']
+    conn.executemany(
+        'INSERT INTO kiosk_tags (kiosk_id, tag) VALUES (?, ?)',
+        [(kiosk_id, tag) for kiosk_id in range(1, kiosks + 1) for tag in rng.sample(tags, 2)]
+    )
+    conn.executemany('INSERT INTO kiosk_groups (name) VALUES (?)', [(f'Grupa {i}',) for i in range(20)])
+    conn.executemany(
+        'INSERT INTO kiosk_group_members (group_id, kiosk_id) VALUES (?, ?)',
+        [(rng.randrange(1, 21), kiosk_id) for kiosk_id in range(1, kiosks + 1)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def timed(label, func, repeat=20):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f'{label:<55} {best * 1000:9.2f} ms')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark wyszukiwania kiosków')
+    parser.add_argument('--kiosks', type=int, default=5000, help='liczba kiosków')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='kiosk-bench-')
+    database_path = os.path.join(work_dir, 'kiosks.db')
+    os.environ['DATABASE_PATH'] = database_path
+
+    sys.path.insert(0, BACKEND_DIR)
+    import app as backend
+
+    generate_fleet(database_path, args.kiosks)
+    print(f'Kiosków: {args.kiosks}')
+
+    client = backend.app.test_client()
+    token = client.post('/api/auth/login', json={'username': 'admin', 'password': 'admin'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def api(url):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return response.get_json()
+
+    def full_list():
+        backend.kiosk_snapshot.invalidate()
+        return api('/api/kiosks')
+
+    timed('Pełna lista /api/kiosks (bez migawki)', full_list)
+    queries = (
+        ('Pierwsza strona (id)', 'limit=100'),
+        ('Offline, sortowanie po nazwie', 'status=offline&sort=name&limit=100'),
+        ('Tag lobby + grupa 3, pola id,name,status', 'tag=lobby&group=3&fields=id,name,status&limit=100'),
+        ('Fragment IP "10.0.1", z tagami i grupami', 'q=10.0.1&fields=id,ip_address,tags,groups&limit=100'),
+        ('Ostatnie połączenie malejąco, z total', 'sort=last_connection&order=desc&include_total=1&limit=100'),
+    )
+    for label, query in queries:
+        first = timed(label, lambda: api(f'/api/kiosks/query?{query}'))
+        if first['next_cursor']:
+            timed('  kolejna strona', lambda: api(f'/api/kiosks/query?{query}&cursor={first["next_cursor"]}'))
+
+    def walk():
+        cursor, pages = None, 0
+        while True:
+            page = api('/api/kiosks/query?sort=name&fields=id,name&limit=100' + (f'&cursor={cursor}' if cursor else ''))
+            pages += 1
+            cursor = page['next_cursor']
+            if not cursor:
+                return pages
+    pages = timed('Cała flota stronami po 100 (sortowanie po nazwie)', walk, repeat=3)
+    print(f'    stron: {pages}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Test obciążeniowy trybów serwowania backendu: serwer deweloperski Werkzeug (app.run)
+i tryb ASGI (backend/asgi.py, uvicorn).
+
+Symuluje wiele wolnych kiosków (lokalny serwer FTP, który odpowiada dopiero po
+--kiosk-delay sekundach) i równolegle mierzy przepustowość oraz opóźnienia żądań
+panelu (GET /api/kiosks), które nie powinny czekać na kioski.
+
+Użycie:
+    python backend/benchmarks/bench_serving.py [--mode both|dev|asgi] [--slow-clients 200]
+        [--dashboard-clients 8] [--duration 15] [--kiosk-delay 3]
+"""
+import argparse
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER_COMMANDS = {
+    # Jak python backend/app.py, ale bez automatycznego przeładowania (debug)
+    'dev': "import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)",
+    'asgi': "import asgi, uvicorn; uvicorn.run(asgi.application, host='127.0.0.1', port={port}, log_level='warning')",
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_slow_kiosk(delay):
+    # Minimalny serwer FTP - powitanie dopiero po opóźnieniu, potem logowanie i NOOP
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1024)
+    replies = {'USER': '331 Hasło', 'PASS': '230 Zalogowano', 'PWD': '257 "/"', 'NOOP': '200 OK', 'TYPE': '200 OK'}
+
+    def handle(conn):
+        try:
+            with conn, conn.makefile('rwb', buffering=0) as stream:
+                time.sleep(delay)
+                stream.write(b'220 kiosk\r\n')
+                for line in stream:
+                    command = line.decode('latin-1').split(' ', 1)[0].strip().upper()
+                    if command == 'QUIT':
+                        stream.write(b'221 Bye\r\n')
+                        return
+                    stream.write(replies.get(command, '502 Nieobsługiwane').encode('utf-8') + b'\r\n')
+        except OSError:
+            pass  # backend zamknął sesję (np. po przekroczeniu czasu bezczynności)
+
+    def serve():
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def request(url, method='GET', data=None, token=None, timeout=120):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    body = json.dumps(data).encode('utf-8') if data is not None else None
+    req = urllib.request.Request(url, data=body, method=method, headers=headers)
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return json.loads(response.read() or b'null')
+
+
+def start_backend(mode):
+    port = free_port()
+    env = dict(os.environ, DATABASE_PATH=os.path.join(tempfile.mkdtemp(prefix='kiosk-bench-'), 'kiosks.db'))
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVER_COMMANDS[mode].format(port=port)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            token = request(f'{base_url}/api/auth/login', 'POST', {'username': 'admin', 'password': 'admin'})['token']
+            return process, base_url, token
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'Backend w trybie {mode} nie wystartował')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else float('nan')
+
+
+def run(mode, args, kiosk_port):
+    process, base_url, token = start_backend(mode)
+    stop = threading.Event()
+    usernames = itertools.count()
+    lock = threading.Lock()
+    dashboard, slow, errors = [], [], [0]
+
+    def slow_client():
+        while not stop.is_set():
+            # Inny użytkownik przy każdym żądaniu - nowa sesja FTP, jak przy wielu różnych kioskach
+            data = {'hostname': '127.0.0.1', 'port': kiosk_port, 'username': f'kiosk{next(usernames)}', 'password': 'x'}
+            started = time.perf_counter()
+            try:
+                request(f'{base_url}/api/ftp/connect', 'POST', data, token)
+                with lock:
+                    slow.append(time.perf_counter() - started)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+
+    def dashboard_client():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                request(f'{base_url}/api/kiosks', token=token)
+                with lock:
+                    dashboard.append(time.perf_counter() - started)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=slow_client, daemon=True) for _ in range(args.slow_clients)]
+    threads += [threading.Thread(target=dashboard_client, daemon=True) for _ in range(args.dashboard_clients)]
+    try:
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        with lock:
+            dashboard_done, slow_done, failed = list(dashboard), list(slow), errors[0]
+    finally:
+        process.kill()
+        process.wait()
+
+    print(f'[{mode}]')
+    print(f'  panel:   {len(dashboard_done) / args.duration:8.1f} żądań/s, '
+          f'p50 {percentile(dashboard_done, 0.5) * 1000:7.1f} ms, p95 {percentile(dashboard_done, 0.95) * 1000:7.1f} ms, '
+          f'p99 {percentile(dashboard_done, 0.99) * 1000:7.1f} ms')
+    print(f'  kioski:  {len(slow_done) / args.duration:8.1f} operacji/s (w toku naraz: {args.slow_clients})')
+    print(f'  błędy:   {failed}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Test obciążeniowy trybów serwowania backendu')
+    parser.add_argument('--mode', choices=['both', 'dev', 'asgi'], default='both')
+    parser.add_argument('--slow-clients', type=int, default=200)
+    parser.add_argument('--dashboard-clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--kiosk-delay', type=float, default=3)
+    args = parser.parse_args()
+
+    kiosk_port = start_slow_kiosk(args.kiosk_delay)
+    for mode in (['dev', 'asgi'] if args.mode == 'both' else [args.mode]):
+        run(mode, args, kiosk_port)
+
+
+if __name__ == '__main__':
+    main()
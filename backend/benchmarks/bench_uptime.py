@@ -0,0 +1,118 @@
+"""
+Benchmark historii dostępności: agregacja heartbeatów i zapytania /api/kiosks/.../uptime.
+
+Generuje syntetyczną historię (heartbeat co 30 s, losowe przerwy) w tymczasowej bazie
+(nie dotyka database/kiosks.db), agreguje ją i mierzy czas zapytań o dostępność
+jednego kiosku i całej floty dla zakresów doba / 30 dni / rok. Dla porównania
+liczy dostępność bezpośrednio z surowych heartbeatów (bez agregatów).
+
+Użycie:
+    python backend/benchmarks/bench_uptime.py [--kiosks 200] [--days 7]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def generate_history(database_path, kiosks, start, end):
+    conn = sqlite3.connect(database_path)
+    conn.executemany(
+        'INSERT INTO kiosks (mac_address, serial_number, name) VALUES (?, ?, ?)',
+        [(f'00:00:00:00:{i // 256:02x}:{i % 256:02x}', f'BENCH{i:06d}', f'Kiosk {i}') for i in range(kiosks)]
+    )
+    rng = random.Random(1)
+    for kiosk_id in range(1, kiosks + 1):
+        rows = []
+        ts = start + rng.randrange(30)
+        while ts < end:
+            # Średnio kilka przerw na dobę, część kiosków "miga" częściej
+            if rng.random() < (0.002 if kiosk_id % 10 else 0.02):
+                ts += rng.randrange(120, 7200)
+                continue
+            rows.append((ts, kiosk_id))
+            ts += 30
+        conn.executemany('INSERT INTO heartbeats (ts, kiosk_id) VALUES (?, ?)', rows)
+    conn.commit()
+    count = conn.execute('SELECT COUNT(*) FROM heartbeats').fetchone()[0]
+    conn.close()
+    return count
+
+
+def timed(label, func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f'{label:<45} {best * 1000:9.1f} ms')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark historii dostępności kiosków')
+    parser.add_argument('--kiosks', type=int, default=200, help='liczba kiosków')
+    parser.add_argument('--days', type=int, default=7, help='liczba dni syntetycznej historii')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='kiosk-bench-')
+    database_path = os.path.join(work_dir, 'kiosks.db')
+    os.environ['DATABASE_PATH'] = database_path
+
+    sys.path.insert(0, BACKEND_DIR)
+    import app as backend
+
+    now = int(time.time())
+    history_start = now - args.days * backend.ROLLUP_DAY
+    started = time.perf_counter()
+    count = generate_history(database_path, args.kiosks, history_start, now)
+    print(f'Heartbeatów: {count} ({args.kiosks} kiosków, {args.days} dni), generowanie {time.perf_counter() - started:.1f} s')
+
+    started = time.perf_counter()
+    backend.rollup_heartbeats(now)
+    print(f'Pierwsza agregacja całej historii: {time.perf_counter() - started:.2f} s')
+    # Kolejny przebieg wątku w tle - tylko ostatnia minuta
+    timed('Przyrostowa agregacja (co minutę)', lambda: backend.rollup_heartbeats(now + 60))
+
+    client = backend.app.test_client()
+    token = client.post('/api/auth/login', json={'username': 'admin', 'password': 'admin'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def api(url):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return response.get_json()
+
+    for label, days in (('doba', 1), ('30 dni', 30), ('rok', 365)):
+        start = backend.epoch_to_timestamp(now - days * backend.ROLLUP_DAY)
+        result = timed(f'Kiosk 10, {label}', lambda: api(f'/api/kiosks/10/uptime?start={start}'))
+        print(f'    rozdzielczość {result["resolution"]} s, dostępność {result["uptime_percent"]}%, przerw {result["outage_count"]}')
+        timed(f'Flota, {label}', lambda: api(f'/api/kiosks/uptime?start={start}'))
+
+    # Porównanie: dostępność floty liczona z surowych heartbeatów
+    conn = sqlite3.connect(database_path)
+    since = now - backend.ROLLUP_DAY
+    timed(
+        'Flota, doba - z surowych heartbeatów',
+        lambda: conn.execute(
+            'SELECT kiosk_id, COUNT(DISTINCT ts / 60) FROM heartbeats WHERE ts >= ? GROUP BY kiosk_id', (since,)
+        ).fetchall()
+    )
+    since = history_start
+    timed(
+        f'Flota, {args.days} dni - z surowych heartbeatów',
+        lambda: conn.execute(
+            'SELECT kiosk_id, COUNT(DISTINCT ts / 60) FROM heartbeats WHERE ts >= ? GROUP BY kiosk_id', (since,)
+        ).fetchall()
+    )
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Testy działają na tymczasowej bazie (nie dotykają database/kiosks.db)
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='kiosk-test-'), 'kiosks.db')
+sys.path.insert(0, BACKEND_DIR)
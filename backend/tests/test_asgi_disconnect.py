@@ -0,0 +1,80 @@
+"""
+Rozłączenie klienta w trakcie strumieniowanej odpowiedzi trybu ASGI: most przestaje pobierać
+kolejne porcje i zamyka odpowiedź, więc generator zwalnia swoje zasoby.
+"""
+import asyncio
+import os
+import tempfile
+import threading
+from urllib.parse import urlencode
+
+import pytest
+
+import app as backend
+import asgi
+
+
+def run_asgi(path, query, disconnect_after, timeout=10):
+    async def main():
+        incoming = asyncio.Queue()
+        await incoming.put({'type': 'http.request', 'body': b'', 'more_body': False})
+        body = []
+
+        async def receive():
+            return await incoming.get()
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and message.get('body'):
+                body.append(message['body'])
+                if len(body) == disconnect_after:
+                    await incoming.put({'type': 'http.disconnect'})
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': urlencode(query).encode('ascii'),
+            'headers': [], 'http_version': '1.1', 'scheme': 'http', 'root_path': '',
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)
+        }
+        await asyncio.wait_for(asgi.application(scope, receive, send), timeout)
+        return body
+    return asyncio.run(main())
+
+
+def test_download_stops_and_releases_session_on_disconnect():
+    pytest.importorskip('pyftpdlib')
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+
+    root = tempfile.mkdtemp()
+    size = 32 * 1024 * 1024
+    with open(os.path.join(root, 'big.bin'), 'wb') as file:
+        file.truncate(size)
+    authorizer = DummyAuthorizer()
+    authorizer.add_user('kiosk', 'pw', root, perm='elr')
+    handler = type('Handler', (FTPHandler,), {'authorizer': authorizer})
+    server = ThreadedFTPServer(('127.0.0.1', 0), handler)
+    port = server.address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        body = run_asgi('/api/ftp/download', {
+            'hostname': '127.0.0.1', 'port': port, 'username': 'kiosk', 'password': 'pw', 'path': '/big.bin'
+        }, disconnect_after=1)
+    finally:
+        server.close_all()
+
+    assert sum(len(chunk) for chunk in body) < size
+    assert backend.ftp_pool._in_use[('127.0.0.1', port, 'kiosk')] == 0
+
+
+def test_event_stream_unsubscribes_on_disconnect(monkeypatch):
+    # Krótki keepalive - generator wraca z queue.get() szybko po rozłączeniu
+    monkeypatch.setattr(backend, 'KIOSK_EVENTS_KEEPALIVE', 0.1)
+    token = backend.jwt.encode({
+        'username': 'admin',
+        'exp': backend.datetime.datetime.utcnow() + backend.datetime.timedelta(minutes=5)
+    }, backend.JWT_SECRET_KEY, algorithm="HS256")
+
+    body = run_asgi('/api/kiosks/events', {'token': token}, disconnect_after=2)
+
+    assert body[0].startswith(b'retry:')
+    assert len(backend.kiosk_events._subscribers) == 0
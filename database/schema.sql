@@ -14,6 +14,7 @@ CREATE TABLE IF NOT EXISTS kiosks (
 
 CREATE INDEX IF NOT EXISTS idx_kiosks_mac ON kiosks(mac_address);
 CREATE INDEX IF NOT EXISTS idx_kiosks_serial ON kiosks(serial_number);
+CREATE INDEX IF NOT EXISTS idx_kiosks_last_connection ON kiosks(last_connection);
 
 -- Tabela ustawień aplikacji
 CREATE TABLE IF NOT EXISTS settings (
@@ -40,3 +41,154 @@ CREATE TABLE IF NOT EXISTS users (
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
 );
+
+-- Magazyn plików multimedialnych adresowanych treścią (SHA-256)
+CREATE TABLE IF NOT EXISTS media_files (
+    sha256 CHAR(64) PRIMARY KEY,
+    size INTEGER NOT NULL,
+    original_name VARCHAR(255),
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    last_used DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_media_files_last_used ON media_files(last_used);
+
+-- Manifest plików wysłanych na kioski (ścieżka na kiosku -> skrót treści)
+CREATE TABLE IF NOT EXISTS kiosk_media (
+    kiosk_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    size INTEGER NOT NULL,
+    synced_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kiosk_id, path)
+);
+
+-- Trwała kolejka zadań w tle (operacje FTP/SSH na kioskach); payload bez haseł
+CREATE TABLE IF NOT EXISTS jobs (
+    id CHAR(32) PRIMARY KEY,
+    type VARCHAR(30) NOT NULL,
+    kiosk_key VARCHAR(255) NOT NULL,
+    payload TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_after DATETIME NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    started_at DATETIME,
+    finished_at DATETIME,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs(status, run_after);
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at);
+
+-- Historia heartbeatów (tylko dopisywanie; czas jako epoch w sekundach)
+CREATE TABLE IF NOT EXISTS heartbeats (
+    ts INTEGER NOT NULL,
+    kiosk_id INTEGER NOT NULL,
+    PRIMARY KEY (ts, kiosk_id)
+) WITHOUT ROWID;
+
+-- Agregaty dostępności: resolution = 60 / 3600 / 86400 s, bucket = początek przedziału (epoch)
+CREATE TABLE IF NOT EXISTS heartbeat_rollups (
+    resolution INTEGER NOT NULL,
+    kiosk_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    up_minutes INTEGER NOT NULL,
+    outages INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (resolution, kiosk_id, bucket)
+) WITHOUT ROWID;
+
+-- Zapytania o całą flotę w zakresie czasu (indeks pokrywający)
+CREATE INDEX IF NOT EXISTS idx_heartbeat_rollups_bucket ON heartbeat_rollups(resolution, bucket, kiosk_id, up_minutes, outages);
+
+-- Do którego momentu heartbeaty zostały zagregowane (per poziom)
+CREATE TABLE IF NOT EXISTS heartbeat_rollup_state (
+    resolution INTEGER PRIMARY KEY,
+    done_until INTEGER NOT NULL
+);
+
+-- Kopia harmonogramu odtwarzacza (schedule.json) każdego kiosku; sha256 - skrót pliku na kiosku
+CREATE TABLE IF NOT EXISTS kiosk_schedules (
+    kiosk_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    content TEXT NOT NULL,
+    fetched_at DATETIME,
+    published_at DATETIME
+);
+
+-- Szablony harmonogramów (treść jak schedule.json; nazwy plików mogą zawierać {serial} i {id})
+CREATE TABLE IF NOT EXISTS schedule_templates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(100) NOT NULL UNIQUE,
+    version INTEGER NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    content TEXT NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Grupy kiosków z przypisanym szablonem harmonogramu
+CREATE TABLE IF NOT EXISTS kiosk_groups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(100) NOT NULL UNIQUE,
+    template_id INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_kiosk_groups_template ON kiosk_groups(template_id);
+
+CREATE TABLE IF NOT EXISTS kiosk_group_members (
+    group_id INTEGER NOT NULL,
+    kiosk_id INTEGER NOT NULL,
+    PRIMARY KEY (group_id, kiosk_id)
+) WITHOUT ROWID;
+
+-- Grupy danego kiosku
+CREATE INDEX IF NOT EXISTS idx_kiosk_group_members_kiosk ON kiosk_group_members(kiosk_id, group_id);
+
+-- Tagi kiosków (dowolne etykiety, np. lokalizacja, orientacja ekranu)
+CREATE TABLE IF NOT EXISTS kiosk_tags (
+    kiosk_id INTEGER NOT NULL,
+    tag VARCHAR(50) NOT NULL,
+    PRIMARY KEY (kiosk_id, tag)
+) WITHOUT ROWID;
+
+-- Kiosk z danym tagiem
+CREATE INDEX IF NOT EXISTS idx_kiosk_tags_tag ON kiosk_tags(tag, kiosk_id);
+
+-- Wyszukiwanie kiosków (/api/kiosks/query): filtr statusu i stronicowanie po nazwie / ostatnim połączeniu
+-- (wyrażenia takie same jak w KIOSK_QUERY_SORTS; id dołączane przez SQLite do każdego wpisu indeksu)
+CREATE INDEX IF NOT EXISTS idx_kiosks_status ON kiosks(status);
+CREATE INDEX IF NOT EXISTS idx_kiosks_name_sort ON kiosks(IFNULL(name, ''));
+CREATE INDEX IF NOT EXISTS idx_kiosks_last_connection_sort ON kiosks(IFNULL(last_connection, ''));
+
+-- Wdrożenia szablonów harmonogramów; publikacja na każdym kiosku to zadanie w kolejce (jobs)
+CREATE TABLE IF NOT EXISTS schedule_rollouts (
+    id CHAR(32) PRIMARY KEY,
+    allow_missing INTEGER NOT NULL DEFAULT 0,
+    created_at DATETIME NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_schedule_rollouts_created_at ON schedule_rollouts(created_at);
+
+-- Wynik wdrożenia na poszczególnych kioskach (status: pending, publishing, done, skipped, error)
+CREATE TABLE IF NOT EXISTS schedule_rollout_kiosks (
+    rollout_id CHAR(32) NOT NULL,
+    kiosk_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name VARCHAR(100),
+    template_id INTEGER,
+    group_id INTEGER,
+    job_id CHAR(32),
+    status VARCHAR(20) NOT NULL,
+    version INTEGER,
+    missing_files TEXT,
+    error TEXT,
+    finished_at DATETIME,
+    PRIMARY KEY (rollout_id, kiosk_id)
+) WITHOUT ROWID;
@@ -4,6 +4,12 @@
 class ApiClient {
     constructor(baseUrl) {
         this.baseUrl = baseUrl;
+        // Ostatnie listingi katalogów FTP wraz z ETag (klucz: host, port, użytkownik, ścieżka)
+        this.listingCache = new Map();
+        // Ostatnio pobrane treści plików wraz z ETag (get-file-content)
+        this.fileContentCache = new Map();
+        // Ostatnia migawka floty wraz z ETag (/api/kiosks/snapshot)
+        this.fleetSnapshot = null;
     }
 
     getAuthToken() {
@@ -15,15 +21,17 @@ class ApiClient {
      * @param {string} endpoint - ścieżka endpoint
      * @param {string} method - metoda HTTP (GET, POST, PUT, DELETE)
      * @param {object} data - dane do wysłania (opcjonalne)
+     * @param {object} extraHeaders - dodatkowe nagłówki (opcjonalne)
      * @returns {Promise} - promise z odpowiedzią
      */
-    async fetchApi(endpoint, method = 'GET', data = null) {
+    async fetchApi(endpoint, method = 'GET', data = null, extraHeaders = {}) {
         const url = `${this.baseUrl}${endpoint}`;
         const options = {
             method,
             headers: {
                 'Content-Type': 'application/json',
-                'Authorization': `Bearer ${this.getAuthToken()}`
+                'Authorization': `Bearer ${this.getAuthToken()}`,
+                ...extraHeaders
             }
         };
 
@@ -33,6 +41,12 @@ class ApiClient {
 
         try {
             const response = await fetch(url, options);
+
+            // Dane się nie zmieniły (If-None-Match) - wywołujący użyje swojej kopii
+            if (response.status === 304) {
+                return { notModified: true, etag: response.headers.get('ETag') };
+            }
+
             const result = await response.json();
 
             if (!response.ok) {
@@ -43,11 +57,12 @@ class ApiClient {
                     localStorage.removeItem('username');
                     window.location.href = 'login.html';
                 }
-                throw new ApiError(result.error || 'Wystąpił błąd podczas komunikacji z API', response.status);
+                throw new ApiError(result.error || 'Wystąpił błąd podczas komunikacji z API', response.status, result);
             }
 
             // Dodajemy informację, czy należy odświeżać interfejs po tej operacji
             result.noRefresh = response.headers.get('X-No-Refresh') === 'true' || result.no_refresh === true;
+            result.etag = response.headers.get('ETag');
 
             return result;
         } catch (error) {
@@ -64,6 +79,64 @@ class ApiClient {
         return this.fetchApi('/api/kiosks');
     }
 
+    /**
+     * Pobiera kompaktową migawkę floty (kolumny, bez haseł) - niezmieniona od ostatniego
+     * pobrania zwraca 304 i listę z pamięci
+     * @returns {Promise} - { kiosks, changed }
+     */
+    async getKioskSnapshot() {
+        const headers = this.fleetSnapshot ? { 'If-None-Match': this.fleetSnapshot.etag } : {};
+        const result = await this.fetchApi('/api/kiosks/snapshot', 'GET', null, headers);
+        if (result.notModified && this.fleetSnapshot) {
+            return { kiosks: this.fleetSnapshot.kiosks, changed: false };
+        }
+        const kiosks = Array.from({ length: result.count }, (_, i) =>
+            Object.fromEntries(result.fields.map(field => [field, result.columns[field][i]]))
+        );
+        if (result.etag) {
+            this.fleetSnapshot = { etag: result.etag, kiosks };
+        }
+        return { kiosks, changed: true };
+    }
+
+    /**
+     * Otwiera strumień zmian stanu kiosków (Server-Sent Events)
+     * @param {object} handlers - { snapshot(kiosks), change(event), reset() }
+     * @returns {EventSource} - otwarte połączenie (close() kończy subskrypcję)
+     */
+    openKioskEvents(handlers) {
+        // EventSource nie pozwala ustawić nagłówka Authorization - token w parametrze zapytania
+        const token = encodeURIComponent(this.getAuthToken() || '');
+        const source = new EventSource(`${this.baseUrl}/api/kiosks/events?token=${token}`);
+        source.addEventListener('snapshot', event => handlers.snapshot(JSON.parse(event.data)));
+        source.addEventListener('kiosk', event => handlers.change(JSON.parse(event.data)));
+        source.addEventListener('reset', () => handlers.reset());
+        return source;
+    }
+
+    /**
+     * Wyszukuje kiosk po stronie serwera (filtry, stronicowanie kursorem, wybór pól)
+     * @param {object} filters - { status, group, tag, q, fields, sort: 'id'|'name'|'last_connection',
+     *                             order: 'asc'|'desc', limit, cursor, include_total } (listy jako tablice lub 'a,b')
+     * @returns {Promise} - promise z { kiosks, next_cursor, total? }
+     */
+    async queryKiosks(filters = {}) {
+        const params = new URLSearchParams();
+        for (const [key, value] of Object.entries(filters)) {
+            if (value === null || value === undefined || value === '') continue;
+            params.append(key, Array.isArray(value) ? value.join(',') : value);
+        }
+        return this.fetchApi(`/api/kiosks/query?${params.toString()}`);
+    }
+
+    async setKioskTags(kioskId, tags) {
+        return this.fetchApi(`/api/kiosks/${kioskId}/tags`, 'PUT', { tags });
+    }
+
+    async getKioskTags() {
+        return this.fetchApi('/api/kiosk-tags');
+    }
+
     async addKiosk(kioskData) {
         return this.fetchApi('/api/kiosks', 'POST', kioskData);
     }
@@ -76,6 +149,27 @@ class ApiClient {
         return this.fetchApi(`/api/kiosks/${kioskId}`, 'DELETE');
     }
 
+    /**
+     * Dostępność kiosku w zakresie czasu
+     * @param {number} kioskId - ID kiosku
+     * @param {string} [start] - początek zakresu (YYYY-MM-DD lub YYYY-MM-DD HH:MM:SS), domyślnie 7 dni temu
+     * @param {string} [end] - koniec zakresu, domyślnie teraz
+     */
+    async getKioskUptime(kioskId, start, end) {
+        const params = new URLSearchParams();
+        if (start) params.set('start', start);
+        if (end) params.set('end', end);
+        return this.fetchApi(`/api/kiosks/${kioskId}/uptime?${params}`);
+    }
+
+    // Dostępność wszystkich kiosków - najczęściej rozłączające się na początku
+    async getFleetUptime(start, end) {
+        const params = new URLSearchParams();
+        if (start) params.set('start', start);
+        if (end) params.set('end', end);
+        return this.fetchApi(`/api/kiosks/uptime?${params}`);
+    }
+
     // Metody dla ustawień
     async getSettings() {
         return this.fetchApi('/api/settings');
@@ -104,6 +198,30 @@ class ApiClient {
 
     async listFtpFiles(connectionData, path = '/home/kiosk/MediaPionowe') {
         const data = { ...connectionData, path };
+        const cacheKey = `${connectionData.hostname}:${connectionData.port || 21}:${connectionData.username}:${path}`;
+        const cached = this.listingCache.get(cacheKey);
+        const headers = cached ? { 'If-None-Match': cached.etag } : {};
+
+        const result = await this.fetchApi('/api/ftp/files', 'POST', data, headers);
+        if (result.notModified && cached) {
+            return cached.files;
+        }
+        if (result.etag) {
+            this.listingCache.set(cacheKey, { etag: result.etag, files: result });
+        }
+        return result;
+    }
+
+    /**
+     * Pobiera stronę listingu katalogu FTP posortowaną i przefiltrowaną po stronie serwera
+     * @param {object} connectionData - dane połączenia FTP
+     * @param {string} path - ścieżka katalogu
+     * @param {object} options - { limit, cursor, sort: 'name'|'size'|'modified', order: 'asc'|'desc',
+     *                             extension, name, is_directory, include_total }
+     * @returns {Promise} - promise z { files, next_cursor, total? }
+     */
+    async listFtpFilesPage(connectionData, path, options = {}) {
+        const data = { ...connectionData, path, limit: 100, ...options };
         return this.fetchApi('/api/ftp/files', 'POST', data);
     }
 
@@ -112,6 +230,80 @@ class ApiClient {
         return this.fetchApi(`/api/kiosks/${kioskId}/ftp-credentials`);
     }
 
+    /**
+     * Harmonogram odtwarzacza (schedule.json) kiosku - kopia serwera, pobierana z kiosku przy braku lub refresh
+     * @param {number} kioskId - ID kiosku
+     * @param {boolean} refresh - wymuś pobranie pliku z kiosku
+     * @returns {Promise} - { version, sha256, schedule, missing_files, fetched_at, published_at }
+     */
+    async getKioskSchedule(kioskId, refresh = false) {
+        return this.fetchApi(`/api/kiosks/${kioskId}/schedule${refresh ? '?refresh=1' : ''}`);
+    }
+
+    /**
+     * Szablony harmonogramów (nazwy plików mogą zawierać {serial} i {id})
+     */
+    async getScheduleTemplates() {
+        return this.fetchApi('/api/schedule-templates');
+    }
+
+    async createScheduleTemplate(name, schedule) {
+        return this.fetchApi('/api/schedule-templates', 'POST', { name, schedule });
+    }
+
+    async updateScheduleTemplate(templateId, fields) {
+        return this.fetchApi(`/api/schedule-templates/${templateId}`, 'PUT', fields);
+    }
+
+    async deleteScheduleTemplate(templateId) {
+        return this.fetchApi(`/api/schedule-templates/${templateId}`, 'DELETE');
+    }
+
+    /**
+     * Grupy kiosków - { name, template_id, kiosk_ids }
+     */
+    async getKioskGroups() {
+        return this.fetchApi('/api/kiosk-groups');
+    }
+
+    async createKioskGroup(group) {
+        return this.fetchApi('/api/kiosk-groups', 'POST', group);
+    }
+
+    async updateKioskGroup(groupId, fields) {
+        return this.fetchApi(`/api/kiosk-groups/${groupId}`, 'PUT', fields);
+    }
+
+    async deleteKioskGroup(groupId) {
+        return this.fetchApi(`/api/kiosk-groups/${groupId}`, 'DELETE');
+    }
+
+    /**
+     * Wdraża szablony na kioski grup (równolegle po stronie serwera, kiosk z aktualnym harmonogramem jest pomijany)
+     * @param {object} options - { group_ids?, kiosk_ids?, template_id?, allow_missing? }
+     * @returns {Promise} - opis wdrożenia (202); postęp przez getScheduleRollout
+     */
+    async startScheduleRollout(options) {
+        return this.fetchApi('/api/schedule-rollouts', 'POST', options);
+    }
+
+    async getScheduleRollout(rolloutId) {
+        return this.fetchApi(`/api/schedule-rollouts/${rolloutId}`);
+    }
+
+    /**
+     * Publikuje harmonogram na kiosku (atomowa podmiana pliku, pomijana przy braku zmian)
+     * @param {number} kioskId - ID kiosku
+     * @param {object} schedule - { "plik": liczba_odtworzeń }
+     * @param {number|null} version - wersja, na której oparto zmiany (409, jeśli w międzyczasie się zmieniła)
+     * @param {boolean} allowMissing - zapisz mimo plików, których nie ma na kiosku
+     */
+    async saveKioskSchedule(kioskId, schedule, version = null, allowMissing = false) {
+        const data = { schedule, allow_missing: allowMissing };
+        if (version !== null && version !== undefined) data.version = version;
+        return this.fetchApi(`/api/kiosks/${kioskId}/schedule`, 'PUT', data);
+    }
+
     // Nowa metoda do przesyłania plików przez FTP
     async uploadFtpFile(connectionData, filePath, fileData, fileName) {
         const data = {
@@ -123,6 +315,143 @@ class ApiClient {
         return this.fetchApi('/api/ftp/upload', 'POST', data);
     }
 
+    /**
+     * Wysyła plik jako surowe bajty w treści żądania (bez base64 w JSON)
+     * @param {string} endpoint - ścieżka endpoint wraz z parametrami
+     * @param {File|Blob} file - plik do przesłania
+     * @param {function} onProgress - opcjonalny callback (wysłane bajty, rozmiar całkowity)
+     * @param {object} headers - dodatkowe nagłówki żądania
+     * @returns {Promise} - promise z odpowiedzią
+     */
+    sendFileStream(endpoint, file, onProgress = null, headers = {}) {
+        return new Promise((resolve, reject) => {
+            // XMLHttpRequest zamiast fetch - udostępnia postęp wysyłania
+            const xhr = new XMLHttpRequest();
+            xhr.open('POST', `${this.baseUrl}${endpoint}`);
+            xhr.setRequestHeader('Authorization', `Bearer ${this.getAuthToken()}`);
+            xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+            Object.entries(headers).forEach(([name, value]) => xhr.setRequestHeader(name, value));
+
+            if (onProgress) {
+                xhr.upload.onprogress = (event) => {
+                    if (event.lengthComputable) {
+                        onProgress(event.loaded, event.total);
+                    }
+                };
+            }
+
+            xhr.onload = () => {
+                let result = {};
+                try {
+                    result = JSON.parse(xhr.responseText);
+                } catch (e) {
+                    // Odpowiedź bez JSON - obsłużona poniżej przez kod statusu
+                }
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    resolve(result);
+                } else {
+                    if (xhr.status === 401) {
+                        localStorage.removeItem('authToken');
+                        localStorage.removeItem('isLoggedIn');
+                        localStorage.removeItem('username');
+                        window.location.href = 'login.html';
+                    }
+                    reject(new ApiError(result.error || 'Wystąpił błąd podczas przesyłania pliku', xhr.status));
+                }
+            };
+            xhr.onerror = () => reject(new ApiError('Błąd sieci', 0));
+
+            xhr.send(file);
+        });
+    }
+
+    /**
+     * Przesyła plik strumieniowo na serwer FTP kiosku
+     * @param {object} connectionData - dane połączenia FTP
+     * @param {string} filePath - katalog docelowy
+     * @param {File|Blob} file - plik do przesłania
+     * @param {string} fileName - nazwa pliku na serwerze
+     * @param {function} onProgress - opcjonalny callback (wysłane bajty, rozmiar całkowity)
+     * @returns {Promise} - promise z odpowiedzią
+     */
+    uploadFtpFileStream(connectionData, filePath, file, fileName, onProgress = null) {
+        const params = new URLSearchParams();
+        params.append('hostname', connectionData.hostname);
+        params.append('port', connectionData.port || 21);
+        params.append('username', connectionData.username);
+        params.append('path', filePath);
+        params.append('file_name', fileName);
+        // Hasło w nagłówku, nie w adresie - adresy trafiają do logów serwera i proxy
+        const headers = { 'X-FTP-Password': encodeURIComponent(connectionData.password) };
+        return this.sendFileStream(`/api/ftp/upload-stream?${params.toString()}`, file, onProgress, headers);
+    }
+
+    /**
+     * Przesyła plik raz do backendu, który rozsyła go równolegle do wielu kiosków
+     * @param {File|Blob} file - plik do rozesłania
+     * @param {string} fileName - nazwa pliku na kioskach
+     * @param {number[]} kioskIds - identyfikatory kiosków
+     * @param {string} filePath - katalog docelowy na kioskach
+     * @param {function} onProgress - opcjonalny callback (wysłane bajty, rozmiar całkowity)
+     * @returns {Promise} - promise z opisem zadania (id, status, wyniki per kiosk)
+     */
+    distributeFile(file, fileName, kioskIds, filePath = '/home/kiosk/MediaPionowe', onProgress = null) {
+        const params = new URLSearchParams();
+        params.append('file_name', fileName);
+        params.append('path', filePath);
+        params.append('kiosk_ids', kioskIds.join(','));
+        return this.sendFileStream(`/api/distribute?${params.toString()}`, file, onProgress);
+    }
+
+    /**
+     * Pobiera stan zadania dystrybucji pliku
+     * @param {string} jobId - identyfikator zadania
+     */
+    async getDistributionJob(jobId) {
+        return this.fetchApi(`/api/distribute/${jobId}`);
+    }
+
+    /**
+     * Pobiera stan zadania z kolejki w tle (operacje wywołane z flagą async)
+     * @param {string} jobId - identyfikator zadania
+     */
+    async getJob(jobId) {
+        return this.fetchApi(`/api/jobs/${jobId}`);
+    }
+
+    /**
+     * Pobiera listę ostatnich zadań w tle
+     * @param {object} filters - opcjonalne filtry: status, type, kiosk, limit
+     */
+    async listJobs(filters = {}) {
+        const query = new URLSearchParams(filters).toString();
+        return this.fetchApi(`/api/jobs${query ? `?${query}` : ''}`);
+    }
+
+    /**
+     * Anuluje zadanie oczekujące w kolejce
+     * @param {string} jobId - identyfikator zadania
+     */
+    async cancelJob(jobId) {
+        return this.fetchApi(`/api/jobs/${jobId}`, 'DELETE');
+    }
+
+    /**
+     * Czeka na zakończenie zadania, odpytując jego stan
+     * @param {string} jobId - identyfikator zadania
+     * @param {number} interval - odstęp między zapytaniami (ms)
+     * @returns {Promise} - promise z końcowym stanem zadania
+     */
+    async waitForJob(jobId, interval = 1000) {
+        for (;;) {
+            const job = await this.getJob(jobId);
+            if (['done', 'error', 'cancelled'].includes(job.status)) {
+                return job;
+            }
+            await new Promise(resolve => setTimeout(resolve, interval));
+        }
+    }
+
     // Nowa metoda do tworzenia katalogów na serwerze FTP
     async createFtpDirectory(connectionData, path, folderName) {
         const data = {
@@ -152,6 +481,27 @@ class ApiClient {
         return this.fetchApi('/api/ftp/delete-multiple', 'POST', data);
     }
 
+    /**
+     * Uruchamia rekurencyjną operację na drzewie katalogów FTP (jako zadanie w tle)
+     * @param {object} connectionData - dane połączenia FTP
+     * @param {'delete'|'copy'|'move'} operation - rodzaj operacji
+     * @param {string} path - ścieżka źródłowa (plik lub katalog)
+     * @param {string} destination - ścieżka docelowa (dla copy/move)
+     * @returns {Promise} - promise z opisem zadania (id, status, postęp)
+     */
+    async startFtpTreeOperation(connectionData, operation, path, destination = null) {
+        const data = { ...connectionData, operation, path, destination };
+        return this.fetchApi('/api/ftp/tree-operation', 'POST', data);
+    }
+
+    /**
+     * Pobiera stan operacji na drzewie katalogów FTP
+     * @param {string} jobId - identyfikator zadania
+     */
+    async getFtpTreeOperation(jobId) {
+        return this.fetchApi(`/api/ftp/tree-operation/${jobId}`);
+    }
+
     // Nowa metoda do pobierania plików przez FTP
     downloadFtpFile(connectionData, filePath) {
         // Tworzymy URL z parametrami, ponieważ będziemy korzystać z otwarcia URL zamiast fetch
@@ -204,14 +554,76 @@ class ApiClient {
     }
 
     /**
-     * Pobiera zawartość pliku z serwera FTP
+     * Wykonuje polecenie SSH na wielu kioskach równolegle
+     * @param {'restart-service'|'rotate-right'|'rotate-normal'} command - nazwa polecenia
+     * @param {number[]} kioskIds - identyfikatory kiosków
+     * @param {function} onResult - callback wywoływany dla każdego kiosku po zakończeniu polecenia
+     * @returns {Promise} - promise z podsumowaniem (total, succeeded, failed)
+     */
+    async bulkKioskCommand(command, kioskIds, onResult = null) {
+        const response = await fetch(`${this.baseUrl}/api/kiosks/bulk-command`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Authorization': `Bearer ${this.getAuthToken()}`
+            },
+            body: JSON.stringify({ command, kiosk_ids: kioskIds })
+        });
+
+        if (!response.ok) {
+            const result = await response.json().catch(() => ({}));
+            throw new ApiError(result.error || 'Wystąpił błąd podczas komunikacji z API', response.status);
+        }
+
+        // Odpowiedź NDJSON - wyniki kolejnych kiosków przychodzą w miarę ich zakończenia
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let summary = null;
+        for (;;) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            for (const line of lines) {
+                if (!line.trim()) {
+                    continue;
+                }
+                const result = JSON.parse(line);
+                if (result.summary) {
+                    summary = result;
+                } else if (onResult) {
+                    onResult(result);
+                }
+            }
+        }
+        return summary;
+    }
+
+    /**
+     * Pobiera zawartość pliku z serwera FTP (niezmieniony plik - 304 i treść z pamięci podręcznej)
      * @param {object} connectionData - dane połączenia FTP
      * @param {string} filePath - ścieżka do pliku
+     * @param {string} encoding - kodowanie pliku (domyślnie utf-8)
      * @returns {Promise} - promise z odpowiedzią zawierającą zawartość pliku
      */
-    async getFileContent(connectionData, filePath) {
-        const data = { ...connectionData, path: filePath };
-        return this.fetchApi('/api/ftp/get-file-content', 'POST', data);
+    async getFileContent(connectionData, filePath, encoding = 'utf-8') {
+        const data = { ...connectionData, path: filePath, encoding };
+        const cacheKey = `${this.fileContentKey(connectionData, filePath)}:${encoding}`;
+        const cached = this.fileContentCache.get(cacheKey);
+        const headers = cached ? { 'If-None-Match': cached.etag } : {};
+
+        const result = await this.fetchApi('/api/ftp/get-file-content', 'POST', data, headers);
+        if (result.notModified && cached) {
+            return cached.result;
+        }
+        if (result.etag) {
+            this.fileContentCache.set(cacheKey, { etag: result.etag, result });
+        }
+        return result;
     }
 
     /**
@@ -219,11 +631,21 @@ class ApiClient {
      * @param {object} connectionData - dane połączenia FTP
      * @param {string} filePath - ścieżka do pliku
      * @param {string} content - zawartość pliku
+     * @param {string} encoding - kodowanie, w jakim plik ma zostać zapisany (domyślnie utf-8)
      * @returns {Promise} - promise z odpowiedzią
      */
-    async putFileContent(connectionData, filePath, content) {
-        const data = { ...connectionData, path: filePath, content };
-        return this.fetchApi('/api/ftp/put-file-content', 'POST', data);
+    async putFileContent(connectionData, filePath, content, encoding = 'utf-8') {
+        const data = { ...connectionData, path: filePath, content, encoding };
+        const result = await this.fetchApi('/api/ftp/put-file-content', 'POST', data);
+        const key = this.fileContentKey(connectionData, filePath);
+        for (const cacheKey of this.fileContentCache.keys()) {
+            if (cacheKey.startsWith(`${key}:`)) this.fileContentCache.delete(cacheKey);
+        }
+        return result;
+    }
+
+    fileContentKey(connectionData, filePath) {
+        return `${connectionData.hostname}:${connectionData.port || 21}:${connectionData.username}:${filePath}`;
     }
 }
 
@@ -231,10 +653,12 @@ class ApiClient {
  * Klasa błędu API
  */
 class ApiError extends Error {
-    constructor(message, statusCode) {
+    constructor(message, statusCode, details = null) {
         super(message);
         this.name = 'ApiError';
         this.statusCode = statusCode;
+        // Pełna treść odpowiedzi błędu (np. missing_files, version)
+        this.details = details;
     }
 }
 
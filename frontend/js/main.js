@@ -15,7 +15,8 @@ let ftp = {
 let selectedKiosk = null;
 let selectedFiles = [];
 let lastActiveSection = 'dashboard'; // Zapamiętaj ostatnio aktywną sekcję
-let kiosksRefreshInterval = null; // Interwał odświeżania listy kiosków
+let kiosksRefreshInterval = null; // Interwał odświeżania listy kiosków (gdy strumień zdarzeń jest niedostępny)
+let kioskEventSource = null; // Strumień zmian stanu kiosków (Server-Sent Events)
 
 // Załaduj konfigurację po załadowaniu DOM
 document.addEventListener('DOMContentLoaded', async function() {
@@ -41,8 +42,8 @@ document.addEventListener('DOMContentLoaded', async function() {
             switchSection(savedSection);
         }
         
-        // Ustaw interwał odświeżania
-        setInterval(refreshData, CONFIG.refreshInterval);
+        // Zmiany stanu kiosków przychodzą ze strumienia zdarzeń zamiast cyklicznego odpytywania
+        subscribeKioskEvents();
     } catch (error) {
         console.error('Błąd podczas inicjalizacji aplikacji:', error);
         
@@ -558,7 +559,7 @@ function loadFtpKiosks() {
         const lastConnLabel = document.createElement('span');
         lastConnLabel.textContent = 'Ostatnie połączenie:';
         const lastConnValue = document.createElement('span');
-        lastConnValue.textContent = kiosk.last_connection ? formatDate(kiosk.last_connection) : 'Nigdy';
+        lastConnValue.textContent = formatLastConnection(kiosk, 'Nigdy');
         lastConnElement.appendChild(lastConnLabel);
         lastConnElement.appendChild(lastConnValue);
         
@@ -910,6 +911,7 @@ async function handleDroppedFiles(files) {
         // Usuń klasę uploading
         if (dropZone) {
             dropZone.classList.remove('uploading');
+            delete dropZone.dataset.progress;
         }
     }
 }
@@ -920,33 +922,26 @@ async function handleDroppedFiles(files) {
  * @returns {Promise} - Promise z wynikiem operacji
  */
 function uploadDroppedFile(file) {
-    return new Promise((resolve, reject) => {
-        // Odczytujemy plik jako base64
-        const reader = new FileReader();
-        
-        reader.onload = async function(event) {
-            try {
-                // Przesyłamy dane pliku wraz z danymi połączenia FTP
-                const result = await api.uploadFtpFile(
-                    ftp.connection,
-                    ftp.currentPath,
-                    event.target.result,
-                    file.name
-                );
-                
-                resolve(result);
-            } catch (error) {
-                reject(error);
-            }
-        };
-        
-        reader.onerror = function(error) {
-            reject(new Error(`Nie można odczytać pliku: ${error}`));
-        };
-        
-        // Rozpocznij odczyt pliku jako URL danych (base64)
-        reader.readAsDataURL(file);
-    });
+    // Plik wysyłany jest strumieniowo, bez odczytu do pamięci jako base64
+    return api.uploadFtpFileStream(
+        ftp.connection,
+        ftp.currentPath,
+        file,
+        file.name,
+        (loaded, total) => showUploadProgress(loaded, total)
+    );
+}
+
+/**
+ * Pokazuje postęp przesyłania w strefie upuszczania plików
+ * @param {number} loaded - liczba wysłanych bajtów
+ * @param {number} total - rozmiar całkowity
+ */
+function showUploadProgress(loaded, total) {
+    const dropZone = document.getElementById('ftp-drop-zone');
+    if (dropZone && total > 0) {
+        dropZone.dataset.progress = `${Math.round(loaded / total * 100)}%`;
+    }
 }
 
 /**
@@ -1273,43 +1268,42 @@ function updateSelectedFiles() {
     }
 }
 
-function uploadFtpFile(file) {
+async function uploadFtpFile(file) {
     // Pokaż powiadomienie o rozpoczęciu przesyłania
     showToast(`Przesyłanie pliku ${file.name} do ${ftp.currentPath}...`, 'info');
     
-    // Odczytujemy plik jako base64
-    const reader = new FileReader();
-    reader.onload = async function(event) {
-        try {
-            // Przesyłamy dane pliku wraz z danymi połączenia FTP
-            const result = await api.uploadFtpFile(
-                ftp.connection,
-                ftp.currentPath,
-                event.target.result,
-                file.name
-            );
-            
-            // Wyświetl komunikat o sukcesie
-            showToast(`Plik ${file.name} został przesłany pomyślnie`, 'success');
-            
-            // Odśwież listę plików
-            loadFtpFiles(ftp.currentPath);
-            
-            // Dodaj informację o aktywności
-            addActivity(`Przesłano plik ${file.name} do ${ftp.currentPath} na kiosku ${selectedKiosk.name || selectedKiosk.id}`);
-        } catch (error) {
-            console.error('Błąd podczas przesyłania pliku:', error);
-            showToast(`Błąd podczas przesyłania pliku: ${error.message}`, 'error');
-        }
-    };
-    
-    reader.onerror = function(error) {
-        console.error('Błąd odczytu pliku:', error);
-        showToast(`Nie można odczytać pliku: ${error}`, 'error');
-    };
+    const dropZone = document.getElementById('ftp-drop-zone');
+    if (dropZone) {
+        dropZone.classList.add('uploading');
+    }
     
-    // Rozpocznij odczyt pliku jako URL danych (base64)
-    reader.readAsDataURL(file);
+    try {
+        // Przesyłamy plik strumieniowo wraz z danymi połączenia FTP
+        await api.uploadFtpFileStream(
+            ftp.connection,
+            ftp.currentPath,
+            file,
+            file.name,
+            (loaded, total) => showUploadProgress(loaded, total)
+        );
+        
+        // Wyświetl komunikat o sukcesie
+        showToast(`Plik ${file.name} został przesłany pomyślnie`, 'success');
+        
+        // Odśwież listę plików
+        loadFtpFiles(ftp.currentPath);
+        
+        // Dodaj informację o aktywności
+        addActivity(`Przesłano plik ${file.name} do ${ftp.currentPath} na kiosku ${selectedKiosk.name || selectedKiosk.id}`);
+    } catch (error) {
+        console.error('Błąd podczas przesyłania pliku:', error);
+        showToast(`Błąd podczas przesyłania pliku: ${error.message}`, 'error');
+    } finally {
+        if (dropZone) {
+            dropZone.classList.remove('uploading');
+            delete dropZone.dataset.progress;
+        }
+    }
 }
 
 /**
@@ -1469,39 +1463,10 @@ function addActivity(action) {
  */
 async function refreshData() {
     try {
-        // Pobierz dane kiosków bez ingerencji w aktywną sekcję
-        const response = await api.getKiosks();
-        
-        // Sprawdź, czy odpowiedź jest w nowym formacie (ma właściwość kiosks i no_refresh)
-        if (response.kiosks && response.no_refresh === true) {
-            // Jeśli tak, to aktualizujemy dane w pamięci bez odświeżania interfejsu
-            kiosksData = response.kiosks;
-            console.log("Odebrano odpowiedź z flagą no_refresh - pomijanie odświeżania UI");
-            return;
-        }
-        
-        // W przeciwnym przypadku traktujemy odpowiedź jako standardową tablicę kiosków
-        const newKiosksData = Array.isArray(response) ? response : (response.kiosks || []);
-        
-        // Sprawdź, czy odpowiedź zawiera flagę noRefresh (dla kompatybilności wstecznej)
-        if (response.noRefresh) {
-            kiosksData = newKiosksData;
-            console.log("Odebrano odpowiedź z flagą noRefresh - pomijanie odświeżania UI");
-            return;
-        }
-        
-        // Sprawdź, czy dane się zmieniły pomijając zmiany IP
-        const dataChangedExcludingIp = hasDataChangedExcludingIp(kiosksData, newKiosksData);
-        
-        // Zaktualizuj dane w pamięci zawsze (by aktualizować IP)
-        kiosksData = newKiosksData;
-        
-        // Aktualizuj interfejs tylko jeśli zmieniło się coś więcej niż IP
-        if (dataChangedExcludingIp) {
-            // Aktualizuj tylko potrzebne elementy DOM bez zmiany aktywnej sekcji
-            updateDashboardStatsOnly();
-            updateKiosksTableOnly();
-            loadFtpKiosksOnly();
+        // Kompaktowa migawka floty - gdy nic się nie zmieniło, serwer odpowiada 304 bez treści
+        const snapshot = await api.getKioskSnapshot();
+        if (snapshot.changed) {
+            applyKiosksData(snapshot.kiosks);
         }
     } catch (error) {
         console.error('Błąd podczas odświeżania danych:', error);
@@ -1509,6 +1474,72 @@ async function refreshData() {
     }
 }
 
+/**
+ * Zapisuje nową listę kiosków i odświeża interfejs, jeśli zmieniło się coś więcej niż IP
+ * @param {Array} newKiosksData - aktualna lista kiosków
+ */
+function applyKiosksData(newKiosksData) {
+    // Sprawdź, czy dane się zmieniły pomijając zmiany IP
+    const dataChangedExcludingIp = hasDataChangedExcludingIp(kiosksData, newKiosksData);
+    
+    // Zaktualizuj dane w pamięci zawsze (by aktualizować IP)
+    kiosksData = newKiosksData;
+    
+    // Aktualizuj interfejs tylko jeśli zmieniło się coś więcej niż IP
+    if (dataChangedExcludingIp) {
+        // Aktualizuj tylko potrzebne elementy DOM bez zmiany aktywnej sekcji
+        updateDashboardStatsOnly();
+        updateKiosksTableOnly();
+        loadFtpKiosksOnly();
+    }
+}
+
+/**
+ * Nakłada zmianę ze strumienia zdarzeń na listę kiosków w pamięci
+ * @param {object} event - { type: 'added' | 'removed' | 'updated' | 'online' | 'offline' | 'ip_changed', id, fields }
+ */
+function applyKioskEvent(event) {
+    let newKiosksData;
+    if (event.type === 'removed') {
+        newKiosksData = kiosksData.filter(kiosk => kiosk.id !== event.id);
+    } else if (event.type === 'added') {
+        newKiosksData = [...kiosksData.filter(kiosk => kiosk.id !== event.id), event.fields];
+    } else {
+        newKiosksData = kiosksData.map(kiosk => kiosk.id === event.id ? { ...kiosk, ...event.fields } : kiosk);
+    }
+    applyKiosksData(newKiosksData);
+}
+
+/**
+ * Subskrybuje zmiany stanu kiosków. Bezczynny panel nie wysyła żadnych zapytań -
+ * serwer przysyła tylko zmiany. Bez obsługi EventSource panel wraca do odpytywania.
+ */
+function subscribeKioskEvents() {
+    if (!window.EventSource) {
+        kiosksRefreshInterval = setInterval(refreshData, CONFIG.refreshInterval);
+        return;
+    }
+    
+    kioskEventSource = api.openKioskEvents({
+        snapshot: kiosks => applyKiosksData(kiosks),
+        change: event => applyKioskEvent(event),
+        reset: () => {
+            // Panel nie nadążał ze zdarzeniami - nowe połączenie zaczyna od pełnej listy
+            kioskEventSource.close();
+            subscribeKioskEvents();
+        }
+    });
+    
+    kioskEventSource.onerror = () => {
+        // Przeglądarka sama ponawia zerwane połączenie; CLOSED oznacza odrzucenie (np. wygasły token)
+        if (kioskEventSource.readyState === EventSource.CLOSED) {
+            kioskEventSource = null;
+            refreshData();
+            kiosksRefreshInterval = setInterval(refreshData, CONFIG.refreshInterval);
+        }
+    };
+}
+
 /**
  * Aktualizuje tylko liczniki na dashboardzie bez ingerencji w resztę UI
  */
@@ -1646,7 +1677,7 @@ function updateKiosksTableOnly() {
         
         // Ostatnie połączenie
         const lastConnCell = document.createElement('td');
-        lastConnCell.textContent = kiosk.last_connection ? formatDate(kiosk.last_connection) : '-';
+        lastConnCell.textContent = formatLastConnection(kiosk, '-');
         row.appendChild(lastConnCell);
         
        // Akcje
@@ -1814,7 +1845,7 @@ function loadFtpKiosksOnly() {
        const lastConnLabel = document.createElement('span');
        lastConnLabel.textContent = 'Ostatnie połączenie:';
        const lastConnValue = document.createElement('span');
-       lastConnValue.textContent = kiosk.last_connection ? formatDate(kiosk.last_connection) : 'Nigdy';
+       lastConnValue.textContent = formatLastConnection(kiosk, 'Nigdy');
        lastConnElement.appendChild(lastConnLabel);
        lastConnElement.appendChild(lastConnValue);
        
@@ -1871,6 +1902,17 @@ function formatDate(dateStr) {
    return date.toLocaleString('pl-PL');
 }
 
+/**
+* Formatuje czas ostatniego połączenia - migawka floty nie podaje go dla kiosków online
+* (łączą się na bieżąco), więc wtedy wyświetlane jest "Teraz"
+*/
+function formatLastConnection(kiosk, fallback) {
+   if (kiosk.last_connection) {
+       return formatDate(kiosk.last_connection);
+   }
+   return kiosk.status === 'online' ? 'Teraz' : fallback;
+}
+
 /**
 * Formatuje rozmiar pliku
 */
@@ -2036,14 +2078,6 @@ function connectVNC(kiosk) {
    }
 }
 
-// Automatyczne odświeżanie listy kiosków co 30 sekund, gdy użytkownik jest w sekcji "kiosks"
-setInterval(() => {
-   const activeSection = localStorage.getItem('activeSection');
-   if (activeSection === 'kiosks') {
-       refreshData();
-   }
-}, 30000);
-
 /**
  * Restartuje usługę na kiosku poprzez SSH
  * @param {object} kiosk - obiekt kiosku
@@ -6,6 +6,7 @@ let playlistFtp = {
     connection: null,
     files: [],
     scheduleData: null,
+    scheduleVersion: null,
     currentKiosk: null,
     isLoading: false
 };
@@ -282,12 +283,8 @@ async function createNewScheduleFile() {
         setPlaylistLoadingStatus(true, 'Tworzenie pliku schedule.json...');
         
         // Tworzymy nowy pusty plik schedule.json
-        const emptySchedule = '{}';
-        await api.putFileContent(
-            playlistFtp.connection,
-            '/schedule.json',
-            emptySchedule
-        );
+        const result = await api.saveKioskSchedule(playlistFtp.currentKiosk.id, {});
+        playlistFtp.scheduleVersion = result.version;
         
         showToast('Plik schedule.json został utworzony', 'success');
         
@@ -307,47 +304,41 @@ async function createNewScheduleFile() {
 /**
  * Ładowanie pliku schedule.json
  */
-async function loadScheduleFile(filePath) {
-    if (!playlistFtp.connection) return;
+async function loadScheduleFile(filePath, refresh = false) {
+    if (!playlistFtp.connection || !playlistFtp.currentKiosk) return;
     
     try {
         setPlaylistLoadingStatus(true, 'Pobieranie pliku schedule.json...');
         
-        // Użyj pełnej ścieżki, dodając / jeśli nie zaczyna się od /
-        const fullPath = filePath.startsWith('/') ? filePath : '/' + filePath;
-        const result = await api.getFileContent(playlistFtp.connection, fullPath);
+        // Harmonogram z kopii serwera (plik z kiosku pobierany tylko, gdy kopii brak lub jest nieaktualna)
+        const result = await api.getKioskSchedule(playlistFtp.currentKiosk.id, refresh);
+        playlistFtp.scheduleData = result.schedule;
+        playlistFtp.scheduleVersion = result.version;
         
-        if (result && result.content) {
-            try {
-                // Parsowanie zawartości JSON
-                const scheduleData = JSON.parse(result.content);
-                playlistFtp.scheduleData = scheduleData;
-                
-                // Wyświetlenie danych w edytorze
-                renderScheduleEditor(scheduleData);
-                
-                console.log('Dane playlisty załadowane:', scheduleData);
-                
-                // Explicite zmień stan ładowania na false po zakończeniu
-                playlistFtp.isLoading = false;
-            } catch (parseError) {
-                console.error('Błąd parsowania JSON:', parseError);
-                showToast('Plik schedule.json zawiera nieprawidłowy format JSON', 'error');
-                
-                // Jeśli plik jest pusty lub nieprawidłowy, inicjalizujemy pusty obiekt
-                playlistFtp.scheduleData = {};
-                renderScheduleEditor({});
-            }
+        // Wyświetlenie danych w edytorze
+        renderScheduleEditor(result.schedule);
+        
+        if (result.missing_files && result.missing_files.length) {
+            showToast('Brak plików na kiosku: ' + result.missing_files.join(', '), 'warning');
+        }
+        
+        // Explicite zmień stan ładowania na false po zakończeniu
+        playlistFtp.isLoading = false;
+    } catch (error) {
+        if (error.statusCode === 404) {
+            // Kiosk nie ma jeszcze pliku schedule.json - komunikat z przyciskiem tworzenia pokazuje checkForScheduleFile
+            playlistFtp.scheduleData = null;
+        } else if (error.statusCode === 422) {
+            showToast(error.message, 'error');
+            // Jeśli plik jest nieprawidłowy, inicjalizujemy pusty obiekt
+            playlistFtp.scheduleData = {};
+            renderScheduleEditor({});
         } else {
-            showToast('Nie udało się pobrać pliku schedule.json', 'error');
+            console.error('Błąd podczas pobierania pliku schedule.json:', error);
+            showToast('Błąd podczas pobierania pliku schedule.json: ' + error.message, 'error');
             // Zresetuj dane, żeby UI wiedział, że nie mamy danych
             playlistFtp.scheduleData = null;
         }
-    } catch (error) {
-        console.error('Błąd podczas pobierania pliku schedule.json:', error);
-        showToast('Błąd podczas pobierania pliku schedule.json: ' + error.message, 'error');
-        // Zresetuj dane, żeby UI wiedział, że nie mamy danych
-        playlistFtp.scheduleData = null;
     } finally {
         // Upewnij się, że stan ładowania jest zawsze wyłączony na koniec
         setPlaylistLoadingStatus(false);
@@ -647,24 +638,37 @@ async function saveScheduleFile() {
             }
         });
         
-        // Zapisz dane do pliku
-        const scheduleContent = JSON.stringify(scheduleData, null, 2);
-        await api.putFileContent(
-            playlistFtp.connection,
-            '/schedule.json',
-            scheduleContent
-        );
+        // Publikacja na kiosku (serwer pomija wysyłkę, jeśli treść się nie zmieniła)
+        const kioskId = playlistFtp.currentKiosk.id;
+        let result;
+        try {
+            result = await api.saveKioskSchedule(kioskId, scheduleData, playlistFtp.scheduleVersion);
+        } catch (error) {
+            const missing = error.statusCode === 422 && error.details && error.details.missing_files;
+            if (!missing || !confirm(`Na kiosku brakuje plików: ${missing.join(', ')}. Zapisać mimo to?`)) {
+                throw error;
+            }
+            result = await api.saveKioskSchedule(kioskId, scheduleData, playlistFtp.scheduleVersion, true);
+        }
         
         // Aktualizuj dane w pamięci
-        playlistFtp.scheduleData = scheduleData;
+        playlistFtp.scheduleData = result.schedule;
+        playlistFtp.scheduleVersion = result.version;
         
-        showToast('Playlista została zapisana', 'success');
+        showToast(result.unchanged ? 'Playlista bez zmian' : 'Playlista została zapisana', 'success');
         
         // Odśwież listę plików
-        await loadPlaylistFiles();
+        if (!result.unchanged) {
+            await loadPlaylistFiles();
+        }
     } catch (error) {
         console.error('Błąd podczas zapisywania playlisty:', error);
-        showToast('Nie udało się zapisać playlisty: ' + error.message, 'error');
+        if (error.statusCode === 409) {
+            showToast('Playlista została w międzyczasie zmieniona - wczytano aktualną wersję', 'error');
+            await loadScheduleFile('schedule.json', true);
+        } else {
+            showToast('Nie udało się zapisać playlisty: ' + error.message, 'error');
+        }
     } finally {
         setPlaylistLoadingStatus(false);
     }